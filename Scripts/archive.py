@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compressed, content-addressed archive of hub logs.
+
+A log is cut into segments on line boundaries chosen from the content
+of the lines (a segment ends after a line whose CRC32 has its low bits
+clear, once it holds at least MIN_SEGMENT bytes, or at MAX_SEGMENT),
+so two logs sharing a prefix, such as successive copies of the hub's
+audio_data.txt, are cut the same way over that prefix. Every segment is
+compressed with zlib and stored once under the SHA-256 of its content:
+
+    objects/ab/abcdef....z
+    manifests/<name>.json   segments of one log in order, with raw
+                            size, line count and data time range
+    sources.json            the last manifest written for every source
+                            file
+
+Adding a log that grew only reads it from the start of its last
+segment, also under a new name (the daily backups of to_git.sh): the
+segments are taken from the last manifest of the same source file, so
+a backup reads what the hub appended since the last one rather than
+the whole history. The file must still hold the first and the last
+segment of that manifest, or it is read again from the start, so a log
+replaced or rewritten from the start (borrar-data.sh, a hub restart)
+is not taken for one that grew. Single segments can be read directly,
+and records() streams the records of an archived log through
+HubLogReader filters.
+
+    python Scripts/archive.py /home/pirate/backup/archivo add \\
+        actividad_2019-04-03/audio_data.txt
+    python Scripts/archive.py /home/pirate/backup/archivo cat \\
+        actividad_2019-04-03/audio_data.txt
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+from hub_log import TIMESTAMP_FIELD, HubLogReader
+
+MIN_SEGMENT = 64 * 1024
+MAX_SEGMENT = 1024 * 1024
+# a boundary after 1 line in 256 past MIN_SEGMENT
+BOUNDARY_MASK = 0xff
+READ_BUFFER = 1 << 20
+
+
+def segments(stream):
+    """(raw bytes, line count, first and last timestamp) of each segment"""
+    lines = []
+    size = 0
+    first = last = None
+    for line in stream:
+        lines.append(line)
+        size += len(line)
+        match = TIMESTAMP_FIELD.search(line)
+        if match is not None:
+            timestamp = float(match.group(1))
+            first = timestamp if first is None else min(first, timestamp)
+            last = timestamp if last is None else max(last, timestamp)
+        if size >= MAX_SEGMENT or (
+                size >= MIN_SEGMENT and
+                zlib.crc32(line) & BOUNDARY_MASK == 0):
+            yield b''.join(lines), len(lines), first, last
+            lines = []
+            size = 0
+            first = last = None
+    if lines:
+        yield b''.join(lines), len(lines), first, last
+
+
+class Archive(object):
+    """
+    A directory of compressed segments shared by the manifests of the
+    logs added to it
+    """
+    def __init__(self, root, level=6):
+        self.root = root
+        self.level = level
+        self.stats = {'segments': 0, 'stored': 0, 'raw': 0,
+                      'compressed': 0}
+
+    def names(self):
+        """names of the archived logs"""
+        found = []
+        top = os.path.join(self.root, 'manifests')
+        for directory, _, files in os.walk(top):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(directory, name)[len(top) + 1:-5]
+                    found.append(path.replace(os.sep, '/'))
+        return sorted(found)
+
+    def manifest(self, name):
+        """manifest of an archived log"""
+        with open(self.__manifest_path(name)) as manifest:
+            return json.load(manifest)
+
+    def add(self, name, path):
+        """
+        archive a log under name; a log archived before, under this or
+        another name, that only grew is read from the start of its last
+        segment
+        """
+        entries = []
+        offset = 0
+        source = os.path.abspath(path)
+        sources = self.__sources()
+        previous = name if os.path.exists(self.__manifest_path(name)) \
+            else sources.get(source)
+        if previous is not None and \
+                os.path.exists(self.__manifest_path(previous)):
+            entries = self.manifest(previous)['segments']
+            offset = self.__resume(entries, path)
+        with open(path, 'rb', READ_BUFFER) as log:
+            log.seek(offset)
+            for raw, lines, first, last in segments(log):
+                digest = hashlib.sha256(raw).hexdigest()
+                self.__store(digest, raw)
+                entries.append({'sha256': digest, 'size': len(raw),
+                                'lines': lines, 'first': first,
+                                'last': last})
+        self.__save_manifest(name, {'segments': entries,
+                                    'size': sum(entry['size']
+                                                for entry in entries)})
+        sources[source] = name
+        self.__save_json(os.path.join(self.root, 'sources.json'), sources)
+        return entries
+
+    def segment(self, name, number):
+        """raw bytes of one segment of an archived log"""
+        return self.read_object(self.manifest(name)['segments'][number]
+                                ['sha256'])
+
+    def read_object(self, digest):
+        with open(self.__object_path(digest), 'rb') as stored:
+            return zlib.decompress(stored.read())
+
+    def lines(self, name, start=None, end=None):
+        """
+        raw lines of an archived log; with start or end only from the
+        segments whose time range meets [start, end)
+        """
+        for entry in self.manifest(name)['segments']:
+            if start is not None and entry['last'] is not None and \
+                    entry['last'] < start:
+                continue
+            if end is not None and entry['first'] is not None and \
+                    entry['first'] >= end:
+                continue
+            raw = self.read_object(entry['sha256'])
+            for line in raw.splitlines(True):
+                yield line
+
+    def records(self, name, **filters):
+        """records of an archived log, see HubLogReader for the filters"""
+        reader = HubLogReader(None, **filters)
+        return reader.records(self.lines(name, filters.get('start'),
+                                         filters.get('end')))
+
+    def __resume(self, entries, path):
+        """
+        drop the last segment (it may have been cut by the end of the
+        file) if the file still holds it and the first one, and return
+        where it started; start over for a file that changed
+        """
+        start = sum(entry['size'] for entry in entries[:-1])
+        if entries and os.path.getsize(path) >= start + entries[-1]['size']:
+            with open(path, 'rb') as log:
+                if self.__holds(log, 0, entries[0]) and \
+                        self.__holds(log, start, entries[-1]):
+                    del entries[-1]
+                    return start
+        del entries[:]
+        return 0
+
+    @staticmethod
+    def __holds(log, offset, entry):
+        """True if an open log holds the segment of entry at offset"""
+        log.seek(offset)
+        raw = log.read(entry['size'])
+        return hashlib.sha256(raw).hexdigest() == entry['sha256']
+
+    def __store(self, digest, raw):
+        self.stats['segments'] += 1
+        self.stats['raw'] += len(raw)
+        path = self.__object_path(digest)
+        if os.path.exists(path):
+            return
+        data = zlib.compress(raw, self.level)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'wb') as stored:
+            stored.write(data)
+            stored.flush()
+            os.fsync(stored.fileno())
+        os.rename(path + '.tmp', path)
+        self.stats['stored'] += 1
+        self.stats['compressed'] += len(data)
+
+    def __object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.z')
+
+    def __manifest_path(self, name):
+        return os.path.join(self.root, 'manifests',
+                            *name.split('/')) + '.json'
+
+    def __sources(self):
+        path = os.path.join(self.root, 'sources.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as stored:
+            return json.load(stored)
+
+    def __save_manifest(self, name, manifest):
+        self.__save_json(self.__manifest_path(name), manifest)
+
+    @staticmethod
+    def __save_json(path, value):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'w') as stored:
+            json.dump(value, stored, indent=1, sort_keys=True)
+            stored.flush()
+            os.fsync(stored.fileno())
+        os.rename(path + '.tmp', path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hub log archive')
+    parser.add_argument('archive', help='archive directory')
+    commands = parser.add_subparsers(dest='command')
+    add = commands.add_parser('add', help='archive logs (their relative '
+                              'path is their name)')
+    add.add_argument('logs', nargs='+')
+    add.add_argument('--prefix', help='archive the logs as '
+                     'PREFIX/<file name> instead')
+    add.add_argument('--level', type=int, default=6,
+                     help='zlib compression level')
+    cat = commands.add_parser('cat', help='write an archived log to stdout')
+    cat.add_argument('name')
+    cat.add_argument('--segment', type=int, help='only this segment')
+    commands.add_parser('ls', help='list the archived logs')
+    args = parser.parse_args()
+    if args.command == 'add':
+        archive = Archive(args.archive, args.level)
+        for path in args.logs:
+            name = os.path.normpath(path).replace(os.sep, '/')
+            if args.prefix:
+                name = args.prefix + '/' + os.path.basename(path)
+            archive.add(name, path)
+        stats = archive.stats
+        print("{0} segments read, {1} new: {2} raw bytes, {3} stored".format(
+            stats['segments'], stats['stored'], stats['raw'],
+            stats['compressed']))
+    elif args.command == 'cat':
+        archive = Archive(args.archive)
+        output = getattr(sys.stdout, 'buffer', sys.stdout)
+        if args.segment is not None:
+            output.write(archive.segment(args.name, args.segment))
+        else:
+            for line in archive.lines(args.name):
+                output.write(line)
+    elif args.command == 'ls':
+        archive = Archive(args.archive)
+        for name in archive.names():
+            manifest = archive.manifest(name)
+            print("{0:<48} {1:>12} bytes {2:>6} segments".format(
+                name, manifest['size'], len(manifest['segments'])))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Deduplication of the audio chunks re-sent by the hub.
+
+The hub sends a chunk again, with more samples, while the badge keeps
+filling it, e.g. F2:1E:84:04:C5:B5 @ 1554299803.642 arrives with 2
+samples and then with 114. Concatenating the chunks as they arrive
+counts such samples twice. ChunkMerger keys the chunks by badge and
+chunk timestamp, keeps the longest version of each (the most recent one
+when equally long), cuts what overlaps the samples already given for
+the badge and gives the chunks of every badge in time order, as one
+continuous stream.
+
+It works in a single pass: a chunk is held until the newest data of its
+badge is more than `horizon` seconds past its end, and only the spans
+given within the last horizon are remembered, so memory depends on the
+horizon and the number of badges, not on the length of the log.
+
+    python Scripts/audio_merge.py actividad_2019-04-32/audio_data.txt \\
+        --output merged_audio_data.txt
+"""
+import argparse
+import bisect
+import collections
+import json
+
+from hub_log import AUDIO, HubLogReader, audio_record
+
+
+def chunk_end(chunk):
+    """time just after the last sample of a chunk"""
+    return chunk.timestamp + len(chunk.samples) * \
+        (chunk.sample_period or 0) / 1000.0
+
+
+class ChunkMerger(object):
+    """
+    Merge audio chunks into per-badge sample streams. add() takes the
+    chunks in arrival order and returns those that are final; flush()
+    returns the rest at the end of the input. stats counts chunks,
+    samples and log bytes read, given and discarded as duplicates
+    (bytes are those of the log lines of chunks dropped entirely), and
+    the chunks that arrived too late to be checked against all the
+    samples given before.
+    """
+    def __init__(self, horizon=120.0):
+        self.horizon = horizon
+        self.pending = {}
+        self.newest = {}
+        self.given = {}
+        self.stats = collections.Counter()
+
+    def add(self, chunk, size=0):
+        """take a chunk and its log line size"""
+        badge = chunk.badge_address.upper()
+        self.stats['chunks_read'] += 1
+        self.stats['samples_read'] += len(chunk.samples)
+        self.stats['bytes_read'] += size
+        key = int(round(chunk.timestamp * 1000))
+        pending = self.pending.setdefault(badge, {})
+        held = pending.get(key)
+        if held is None:
+            pending[key] = (chunk, size)
+        elif self.__better(chunk, held[0]):
+            pending[key] = (chunk, size)
+            self.__discard(*held)
+        else:
+            self.__discard(chunk, size)
+        newest = max(self.newest.get(badge, chunk_end(chunk)),
+                     chunk_end(chunk))
+        self.newest[badge] = newest
+        if chunk_end(chunk) < newest - self.horizon:
+            self.stats['late_chunks'] += 1
+        return self.__release(badge, newest - self.horizon)
+
+    def flush(self):
+        """all chunks still held, badge by badge"""
+        released = []
+        for badge in sorted(self.pending):
+            released.extend(self.__release(badge, float('inf')))
+        return released
+
+    def merge(self, chunks):
+        """generator over the merged stream of (chunk, size) pairs"""
+        for chunk, size in chunks:
+            for merged in self.add(chunk, size):
+                yield merged
+        for merged in self.flush():
+            yield merged
+
+    def __release(self, badge, watermark):
+        pending = self.pending[badge]
+        ready = sorted(key for key, (chunk, size) in pending.items()
+                       if chunk_end(chunk) < watermark)
+        released = []
+        for key in ready:
+            chunk, size = pending.pop(key)
+            chunk = self.__trim(badge, chunk, size)
+            if chunk is not None:
+                released.append(chunk)
+        given = self.given.get(badge, [])
+        while given and given[0][1] < watermark - self.horizon:
+            given.pop(0)
+        return released
+
+    def __trim(self, badge, chunk, size):
+        """cut the samples already given; None if nothing is left"""
+        period = (chunk.sample_period or 0) / 1000.0
+        count = len(chunk.samples)
+        given = self.given.setdefault(badge, [])
+        start = chunk.timestamp
+        end = chunk_end(chunk)
+        if period:
+            slack = period / 2
+            for given_start, given_end in given:
+                if given_end <= start + slack or given_start >= end - slack:
+                    continue
+                if given_start <= start + slack:
+                    start = max(start, given_end)
+                else:
+                    end = min(end, given_start)
+            first = max(0, int(round((start - chunk.timestamp) / period)))
+            last = min(count, int(round((end - chunk.timestamp) / period)))
+        else:
+            first, last = 0, count
+        if last <= first:
+            self.__discard(chunk, size)
+            return None
+        if first or last < count:
+            self.stats['samples_discarded'] += count - (last - first)
+            chunk = chunk._replace(
+                timestamp=chunk.timestamp + first * period,
+                samples=chunk.samples[first:last], num_samples=last - first)
+        bisect.insort(given, (chunk.timestamp, chunk_end(chunk)))
+        self.stats['chunks_given'] += 1
+        self.stats['samples_given'] += len(chunk.samples)
+        return chunk
+
+    def __discard(self, chunk, size):
+        self.stats['chunks_discarded'] += 1
+        self.stats['samples_discarded'] += len(chunk.samples)
+        self.stats['bytes_discarded'] += size
+
+    @staticmethod
+    def __better(chunk, held):
+        """longer wins, then the one received last"""
+        if len(chunk.samples) != len(held.samples):
+            return len(chunk.samples) > len(held.samples)
+        return (chunk.log_timestamp or 0) >= (held.log_timestamp or 0)
+
+
+def read_chunks(path):
+    """(chunk, line size) pairs of the audio chunks of a hub log"""
+    reader = HubLogReader(path, types=[AUDIO])
+    for chunk in reader:
+        if chunk.badge_address:
+            yield chunk, reader.line_size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='merge re-sent audio chunks of hub logs')
+    parser.add_argument('logs', nargs='+', help='audio_data.txt files')
+    parser.add_argument('--horizon', type=float, default=120.0,
+                        help='seconds a chunk is held for later versions')
+    parser.add_argument('--output', help='write the merged chunks to this '
+                        'file in the hub log format')
+    args = parser.parse_args()
+    merger = ChunkMerger(args.horizon)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for path in args.logs:
+            for chunk in merger.merge(read_chunks(path)):
+                if output is not None:
+                    output.write(json.dumps(audio_record(chunk)) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    for key, value in sorted(merger.stats.items()):
+        print("{0:<18} {1:>12}".format(key, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Columnar store for the audio samples of hub logs.
+
+Every badge gets a directory with two append-only files:
+
+    samples.u8 (.i16, .i32)      all its samples, one after the other,
+                                 as uint8 while every value fits, then
+                                 as int16 or int32 once one does not
+    chunks.idx                   one CHUNK_FORMAT record per chunk:
+                                 timestamp, position of its first sample
+                                 in the samples file, number of samples,
+                                 sample period (ms), voltage, member id
+
+store.json records how far each source log has been converted and how
+many samples and chunks of each badge are committed, so conversion is
+incremental (only the lines appended since the last run are read) and
+anything written after the last commit is cut off on the next run.
+When the samples are widened the narrower file is kept until store.json
+names the wider one. Chunks with samples that are not integers or do
+not fit int32 are skipped. Conversion only needs the standard library;
+reading maps the files as NumPy arrays without copying them.
+
+Badges are told apart by their MAC as a 48-bit integer, and named in
+store.json and on disk by its canonical form (AA:BB:CC:DD:EE:FF), so
+however a log spells a MAC its chunks go to the same files. Given a
+roster (see badge_registry.py), the member id of every chunk is looked
+up by that integer, so chunks a badge sent with a stale or missing
+member id are stored under the member it is registered to.
+
+    python Scripts/audio_store.py store actividad_2019-04-32/audio_data.txt \\
+        --roster badges_to_load.csv
+"""
+import argparse
+import json
+import os
+import struct
+from array import array
+
+from badge_registry import BadgeRegistry, int_to_mac, mac_to_int
+from hub_log import AUDIO, HubLogReader
+
+CHUNK_FORMAT = '<dQIHfi'
+CHUNK_SIZE = struct.calcsize(CHUNK_FORMAT)
+CHUNK_FIELDS = ['timestamp', 'offset', 'count', 'period', 'voltage',
+                'member_id']
+SAMPLE_TYPES = {'u8': ('B', 'uint8'), 'i16': ('h', 'int16'),
+                'i32': ('i', 'int32')}
+WIDER = {'u8': 'i16', 'i16': 'i32'}
+
+
+def canonical_badge(badge_address):
+    """the MAC of a badge as store.json names it, however it is written"""
+    return int_to_mac(mac_to_int(badge_address))
+
+
+def badge_dir(badge_address):
+    """directory name of a badge"""
+    return canonical_badge(badge_address).replace(':', '-')
+
+
+class BadgeWriter(object):
+    """appends the chunks of one badge"""
+    def __init__(self, path, committed):
+        self.path = path
+        self.sample_type = committed.get('type', 'u8')
+        self.samples = committed.get('samples', 0)
+        self.chunks = committed.get('chunks', 0)
+        # narrower sample files to delete once the state is saved
+        self.replaced = [os.path.join(path, 'samples.' + sample_type)
+                         for sample_type in SAMPLE_TYPES
+                         if sample_type != self.sample_type]
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.sample_file = self.__open(self.sample_path(),
+                                       self.samples * self.item_size())
+        self.index_file = self.__open(os.path.join(path, 'chunks.idx'),
+                                      self.chunks * CHUNK_SIZE)
+
+    def sample_path(self):
+        return os.path.join(self.path, 'samples.' + self.sample_type)
+
+    def item_size(self):
+        return array(SAMPLE_TYPES[self.sample_type][0]).itemsize
+
+    def append(self, chunk):
+        """
+        write the samples and the index record of a chunk, widening the
+        samples file as needed; ValueError if they do not fit any type
+        """
+        sample_type = self.sample_type
+        while True:
+            try:
+                samples = array(SAMPLE_TYPES[sample_type][0], chunk.samples)
+            except OverflowError:
+                if sample_type not in WIDER:
+                    raise ValueError("sample out of the int32 range")
+                sample_type = WIDER[sample_type]
+            except TypeError:
+                raise ValueError("samples are not integers")
+            else:
+                break
+        if sample_type != self.sample_type:
+            self.__widen(sample_type)
+        samples.tofile(self.sample_file)
+        self.index_file.write(struct.pack(
+            CHUNK_FORMAT, chunk.timestamp, self.samples, len(samples),
+            chunk.sample_period or 0, chunk.voltage or 0.0,
+            chunk.member_id if chunk.member_id is not None else -1))
+        self.samples += len(samples)
+        self.chunks += 1
+
+    def commit(self):
+        """flush the files and return the committed sizes"""
+        for stream in (self.sample_file, self.index_file):
+            stream.flush()
+            os.fsync(stream.fileno())
+        return {'type': self.sample_type, 'samples': self.samples,
+                'chunks': self.chunks}
+
+    def close(self):
+        self.sample_file.close()
+        self.index_file.close()
+
+    def remove_replaced(self):
+        """
+        delete the narrower sample files, once the state naming the
+        current type has been saved
+        """
+        for path in self.replaced:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.replaced = []
+
+    def __widen(self, sample_type):
+        """
+        rewrite the samples as a wider type into a new file; the old
+        one stays until the state has been saved (see remove_replaced)
+        """
+        self.sample_file.close()
+        old_path = self.sample_path()
+        with open(old_path, 'rb') as old:
+            samples = array(SAMPLE_TYPES[self.sample_type][0])
+            samples.frombytes(old.read(self.samples * self.item_size()))
+        self.sample_type = sample_type
+        self.replaced = [os.path.join(self.path, 'samples.' + other)
+                         for other in SAMPLE_TYPES if other != sample_type]
+        with open(self.sample_path() + '.tmp', 'wb') as new:
+            array(SAMPLE_TYPES[sample_type][0], samples).tofile(new)
+            new.flush()
+            os.fsync(new.fileno())
+        os.rename(self.sample_path() + '.tmp', self.sample_path())
+        self.sample_file = self.__open(self.sample_path(),
+                                       self.samples * self.item_size())
+
+    @staticmethod
+    def __open(path, size):
+        """open for appending after cutting off uncommitted data"""
+        stream = open(path, 'ab')
+        stream.truncate(size)
+        stream.seek(size)
+        return stream
+
+
+class AudioStore(object):
+    """
+    Audio samples of many badges in one directory. ingest() converts
+    the new part of a hub log, taking the member ids from registry (a
+    BadgeRegistry) for the badges it knows; samples(), chunks() and
+    slice() read the converted data through memory maps.
+    """
+    def __init__(self, root, registry=None):
+        self.root = root
+        self.registry = registry
+        self.state_path = os.path.join(root, 'store.json')
+        self.state = {'sources': {}, 'badges': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state:
+                self.state = json.load(state)
+        self.maps = {}
+
+    def badges(self):
+        """badge addresses in the store"""
+        return sorted(self.state['badges'])
+
+    def ingest(self, log_path):
+        """
+        convert the audio chunks appended to a hub log since the last
+        call; returns the number of chunks added
+        """
+        source = os.path.abspath(log_path)
+        reader = HubLogReader(log_path, types=[AUDIO],
+                              offset=self.state['sources'].get(source, 0))
+        # MAC integer -> BadgeWriter
+        writers = {}
+        added = 0
+        try:
+            for chunk in reader:
+                try:
+                    mac = mac_to_int(chunk.badge_address)
+                except (AttributeError, ValueError):
+                    reader.stats['malformed'] += 1
+                    continue
+                writer = writers.get(mac)
+                if writer is None:
+                    badge = int_to_mac(mac)
+                    writer = writers[mac] = BadgeWriter(
+                        os.path.join(self.root, badge_dir(badge)),
+                        self.state['badges'].get(badge, {}))
+                if self.registry is not None:
+                    member_id = self.registry.member_id(mac)
+                    if member_id is not None:
+                        chunk = chunk._replace(member_id=member_id)
+                try:
+                    writer.append(chunk)
+                except ValueError:
+                    reader.stats['malformed'] += 1
+                    continue
+                added += 1
+            for mac, writer in writers.items():
+                self.state['badges'][int_to_mac(mac)] = writer.commit()
+            self.state['sources'][source] = reader.offset
+            self.__save_state()
+            for writer in writers.values():
+                writer.remove_replaced()
+        finally:
+            for writer in writers.values():
+                writer.close()
+        self.maps = {}
+        return added
+
+    def chunk_index(self, badge_address):
+        """
+        the chunk records of a badge in arrival order, as a NumPy
+        structured array mapped from chunks.idx
+        """
+        return self.__mapped(badge_address)[0]
+
+    def samples(self, badge_address):
+        """all samples of a badge as a NumPy array mapped from disk"""
+        return self.__mapped(badge_address)[1]
+
+    def chunks(self, badge_address, start=None, end=None):
+        """
+        (timestamp, sample period in seconds, samples) of the chunks of
+        a badge overlapping [start, end) in time order; the samples are
+        views of the mapped file trimmed to the range
+        """
+        import numpy
+        index, samples, order, reach = self.__mapped(badge_address)
+        first = 0
+        if start is not None:
+            # the first chunk in time order that an earlier or the same
+            # chunk reaches past start
+            first = int(numpy.searchsorted(reach, start, side='right'))
+        for pos in range(first, len(order)):
+            chunk = index[order[pos]]
+            timestamp = float(chunk['timestamp'])
+            if end is not None and timestamp >= end:
+                break
+            period = chunk['period'] / 1000.0
+            lo = int(chunk['offset'])
+            hi = lo + int(chunk['count'])
+            if start is not None and timestamp < start:
+                if not period:
+                    continue
+                lo += int(numpy.ceil((start - timestamp) / period))
+                timestamp += (lo - int(chunk['offset'])) * period
+            if end is not None and period:
+                hi = min(hi, lo + max(0, int(numpy.ceil(
+                    (end - timestamp) / period))))
+            if lo < hi:
+                yield timestamp, period, samples[lo:hi]
+
+    def slice(self, badge_address, start, end):
+        """
+        sample times and values of a badge in [start, end) as two
+        NumPy arrays
+        """
+        import numpy
+        times = []
+        values = []
+        for timestamp, period, chunk in self.chunks(badge_address, start,
+                                                    end):
+            times.append(timestamp + period * numpy.arange(len(chunk)))
+            values.append(chunk)
+        if not values:
+            return numpy.empty(0), numpy.empty(0, self.samples(
+                badge_address).dtype)
+        return numpy.concatenate(times), numpy.concatenate(values)
+
+    def __mapped(self, badge_address):
+        import numpy
+        badge = canonical_badge(badge_address)
+        if badge not in self.maps:
+            committed = self.state['badges'][badge]
+            path = os.path.join(self.root, badge_dir(badge))
+            chunk_type = numpy.dtype({
+                'names': CHUNK_FIELDS,
+                'formats': ['<f8', '<u8', '<u4', '<u2', '<f4', '<i4']})
+            index = self.__map(os.path.join(path, 'chunks.idx'), chunk_type,
+                               committed['chunks'])
+            samples = self.__map(
+                os.path.join(path, 'samples.' + committed['type']),
+                numpy.dtype(SAMPLE_TYPES[committed['type']][1]),
+                committed['samples'])
+            order = numpy.argsort(index['timestamp'], kind='stable')
+            ends = index['timestamp'][order] + \
+                index['count'][order] * (index['period'][order] / 1000.0)
+            reach = numpy.maximum.accumulate(ends) if len(ends) else ends
+            self.maps[badge] = index, samples, order, reach
+        return self.maps[badge]
+
+    @staticmethod
+    def __map(path, dtype, count):
+        import numpy
+        if not count:
+            return numpy.empty(0, dtype)
+        return numpy.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def __save_state(self):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        with open(self.state_path + '.tmp', 'w') as state:
+            json.dump(self.state, state, sort_keys=True)
+            state.flush()
+            os.fsync(state.fileno())
+        os.rename(self.state_path + '.tmp', self.state_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='convert hub audio logs into a columnar store')
+    parser.add_argument('store', help='store directory')
+    parser.add_argument('logs', nargs='+', help='audio_data.txt files')
+    parser.add_argument('--roster', action='append', default=[],
+                        help='badges_to_load file to take the member ids '
+                        'from')
+    args = parser.parse_args()
+    registry = BadgeRegistry.load(*args.roster) if args.roster else None
+    store = AudioStore(args.store, registry)
+    for path in args.logs:
+        print("{0}: {1} chunks added".format(path, store.ingest(path)))
+    for badge in store.badges():
+        committed = store.state['badges'][badge]
+        print("  {0} {1:>6} chunks {2:>9} samples ({3})".format(
+            badge, committed['chunks'], committed['samples'],
+            committed['type']))
+
+
+if __name__ == '__main__':
+    main()
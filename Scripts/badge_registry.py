@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Badge roster loaded from the badges_to_load files.
+
+The same roster comes in three layouts, all handled here:
+
+    badges_to_load.csv        MAC,member_id,project,email (UTF-8 BOM)
+    badges_to_load.txt        the same, tab separated, CRLF
+    badges_to_load_final.txt  tab separated, a number in place of the
+                              project
+
+MAC addresses are kept as 48-bit integers and member ids as integers in
+arrays, with two open-addressing hash tables (also arrays) mapping a
+MAC or a member id to its row, so lookups are O(1) integer probes and
+a badge takes about 50 bytes (the 42 badges of the roster, 2 KB).
+
+    python Scripts/badge_registry.py badges_to_load*.csv badges_to_load*.txt
+"""
+import argparse
+import io
+from array import array
+
+EMPTY = -1
+
+
+def mac_to_int(address):
+    """48-bit integer of a MAC address such as CB:F3:EB:7C:75:69"""
+    value = int(address.replace(':', '').replace('-', ''), 16)
+    if value >> 48:
+        raise ValueError("not a MAC address: " + address)
+    return value
+
+
+def int_to_mac(value):
+    """MAC address string of a 48-bit integer"""
+    text = '{0:012X}'.format(value)
+    return ':'.join(text[pos:pos + 2] for pos in range(0, 12, 2))
+
+
+class IntTable(object):
+    """
+    Open-addressing (linear probing) hash table from non-negative
+    integers to row numbers, kept in two arrays
+    """
+    def __init__(self, capacity=8):
+        bits = 3
+        while 1 << bits < capacity * 4 // 3 + 1:
+            bits += 1
+        size = 1 << bits
+        self.shift = 64 - bits
+        self.mask = size - 1
+        self.keys = array('q', [EMPTY]) * size
+        self.rows = array('i', [EMPTY]) * size
+        self.used = 0
+
+    def get(self, key):
+        """row of key or None"""
+        slot = self.__slot(key)
+        while True:
+            stored = self.keys[slot]
+            if stored == key:
+                return self.rows[slot]
+            if stored == EMPTY:
+                return None
+            slot = (slot + 1) & self.mask
+
+    def put(self, key, row):
+        """map key to row"""
+        # keep the load factor under 3/4
+        if (self.used + 1) * 4 > (self.mask + 1) * 3:
+            self.__grow()
+        slot = self.__slot(key)
+        while self.keys[slot] not in (EMPTY, key):
+            slot = (slot + 1) & self.mask
+        if self.keys[slot] == EMPTY:
+            self.used += 1
+        self.keys[slot] = key
+        self.rows[slot] = row
+
+    def nbytes(self):
+        return (len(self.keys) * self.keys.itemsize +
+                len(self.rows) * self.rows.itemsize)
+
+    def __slot(self, key):
+        # Fibonacci hashing spreads MACs sharing their vendor prefix
+        return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> \
+            self.shift
+
+    def __grow(self):
+        keys, rows = self.keys, self.rows
+        self.__init__(self.used * 3 // 2 + 1)
+        for key, row in zip(keys, rows):
+            if key != EMPTY:
+                self.put(key, row)
+
+
+class BadgeRegistry(object):
+    """
+    MAC address, member id, project and email of every badge. The
+    project is the third column of the roster (a name or a number).
+    """
+    def __init__(self):
+        self.macs = array('q')
+        self.member_ids = array('i')
+        self.project_ids = array('H')
+        self.email_ids = array('H')
+        self.projects = []
+        self.emails = []
+        self.by_mac = IntTable()
+        self.by_member = IntTable()
+        self.__interned = {}
+
+    @classmethod
+    def load(cls, *paths):
+        """registry holding the badges of all given roster files"""
+        registry = cls()
+        for path in paths:
+            registry.read(path)
+        return registry
+
+    def read(self, path):
+        """add the badges of a roster file in any of the three layouts"""
+        with io.open(path, encoding='utf-8-sig') as roster:
+            for number, line in enumerate(roster, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                fields = [field.strip() for field in
+                          line.split('\t' if '\t' in line else ',')]
+                if len(fields) < 2:
+                    raise ValueError("{0}:{1}: expected at least a MAC "
+                                     "and a member id".format(path, number))
+                try:
+                    self.add(fields[0], int(fields[1]),
+                             fields[2] if len(fields) > 2 else '',
+                             fields[3] if len(fields) > 3 else '')
+                except ValueError as err:
+                    raise ValueError("{0}:{1}: {2}".format(path, number,
+                                                           err))
+
+    def add(self, address, member_id, project='', email=''):
+        """
+        add a badge; a badge already known with the same member id is
+        kept, a conflicting one is an error
+        """
+        mac = mac_to_int(address) if not isinstance(address, int) \
+            else address
+        row = self.by_mac.get(mac)
+        if row is not None:
+            if self.member_ids[row] != member_id:
+                raise ValueError("{0} is member {1}, not {2}".format(
+                    int_to_mac(mac), self.member_ids[row], member_id))
+            return row
+        if self.by_member.get(member_id) is not None:
+            raise ValueError("member {0} already has badge {1}".format(
+                member_id, self.mac_address(member_id)))
+        row = len(self.macs)
+        self.macs.append(mac)
+        self.member_ids.append(member_id)
+        self.project_ids.append(self.__intern(self.projects, project))
+        self.email_ids.append(self.__intern(self.emails, email))
+        self.by_mac.put(mac, row)
+        self.by_member.put(member_id, row)
+        return row
+
+    def __len__(self):
+        return len(self.macs)
+
+    def member_id(self, address):
+        """member id of a badge given as MAC string or integer, or None"""
+        if not isinstance(address, int):
+            address = mac_to_int(address)
+        row = self.by_mac.get(address)
+        return None if row is None else self.member_ids[row]
+
+    def mac(self, member_id):
+        """MAC of a member as integer, or None"""
+        row = self.by_member.get(int(member_id))
+        return None if row is None else self.macs[row]
+
+    def mac_address(self, member_id):
+        """MAC of a member as string, or None"""
+        mac = self.mac(member_id)
+        return None if mac is None else int_to_mac(mac)
+
+    def project(self, member_id):
+        row = self.by_member.get(int(member_id))
+        return None if row is None else self.projects[self.project_ids[row]]
+
+    def email(self, member_id):
+        row = self.by_member.get(int(member_id))
+        return None if row is None else self.emails[self.email_ids[row]]
+
+    def nbytes(self):
+        """bytes taken by the arrays"""
+        columns = (self.macs, self.member_ids, self.project_ids,
+                   self.email_ids)
+        return sum(len(column) * column.itemsize for column in columns) + \
+            self.by_mac.nbytes() + self.by_member.nbytes()
+
+    def __intern(self, values, value):
+        key = (id(values), value)
+        if key not in self.__interned:
+            self.__interned[key] = len(values)
+            values.append(value)
+        return self.__interned[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load badge rosters')
+    parser.add_argument('rosters', nargs='+', help='badges_to_load files')
+    args = parser.parse_args()
+    registry = BadgeRegistry.load(*args.rosters)
+    print("{0} badges, {1} bytes of arrays".format(
+        len(registry), registry.nbytes()))
+    for row in range(len(registry)):
+        member_id = registry.member_ids[row]
+        print("  {0} {1:>6} {2:<6} {3}".format(
+            int_to_mac(registry.macs[row]), member_id,
+            registry.project(member_id), registry.email(member_id)))
+
+
+if __name__ == '__main__':
+    main()
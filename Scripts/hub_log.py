@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming reader for the logs written by the openbadge hub
+(audio_data.txt and proximity_data.txt in an activity directory).
+
+The hub appends one JSON object per line:
+
+    {"type": "audio received", "log_timestamp": ..., "log_index": -1,
+     "data": {"member": ..., "badge_address": ..., "member_id": ...,
+              "timestamp": ..., "voltage": ..., "sample_period": 50,
+              "num_samples": ..., "samples": [...]}}
+    {"type": "proximity received", ...,
+     "data": {..., "rssi_distances": {"633": {"rssi": -55, "count": 4}}}}
+
+Records are decoded one line at a time into AudioChunk and
+ProximityScan tuples, so memory use does not depend on the size of the
+log. The member_id, badge_address and time filters are applied to the
+raw line before it is decoded. A final line without its newline is
+taken as still being written by the hub and is left alone unless it is
+complete JSON.
+
+    python Scripts/hub_log.py actividad_2019-04-32/audio_data.txt \\
+        --member-id 641 --start 1554299800 --end 1554299900
+"""
+import argparse
+import collections
+import json
+import re
+
+from badge_registry import mac_to_int
+
+AUDIO = 'audio received'
+PROXIMITY = 'proximity received'
+
+AudioChunk = collections.namedtuple('AudioChunk', [
+    'member', 'badge_address', 'member_id', 'timestamp', 'sample_period',
+    'num_samples', 'samples', 'voltage', 'log_timestamp', 'log_index'])
+ProximityScan = collections.namedtuple('ProximityScan', [
+    'member', 'badge_address', 'member_id', 'timestamp', 'rssi_distances',
+    'voltage', 'log_timestamp', 'log_index'])
+RssiDistance = collections.namedtuple('RssiDistance',
+                                      ['member_id', 'rssi', 'count'])
+
+TYPE_FIELD = re.compile(br'"type":\s*"([^"]*)"')
+MEMBER_ID_FIELD = re.compile(br'"member_id":\s*(-?\d+)')
+BADGE_FIELD = re.compile(br'"badge_address":\s*"([^"]*)"')
+# the quote keeps "log_timestamp" from matching
+TIMESTAMP_FIELD = re.compile(br'"timestamp":\s*(-?[\d.eE+-]+)')
+
+READ_BUFFER = 1 << 20
+
+
+def audio_chunk(record):
+    """AudioChunk from a decoded 'audio received' line"""
+    data = record['data']
+    return AudioChunk(data.get('member'), data.get('badge_address'),
+                      data.get('member_id'), data['timestamp'],
+                      data.get('sample_period'),
+                      data.get('num_samples', len(data['samples'])),
+                      data['samples'], data.get('voltage'),
+                      record.get('log_timestamp'), record.get('log_index'))
+
+
+def proximity_scan(record):
+    """ProximityScan from a decoded 'proximity received' line"""
+    data = record['data']
+    distances = []
+    for member_id, seen in data.get('rssi_distances', {}).items():
+        distances.append(RssiDistance(int(member_id), seen.get('rssi'),
+                                      seen.get('count')))
+    distances.sort()
+    return ProximityScan(data.get('member'), data.get('badge_address'),
+                         data.get('member_id'), data['timestamp'],
+                         tuple(distances), data.get('voltage'),
+                         record.get('log_timestamp'),
+                         record.get('log_index'))
+
+
+DECODERS = {AUDIO: audio_chunk, PROXIMITY: proximity_scan}
+
+
+def audio_record(chunk):
+    """the hub log object of an AudioChunk"""
+    return {'type': AUDIO, 'log_timestamp': chunk.log_timestamp,
+            'log_index': chunk.log_index,
+            'data': {'member': chunk.member,
+                     'badge_address': chunk.badge_address,
+                     'member_id': chunk.member_id,
+                     'timestamp': chunk.timestamp,
+                     'sample_period': chunk.sample_period,
+                     'num_samples': len(chunk.samples),
+                     'samples': list(chunk.samples),
+                     'voltage': chunk.voltage}}
+
+
+def proximity_record(scan):
+    """the hub log object of a ProximityScan"""
+    return {'type': PROXIMITY, 'log_timestamp': scan.log_timestamp,
+            'log_index': scan.log_index,
+            'data': {'member': scan.member,
+                     'badge_address': scan.badge_address,
+                     'member_id': scan.member_id,
+                     'timestamp': scan.timestamp,
+                     'rssi_distances': dict(
+                         (str(seen.member_id),
+                          {'rssi': seen.rssi, 'count': seen.count})
+                         for seen in scan.rssi_distances),
+                     'voltage': scan.voltage}}
+
+
+class HubLogReader(object):
+    """
+    Iterate over the records of a hub log, optionally only those of
+    some record types, member ids or badge addresses and those whose
+    data timestamp lies in [start, end), reading from byte offset up to
+    the line that reaches limit. line_size is the length of the line of
+    the record just given. After iterating, offset is the position just
+    past the last complete line and stats counts the lines read,
+    filtered out, malformed and left truncated.
+    """
+    def __init__(self, path, member_ids=None, badge_addresses=None,
+                 start=None, end=None, types=None, offset=0, limit=None):
+        self.path = path
+        self.member_ids = None if member_ids is None else \
+            set(int(member_id) for member_id in member_ids)
+        # as 48-bit integers, however the MACs are written
+        self.badge_addresses = None if badge_addresses is None else \
+            set(mac_to_int(address) for address in badge_addresses)
+        self.start = start
+        self.end = end
+        self.types = None if types is None else \
+            set(kind.encode('ascii') for kind in types)
+        self.offset = offset
+        self.limit = limit
+        self.line_size = 0
+        self.stats = collections.Counter()
+
+    def __iter__(self):
+        return self.records(self.lines())
+
+    def records(self, lines):
+        """filter and decode raw lines from any source"""
+        for line in lines:
+            if not self.__wanted(line):
+                self.stats['filtered'] += 1
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+                decoded = DECODERS[record['type']](record)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.stats['malformed'] += 1
+                continue
+            self.line_size = len(line)
+            yield decoded
+
+    def lines(self):
+        """
+        raw lines from offset on (up to limit); a final line without
+        newline is only given if it decodes
+        """
+        with open(self.path, 'rb', READ_BUFFER) as log:
+            log.seek(self.offset)
+            for line in log:
+                if self.limit is not None and self.offset >= self.limit:
+                    return
+                if not line.endswith(b'\n'):
+                    if not self.__complete(line):
+                        self.stats['truncated'] += 1
+                        return
+                self.offset += len(line)
+                self.stats['lines'] += 1
+                if line.strip():
+                    yield line
+
+    def __wanted(self, line):
+        if self.types is not None:
+            match = TYPE_FIELD.search(line)
+            if match is None or match.group(1) not in self.types:
+                return False
+        if self.member_ids is not None:
+            match = MEMBER_ID_FIELD.search(line)
+            if match is None or int(match.group(1)) not in self.member_ids:
+                return False
+        if self.badge_addresses is not None:
+            match = BADGE_FIELD.search(line)
+            if match is None:
+                return False
+            try:
+                mac = mac_to_int(match.group(1).decode('ascii'))
+            except (UnicodeDecodeError, ValueError):
+                return False
+            if mac not in self.badge_addresses:
+                return False
+        if self.start is not None or self.end is not None:
+            match = TIMESTAMP_FIELD.search(line)
+            if match is None:
+                return False
+            timestamp = float(match.group(1))
+            if self.start is not None and timestamp < self.start:
+                return False
+            if self.end is not None and timestamp >= self.end:
+                return False
+        return True
+
+    @staticmethod
+    def __complete(line):
+        try:
+            json.loads(line.decode('utf-8'))
+        except ValueError:
+            return False
+        return True
+
+
+def read_records(path, **filters):
+    """generator over the records of a hub log, see HubLogReader"""
+    return iter(HubLogReader(path, **filters))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='summarize the records of hub logs')
+    parser.add_argument('logs', nargs='+', help='audio_data.txt or '
+                        'proximity_data.txt files')
+    parser.add_argument('--member-id', action='append', type=int,
+                        dest='member_ids', help='only this member')
+    parser.add_argument('--badge', action='append', dest='badges',
+                        help='only this badge address')
+    parser.add_argument('--start', type=float, help='first timestamp')
+    parser.add_argument('--end', type=float, help='timestamp after the last')
+    args = parser.parse_args()
+    for path in args.logs:
+        reader = HubLogReader(path, member_ids=args.member_ids,
+                              badge_addresses=args.badges,
+                              start=args.start, end=args.end)
+        counts = collections.Counter()
+        for record in reader:
+            counts[(type(record).__name__, record.badge_address)] += 1
+        print(path)
+        for (kind, badge), count in sorted(counts.items()):
+            print("  {0:<14} {1:<18} {2:8}".format(kind, badge, count))
+        print("  " + ", ".join("{0} {1}".format(key, value)
+                               for key, value in sorted(reader.stats.items())))
+
+
+if __name__ == '__main__':
+    main()
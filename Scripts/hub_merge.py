@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time-ordered merge of the logs of several hubs.
+
+Every hub writes its own audio_data.txt and proximity_data.txt in the
+order it receives the data (log_timestamp), while the records carry the
+badge's own timestamp. The badge clock can be off (a badge sends chunks
+stamped ~60000 s in the past until it gets the time from the hub) and a
+record reaches the hub from a fraction of a second to some 20 s after
+it was measured, a chunk sent again later.
+
+A first pass estimates the clock offset of every badge: the hub time of
+a record is at most its log_timestamp, so a low quantile of
+log_timestamp - end of the record (the end of the last sample of an
+audio chunk) over all the records of the badge is taken as its offset.
+The second pass corrects every timestamp by the offset of its badge and
+merges the logs with a heap: one entry per log holding its next record,
+and a heap of corrected records that are given once every log has gone
+`horizon` seconds past them. A record whose corrected time still lies
+more than `horizon` seconds from its log_timestamp (a badge clock not
+set yet) is placed at the time it reached the hub. Memory depends on
+the number of badges and logs and on the horizon, not on the size of
+the logs.
+
+    python Scripts/hub_merge.py hub1/audio_data.txt hub2/audio_data.txt \\
+        --output merged_audio_data.txt
+"""
+import argparse
+import collections
+import heapq
+import json
+import sys
+
+from audio_merge import chunk_end
+from hub_log import AudioChunk, HubLogReader, audio_record, proximity_record
+
+RESOLUTION = 0.1
+
+
+def record_end(record):
+    """badge time of the end of a record"""
+    if isinstance(record, AudioChunk):
+        return chunk_end(record)
+    return record.timestamp
+
+
+class ClockOffsets(object):
+    """
+    Clock offset of every badge (seconds to add to its timestamps) from
+    the (timestamp, log_timestamp) pairs of its records, taken as the
+    `quantile` of log_timestamp - end of record, RESOLUTION wide
+    """
+    def __init__(self, quantile=0.05):
+        self.quantile = quantile
+        self.deltas = collections.defaultdict(collections.Counter)
+        self.__offsets = {}
+
+    def add(self, record):
+        if record.log_timestamp is None or not record.badge_address:
+            return
+        delta = record.log_timestamp - record_end(record)
+        self.deltas[record.badge_address.upper()][
+            int(round(delta / RESOLUTION))] += 1
+        self.__offsets = {}
+
+    def offset(self, badge_address):
+        """offset of a badge, 0 for a badge never seen"""
+        badge = badge_address.upper()
+        if badge not in self.__offsets:
+            counts = self.deltas.get(badge)
+            self.__offsets[badge] = 0.0 if not counts else \
+                self.__quantile(counts) * RESOLUTION
+        return self.__offsets[badge]
+
+    def offsets(self):
+        return dict((badge, self.offset(badge)) for badge in self.deltas)
+
+    def __quantile(self, counts):
+        rank = int(sum(counts.values()) * self.quantile)
+        for delta in sorted(counts):
+            rank -= counts[delta]
+            if rank < 0:
+                return delta
+
+
+class HubMerger(object):
+    """
+    Merge the records of several logs, each in log_timestamp order,
+    into one stream in corrected time order. stats counts the records
+    given, those placed at their log_timestamp, those found out of
+    log_timestamp order in their log, those given after a later one
+    (late) and the most records held at once.
+    """
+    def __init__(self, offsets, horizon=120.0):
+        self.offsets = offsets
+        self.horizon = horizon
+        self.stats = collections.Counter()
+        self.__last = float('-inf')
+
+    def corrected(self, record):
+        """hub time of the first sample of a record"""
+        if not record.badge_address:
+            return record.timestamp
+        time = record.timestamp + \
+            self.offsets.offset(record.badge_address)
+        arrival = record.log_timestamp
+        if arrival is not None and abs(arrival - time) > self.horizon:
+            self.stats['placed_at_arrival'] += 1
+            time = arrival - (record_end(record) - record.timestamp)
+        return time
+
+    def merge(self, sources):
+        """generator over (corrected time, record) of all sources"""
+        logs = []
+        for number, source in enumerate(sources):
+            self.__next(logs, number, iter(source), None)
+        held = []
+        sequence = 0
+        while logs:
+            arrival, number, record, source = heapq.heappop(logs)
+            heapq.heappush(held, (self.corrected(record), sequence,
+                                  record))
+            sequence += 1
+            self.stats['most_held'] = max(self.stats['most_held'],
+                                          len(held))
+            self.__next(logs, number, source, arrival)
+            # every record still to come is past this
+            watermark = (logs[0][0] if logs else float('inf')) - \
+                self.horizon
+            while held and held[0][0] < watermark:
+                yield self.__give(held)
+        while held:
+            yield self.__give(held)
+
+    def __give(self, held):
+        time, _, record = heapq.heappop(held)
+        if time < self.__last:
+            self.stats['late'] += 1
+        self.__last = max(self.__last, time)
+        self.stats['records'] += 1
+        return time, record
+
+    def __next(self, logs, number, source, previous):
+        for record in source:
+            arrival = record.log_timestamp
+            if arrival is None:
+                arrival = self.corrected(record)
+            if previous is not None and arrival < previous:
+                self.stats['out_of_order'] += 1
+                arrival = previous
+            heapq.heappush(logs, (arrival, number, record, source))
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='merge the logs of several hubs in time order')
+    parser.add_argument('logs', nargs='+', help='audio_data.txt or '
+                        'proximity_data.txt files of the hubs')
+    parser.add_argument('--horizon', type=float, default=120.0,
+                        help='seconds a record may take to reach the hub')
+    parser.add_argument('--quantile', type=float, default=0.05,
+                        help='quantile of the delays taken as offset')
+    parser.add_argument('--output', help='write the merged records with '
+                        'corrected timestamps to this file')
+    args = parser.parse_args()
+    offsets = ClockOffsets(args.quantile)
+    for path in args.logs:
+        for record in HubLogReader(path):
+            offsets.add(record)
+    for badge, offset in sorted(offsets.offsets().items()):
+        sys.stderr.write("{0} {1:+12.1f} s\n".format(badge, offset))
+    merger = HubMerger(offsets, args.horizon)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for time, record in merger.merge([HubLogReader(path)
+                                          for path in args.logs]):
+            if output is None:
+                continue
+            encode = audio_record if isinstance(record, AudioChunk) \
+                else proximity_record
+            line = encode(record._replace(timestamp=time))
+            line['clock_offset'] = time - record.timestamp
+            output.write(json.dumps(line) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    for key, value in sorted(merger.stats.items()):
+        sys.stderr.write("{0:<18} {1:>12}\n".format(key, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental ingestion of the hub data files into activity folders.
+
+Instead of copying the whole audio_data.txt and proximity_data.txt into
+every new actividad_<fecha> folder, only the lines the hub appended
+since the last run are read and each one is appended to the folder of
+the day it reached the hub (actividad_YYYY-MM-DD, local time, of its
+log_timestamp), or to a single activity given with --activity. The
+data timestamp is only used for lines without a log_timestamp, as the
+clock of a badge that was not set yet runs some 60680 s behind.
+
+The checkpoint file (/home/pirate/backup/ingest_checkpoint.json, out
+of the git repository the activity folders are in, unless --checkpoint
+names another one) keeps, for every source, its device and inode, the
+offset read up to and a digest of its first bytes, and the committed
+size of every output file. A source replaced or truncated
+(borrar-data.sh, a hub restart) is read again from the start; output
+written after the last checkpoint is cut off before appending again,
+so an interrupted run does not duplicate lines.
+
+    python Scripts/ingest.py --source-dir \\
+        /home/pirate/badges_UCN/openbadge-hub-py/data --dest .
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+from hub_log import TIMESTAMP_FIELD, HubLogReader
+
+HUB_DATA = '/home/pirate/badges_UCN/openbadge-hub-py/data'
+HUB_FILES = ['audio_data.txt', 'proximity_data.txt']
+CHECKPOINT = '/home/pirate/backup/ingest_checkpoint.json'
+HEAD_SIZE = 4096
+LOG_TIMESTAMP_FIELD = re.compile(br'"log_timestamp":\s*(-?[\d.eE+-]+)')
+
+
+def day_activity(timestamp):
+    """activity folder of the local day of a timestamp"""
+    return time.strftime('actividad_%Y-%m-%d', time.localtime(timestamp))
+
+
+def head_digest(path, size):
+    """digest of the first size bytes of a file"""
+    with open(path, 'rb') as source:
+        return hashlib.sha1(source.read(size)).hexdigest()
+
+
+class Ingestor(object):
+    """
+    Append the new lines of hub data files to activity folders under
+    dest. route maps the time of a line (None when it has none) to an
+    activity folder name.
+    """
+    def __init__(self, dest, route=None, checkpoint_path=None):
+        self.dest = dest
+        self.route = route or self.__route_by_day
+        self.checkpoint_path = checkpoint_path or CHECKPOINT
+        self.checkpoint = {'sources': {}, 'outputs': {}}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                self.checkpoint = json.load(checkpoint)
+        self.outputs = {}
+
+    def ingest(self, source_path):
+        """
+        append the lines added to a source since the last run; returns
+        the number of lines and bytes read
+        """
+        source = os.path.abspath(source_path)
+        stat = os.stat(source)
+        offset = self.__resume_offset(source, stat)
+        reader = HubLogReader(source, offset=offset)
+        lines = 0
+        try:
+            for line in reader.lines():
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                self.__output(self.__activity(line),
+                              os.path.basename(source)).write(line)
+                lines += 1
+            self.__commit()
+        finally:
+            self.__close()
+        head_size = min(reader.offset, HEAD_SIZE)
+        self.checkpoint['sources'][source] = {
+            'device': stat.st_dev, 'inode': stat.st_ino,
+            'offset': reader.offset, 'head_size': head_size,
+            'head': head_digest(source, head_size)}
+        self.__save()
+        return lines, reader.offset - offset
+
+    def __resume_offset(self, source, stat):
+        """where to go on reading, 0 for a new, replaced or cut file"""
+        known = self.checkpoint['sources'].get(source)
+        if known is None:
+            return 0
+        if (known['device'], known['inode']) != (stat.st_dev, stat.st_ino):
+            return 0
+        if stat.st_size < known['offset']:
+            return 0
+        if head_digest(source, known['head_size']) != known['head']:
+            return 0
+        return known['offset']
+
+    def __activity(self, line):
+        # the hub clock first, see the module docstring
+        match = LOG_TIMESTAMP_FIELD.search(line) or \
+            TIMESTAMP_FIELD.search(line)
+        return self.route(float(match.group(1)) if match else None)
+
+    @staticmethod
+    def __route_by_day(timestamp):
+        if timestamp is None:
+            return 'actividad_sin_fecha'
+        return day_activity(timestamp)
+
+    def __output(self, activity, name):
+        relative = os.path.join(activity, name)
+        stream = self.outputs.get(relative)
+        if stream is None:
+            path = os.path.join(self.dest, relative)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            stream = open(path, 'ab')
+            committed = self.checkpoint['outputs'].get(relative)
+            if committed is not None and committed < os.path.getsize(path):
+                # written by a run that did not finish
+                stream.truncate(committed)
+            stream.seek(0, os.SEEK_END)
+            self.outputs[relative] = stream
+        return stream
+
+    def __commit(self):
+        for relative, stream in self.outputs.items():
+            stream.flush()
+            os.fsync(stream.fileno())
+            self.checkpoint['outputs'][relative] = stream.tell()
+
+    def __close(self):
+        for stream in self.outputs.values():
+            stream.close()
+        self.outputs = {}
+
+    def __save(self):
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint:
+            json.dump(self.checkpoint, checkpoint, indent=1,
+                      sort_keys=True)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.rename(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='append new hub data to activity folders')
+    parser.add_argument('--source-dir', default=HUB_DATA,
+                        help='hub data directory')
+    parser.add_argument('--file', action='append', dest='files',
+                        help='data file in the source directory '
+                        '(default: audio_data.txt and proximity_data.txt)')
+    parser.add_argument('--dest', default='.',
+                        help='directory holding the activity folders')
+    parser.add_argument('--activity',
+                        help='append everything to this activity folder '
+                        'instead of one folder per day')
+    parser.add_argument('--checkpoint',
+                        help='checkpoint file (default: {0})'
+                        .format(CHECKPOINT))
+    args = parser.parse_args()
+    route = None
+    if args.activity:
+        def one_activity(timestamp):
+            return args.activity
+        route = one_activity
+    ingestor = Ingestor(args.dest, route, args.checkpoint)
+    for name in args.files or HUB_FILES:
+        path = os.path.join(args.source_dir, name)
+        if not os.path.exists(path):
+            print("{0}: not found".format(path))
+            continue
+        lines, size = ingestor.ingest(path)
+        print("{0}: {1} new lines, {2} bytes".format(path, lines, size))
+
+
+if __name__ == '__main__':
+    main()
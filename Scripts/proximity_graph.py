@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Proximity graph of the badges, one sparse adjacency matrix per time
+window, from the rssi_distances of proximity scans.
+
+Every scan of a badge (one every 15 s) lists the badges it heard with
+their RSSI and the number of pings. Within a window of `width` seconds
+the edge from the scanning badge to a heard one sums the pings, their
+RSSI (for the mean) and the pings at `threshold` dBm or more, taken as
+face to face, which is the default weight of the matrix.
+
+Windows are aligned on multiples of the width (15 s, 1 min, 5 min...)
+by data timestamp. Scans reach the hub up to some 20 s late and out of
+order, so a window is given once a scan `lateness` seconds past its end
+has been seen; a scan for a window already given is counted as late
+and left out. A badge whose clock is off can stamp a scan far in the
+future, which would give every window at once and leave all the scans
+after it late, so a scan stamped more than `lateness` seconds after
+the hub logged it (log_timestamp) is counted as ahead and left out.
+Only the edges seen are kept, and only for the windows still open, so
+memory follows the number of edges, not the number of badges squared
+or the length of the log.
+
+    python Scripts/proximity_graph.py \\
+        actividad_2019-04-32/proximity_data.txt --width 15 --width 60 \\
+        --output-dir grafos
+"""
+import argparse
+import collections
+import os
+from array import array
+
+from hub_log import PROXIMITY, HubLogReader
+
+Edge = collections.namedtuple('Edge', ['observer', 'heard', 'count', 'rssi',
+                                       'near'])
+
+
+class Window(object):
+    """
+    The edges of one window, observer and heard member ids with the
+    pings, mean RSSI and face to face pings of each
+    """
+    def __init__(self, width, start, edges):
+        self.width = width
+        self.start = start
+        self.end = start + width
+        self.edges = edges
+
+    def matrix(self, index, weight='near'):
+        """
+        (rows, cols, values) arrays of the non-zero entries of the
+        adjacency matrix for a member id -> row mapping, which grows
+        with members not in it yet
+        """
+        rows, cols = array('i'), array('i')
+        values = array('d')
+        for edge in self.edges:
+            value = getattr(edge, weight)
+            if not value:
+                continue
+            rows.append(index.setdefault(edge.observer, len(index)))
+            cols.append(index.setdefault(edge.heard, len(index)))
+            values.append(value)
+        return rows, cols, values
+
+    def sparse(self, index, weight='near'):
+        """the adjacency matrix as a scipy.sparse COO matrix"""
+        from scipy.sparse import coo_matrix
+        rows, cols, values = self.matrix(index, weight)
+        return coo_matrix((values, (rows, cols)),
+                          shape=(len(index), len(index)))
+
+
+class ProximityGraph(object):
+    """
+    Build the windows of one width from proximity scans given in log
+    order. add() returns the windows that are complete, flush() the
+    rest. stats counts the scans read, late and ahead of the hub clock
+    and the windows and edges given.
+    """
+    def __init__(self, width=60.0, threshold=-62, lateness=60.0):
+        self.width = float(width)
+        self.threshold = threshold
+        self.lateness = lateness
+        # window number -> (observer, heard) -> [count, rssi sum, near]
+        self.open = {}
+        self.given = None
+        self.newest = None
+        self.stats = collections.Counter()
+
+    def add(self, scan):
+        self.stats['scans'] += 1
+        if scan.member_id is None:
+            return []
+        if scan.log_timestamp is not None and \
+                scan.timestamp > scan.log_timestamp + self.lateness:
+            self.stats['ahead'] += 1
+            return []
+        number = int(scan.timestamp // self.width)
+        if self.given is not None and number <= self.given:
+            self.stats['late'] += 1
+            return []
+        edges = self.open.setdefault(number, {})
+        for seen in scan.rssi_distances:
+            if seen.rssi is None:
+                continue
+            count = seen.count or 1
+            edge = edges.get((scan.member_id, seen.member_id))
+            if edge is None:
+                edge = edges[(scan.member_id, seen.member_id)] = [0, 0, 0]
+            edge[0] += count
+            edge[1] += seen.rssi * count
+            if seen.rssi >= self.threshold:
+                edge[2] += count
+        self.newest = scan.timestamp if self.newest is None else \
+            max(self.newest, scan.timestamp)
+        return self.__release(int((self.newest - self.lateness) //
+                                  self.width))
+
+    def flush(self):
+        """the windows still open"""
+        if not self.open:
+            return []
+        return self.__release(max(self.open) + 1)
+
+    def windows(self, scans):
+        """generator over the windows of a stream of scans"""
+        for scan in scans:
+            for window in self.add(scan):
+                yield window
+        for window in self.flush():
+            yield window
+
+    def __release(self, before):
+        """the open windows ending at or before window number before"""
+        released = []
+        for number in sorted(self.open):
+            if number + 1 > before:
+                break
+            edges = self.open.pop(number)
+            released.append(Window(self.width, number * self.width, [
+                Edge(observer, heard, count, float(rssi) / count, near)
+                for (observer, heard), (count, rssi, near)
+                in sorted(edges.items())]))
+            self.given = number if self.given is None else \
+                max(self.given, number)
+            self.stats['windows'] += 1
+            self.stats['edges'] += len(edges)
+        return released
+
+
+def read_scans(path):
+    """the proximity scans of a hub log"""
+    return HubLogReader(path, types=[PROXIMITY])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='proximity graph of hub logs per time window')
+    parser.add_argument('logs', nargs='+', help='proximity_data.txt files')
+    parser.add_argument('--width', type=float, action='append',
+                        dest='widths', help='window width in seconds '
+                        '(default: 15, 60 and 300)')
+    parser.add_argument('--threshold', type=int, default=-62,
+                        help='least RSSI taken as face to face')
+    parser.add_argument('--lateness', type=float, default=60.0,
+                        help='seconds a scan may arrive after a later one')
+    parser.add_argument('--output-dir', help='write the edges of every '
+                        'width to edges_<width>s.csv in this directory')
+    args = parser.parse_args()
+    graphs = [ProximityGraph(width, args.threshold, args.lateness)
+              for width in args.widths or [15, 60, 300]]
+    outputs = []
+    if args.output_dir:
+        if not os.path.isdir(args.output_dir):
+            os.makedirs(args.output_dir)
+        for graph in graphs:
+            output = open(os.path.join(args.output_dir, 'edges_{0:g}s.csv'
+                                       .format(graph.width)), 'w')
+            output.write("start,observer,heard,count,rssi,near\n")
+            outputs.append(output)
+
+    def write(number, windows):
+        if not outputs:
+            return
+        for window in windows:
+            for edge in window.edges:
+                outputs[number].write("{0:.0f},{1},{2},{3},{4:.1f},{5}\n"
+                                      .format(window.start, *edge))
+
+    try:
+        for path in args.logs:
+            for scan in read_scans(path):
+                for number, graph in enumerate(graphs):
+                    write(number, graph.add(scan))
+        for number, graph in enumerate(graphs):
+            write(number, graph.flush())
+    finally:
+        for output in outputs:
+            output.close()
+    for graph in graphs:
+        print("{0:g} s: {1}".format(graph.width, ", ".join(
+            "{0} {1}".format(key, value)
+            for key, value in sorted(graph.stats.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reconciliation of the two sides of every proximity observation.
+
+Both badges of a pair report each other in their own scans (641 hears
+633 at -55 and 633 hears 641 at -56 in the same 15 s), in records that
+reach the hub seconds apart. The directed edges of every window of a
+ProximityGraph (see proximity_graph.py) are hash joined on the
+unordered member pair into one PairEdge:
+
+- rssi is the mean of both sides weighted by their pings;
+- confidence grows with the pings, pings / (pings + PINGS_HALF), and
+  for a pair heard from both sides falls as the sides disagree,
+  1 / (1 + (difference / RSSI_SPREAD) ** 2); a one-sided pair gets half;
+- heard_by names the only member that heard the other for a one-sided
+  pair, None when both did;
+- near tells whether rssi reaches the face to face threshold.
+
+Windows are only joined once the graph gives them, that is once no
+late scan can reach them any more, and dropped right after, so memory
+stays that of the open windows however long the stream.
+
+    python Scripts/reconcile.py actividad_2019-04-32/proximity_data.txt \\
+        --output pares.csv
+"""
+import argparse
+import collections
+import itertools
+
+from proximity_graph import ProximityGraph, read_scans
+
+PINGS_HALF = 4.0
+RSSI_SPREAD = 6.0
+
+PairEdge = collections.namedtuple('PairEdge', [
+    'start', 'low', 'high', 'rssi', 'confidence', 'heard_by', 'near',
+    'low_rssi', 'high_rssi', 'low_count', 'high_count'])
+
+
+def join(window, threshold=-62):
+    """the PairEdges of a window of directed edges, in pair order"""
+    pairs = {}
+    for edge in window.edges:
+        if edge.observer == edge.heard:
+            continue
+        key = (min(edge.observer, edge.heard), max(edge.observer,
+                                                   edge.heard))
+        sides = pairs.get(key)
+        if sides is None:
+            sides = pairs[key] = [None, None]
+        # side 0 is what the lower member id heard
+        sides[0 if edge.observer == key[0] else 1] = edge
+    return [pair_edge(window.start, key, sides, threshold)
+            for key, sides in sorted(pairs.items())]
+
+
+def pair_edge(start, key, sides, threshold=-62):
+    """combine the edges each member of a pair reported"""
+    low, high = sides
+    count = sum(side.count for side in sides if side is not None)
+    rssi = sum(side.rssi * side.count for side in sides
+               if side is not None) / float(count)
+    confidence = count / (count + PINGS_HALF)
+    if low is None or high is None:
+        confidence /= 2
+        heard_by = key[0] if high is None else key[1]
+    else:
+        confidence /= 1 + ((low.rssi - high.rssi) / RSSI_SPREAD) ** 2
+        heard_by = None
+    return PairEdge(start, key[0], key[1], rssi, confidence, heard_by,
+                    rssi >= threshold, low.rssi if low else None,
+                    high.rssi if high else None,
+                    low.count if low else 0, high.count if high else 0)
+
+
+class Reconciler(object):
+    """
+    Join the sides of the observations of proximity scans given in log
+    order, window by window. add() returns the PairEdges of the
+    windows that are complete, flush() the rest. stats counts pairs
+    seen from both sides and from one, besides the counts of the graph.
+    """
+    def __init__(self, width=15.0, threshold=-62, lateness=60.0):
+        self.graph = ProximityGraph(width, threshold, lateness)
+        self.stats = self.graph.stats
+
+    def add(self, scan):
+        return self.__join(self.graph.add(scan))
+
+    def flush(self):
+        return self.__join(self.graph.flush())
+
+    def pairs(self, scans):
+        """generator over the PairEdges of a stream of scans"""
+        for scan in scans:
+            for pair in self.add(scan):
+                yield pair
+        for pair in self.flush():
+            yield pair
+
+    def __join(self, windows):
+        joined = []
+        for window in windows:
+            for pair in join(window, self.graph.threshold):
+                self.stats['one_sided' if pair.heard_by is not None
+                           else 'two_sided'] += 1
+                joined.append(pair)
+        return joined
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='join both sides of the proximity observations')
+    parser.add_argument('logs', nargs='+', help='proximity_data.txt files')
+    parser.add_argument('--width', type=float, default=15.0,
+                        help='window width in seconds')
+    parser.add_argument('--threshold', type=int, default=-62,
+                        help='least RSSI taken as face to face')
+    parser.add_argument('--lateness', type=float, default=60.0,
+                        help='seconds a scan may arrive after a later one')
+    parser.add_argument('--output', help='write the pairs to this CSV file')
+    args = parser.parse_args()
+    reconciler = Reconciler(args.width, args.threshold, args.lateness)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        if output is not None:
+            output.write(",".join(PairEdge._fields) + "\n")
+        scans = itertools.chain.from_iterable(read_scans(path)
+                                              for path in args.logs)
+        for pair in reconciler.pairs(scans):
+            if output is not None:
+                output.write(",".join(
+                    '' if value is None else
+                    '{0:.3f}'.format(value) if isinstance(value, float)
+                    else str(value) for value in pair) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    print(", ".join("{0} {1}".format(key, value)
+                    for key, value in sorted(reconciler.stats.items())))
+
+
+if __name__ == '__main__':
+    main()
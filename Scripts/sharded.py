@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parallel decoding of a hub log in byte range shards.
+
+The log is cut into shards of about the same size, every cut moved to
+just past a newline, and a pool of processes decodes the shards with
+HubLogReader (offset and limit) and reduces the records of each shard
+with a task:
+
+    count     records per record type and badge
+    voltage   min, sum and count of the voltages of every badge
+    columns   the audio chunks as arrays: timestamp, member id, number
+              of samples, voltage, and all the samples one after the
+              other (int16)
+    records   the records themselves
+
+By default one process reads the log as a single shard, and a pool of
+processes gets SHARDS_PER_PROCESS shards per process, so that one done
+early takes another, of MIN_SHARD to MAX_SHARD bytes (the result of a
+shard stays in memory until the merge). The results are merged in
+shard order, so columns and records keep the order of the log; float
+sums may differ in the last digits between numbers of processes, as
+the shards differ.
+
+    python Scripts/sharded.py actividad_2019-04-32/audio_data.txt \\
+        --task voltage --processes 4
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+from array import array
+
+from hub_log import AUDIO, AudioChunk, HubLogReader
+
+MIN_SHARD = 1 << 20
+MAX_SHARD = 64 << 20
+SHARDS_PER_PROCESS = 4
+COLUMNS = [('timestamp', 'd'), ('member_id', 'i'), ('count', 'I'),
+           ('voltage', 'f'), ('samples', 'h')]
+
+
+def shard_count(size, processes):
+    """number of shards of a log of size bytes for a pool of processes"""
+    if processes <= 1:
+        return 1
+    shard_size = min(MAX_SHARD, max(MIN_SHARD, size // (
+        processes * SHARDS_PER_PROCESS)))
+    return max(1, -(-size // shard_size))
+
+
+def shard_ranges(path, shards):
+    """(start, end) byte ranges of about the same size, cut after newlines"""
+    size = os.path.getsize(path)
+    cuts = [0]
+    with open(path, 'rb') as log:
+        for number in range(1, shards):
+            position = max(size * number // shards, cuts[-1])
+            if position:
+                # the line the cut falls in goes to the shard before
+                log.seek(position - 1)
+                log.readline()
+            cuts.append(min(log.tell(), size))
+    cuts.append(size)
+    return [(start, end) for start, end in zip(cuts, cuts[1:])
+            if end > start]
+
+
+def count_records(records):
+    counts = collections.Counter()
+    for record in records:
+        counts[(type(record).__name__, record.badge_address)] += 1
+    return counts
+
+
+def merge_counts(results):
+    total = collections.Counter()
+    for counts in results:
+        total.update(counts)
+    return total
+
+
+def voltage_records(records):
+    voltages = {}
+    for record in records:
+        if record.voltage is None:
+            continue
+        low, total, count = voltages.get(record.badge_address,
+                                         (record.voltage, 0.0, 0))
+        voltages[record.badge_address] = (min(low, record.voltage),
+                                          total + record.voltage, count + 1)
+    return voltages
+
+
+def merge_voltages(results):
+    merged = {}
+    for voltages in results:
+        for badge, (low, total, count) in voltages.items():
+            if badge in merged:
+                old_low, old_total, old_count = merged[badge]
+                low = min(low, old_low)
+                total += old_total
+                count += old_count
+            merged[badge] = (low, total, count)
+    return merged
+
+
+def audio_columns(records):
+    columns = dict((name, array(code)) for name, code in COLUMNS)
+    for record in records:
+        if not isinstance(record, AudioChunk):
+            continue
+        columns['timestamp'].append(record.timestamp)
+        columns['member_id'].append(record.member_id
+                                    if record.member_id is not None else -1)
+        columns['count'].append(len(record.samples))
+        columns['voltage'].append(record.voltage or 0.0)
+        columns['samples'].extend(record.samples)
+    return columns
+
+
+def merge_columns(results):
+    merged = dict((name, array(code)) for name, code in COLUMNS)
+    for columns in results:
+        for name, _ in COLUMNS:
+            merged[name].extend(columns[name])
+    return merged
+
+
+def merge_records(results):
+    merged = []
+    for records in results:
+        merged.extend(records)
+    return merged
+
+
+# task -> (reduce the records of a shard, merge the shard results)
+TASKS = {'count': (count_records, merge_counts),
+         'voltage': (voltage_records, merge_voltages),
+         'columns': (audio_columns, merge_columns),
+         'records': (list, merge_records)}
+
+
+def parse_shard(job):
+    """result of a task over the records of one byte range"""
+    path, start, end, task, filters = job
+    if task == 'columns':
+        filters = dict(filters, types=[AUDIO])
+    reader = HubLogReader(path, offset=start, limit=end, **filters)
+    return TASKS[task][0](reader)
+
+
+def parse_sharded(path, task='count', processes=None, shards=None,
+                  **filters):
+    """
+    merged result of a task over a log, decoded in shards by a pool of
+    processes; see HubLogReader for the filters
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if shards is None:
+        shards = shard_count(os.path.getsize(path), processes)
+    jobs = [(path, start, end, task, filters)
+            for start, end in shard_ranges(path, shards)]
+    if processes == 1 or len(jobs) < 2:
+        results = [parse_shard(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(parse_shard, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return TASKS[task][1](results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='decode a hub log in parallel shards')
+    parser.add_argument('log', help='audio_data.txt or proximity_data.txt')
+    parser.add_argument('--task', choices=['count', 'voltage', 'columns'],
+                        default='count')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--shards', type=int,
+                        help='byte ranges (default: {0} per process, '
+                        'of 1 to 64 MB)'.format(SHARDS_PER_PROCESS))
+    parser.add_argument('--member-id', action='append', type=int,
+                        dest='member_ids', help='only this member')
+    args = parser.parse_args()
+    result = parse_sharded(args.log, args.task, args.processes, args.shards,
+                           member_ids=args.member_ids)
+    if args.task == 'count':
+        for (kind, badge), count in sorted(result.items()):
+            print("{0:<14} {1:<18} {2:8}".format(kind, badge, count))
+    elif args.task == 'voltage':
+        for badge, (low, total, count) in sorted(result.items()):
+            print("{0:<18} min {1:.3f} mean {2:.3f} {3:8} readings".format(
+                badge, low, total / count, count))
+    else:
+        for name, _ in COLUMNS:
+            print("{0:<10} {1:>12} values".format(name, len(result[name])))
+
+
+if __name__ == '__main__':
+    main()
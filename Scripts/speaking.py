@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Speaking intervals of every badge from the samples of an audio store.
+
+The samples of a badge are taken as whole NumPy arrays from the store
+(see audio_store.py) and put on a grid of one cell per sample period,
+so chunks sent more than once fill the same cells. Then, without a
+Python loop over the samples:
+
+- the noise floor is the 20th percentile of every block of one minute
+  and the noise the spread up to the 50th, interpolated between blocks,
+  so it follows a badge that sits around 3 or that drifts;
+- the signal above the floor is smoothed with a moving average;
+- a badge starts speaking when it goes `on` times the noise over the
+  floor and stops when it falls under `off` times the noise;
+- pauses shorter than `min_pause` are closed and intervals shorter
+  than `min_speech` dropped.
+
+Intervals never span a gap in the data. Badges are spread over a pool
+of processes, each mapping the files of its badge.
+
+    python Scripts/audio_store.py store actividad_2019-04-32/audio_data.txt
+    python Scripts/speaking.py store --output speaking.csv
+"""
+import argparse
+import collections
+import multiprocessing
+
+from audio_store import AudioStore
+
+Settings = collections.namedtuple('Settings', [
+    'window', 'block', 'on', 'off', 'min_noise', 'min_speech',
+    'min_pause'])
+DEFAULTS = Settings(window=0.5, block=60.0, on=3.0, off=1.5, min_noise=1.0,
+                    min_speech=0.3, min_pause=0.5)
+# largest grid, in cells per sample, before sorting the samples instead
+SPARSE = 8
+
+
+def sample_grid(index, samples):
+    """
+    sample period (s), time of the first cell, cell numbers and values
+    of the samples of a badge, one value per cell, in time order
+    """
+    import numpy
+    used = index[index['period'] > 0]
+    if not len(used):
+        return None
+    period = float(numpy.median(used['period'])) / 1000.0
+    first = float(used['timestamp'].min())
+    counts = used['count'].astype(numpy.int64)
+    within = numpy.arange(counts.sum()) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    cells = numpy.repeat(numpy.round((used['timestamp'] - first) / period)
+                         .astype(numpy.int64), counts) + within
+    values = numpy.asarray(samples)[
+        numpy.repeat(used['offset'].astype(numpy.int64), counts) + within]
+    # the last copy of a cell wins, as the longest copy of a chunk
+    # comes last
+    size = int(cells.max()) + 1
+    if size > SPARSE * len(cells):
+        # a clock far off, sort rather than spread over a huge grid
+        order = numpy.argsort(cells, kind='stable')[::-1]
+        cells, unique = numpy.unique(cells[order], return_index=True)
+        return period, first, cells, \
+            values[order][unique].astype(numpy.float64)
+    # position of the last sample of every cell; ufunc.at applies
+    # every index in turn, where a fancy assignment with repeated
+    # indices does not say which value is kept
+    last = numpy.full(size, -1, numpy.int64)
+    numpy.maximum.at(last, cells, numpy.arange(len(cells)))
+    cells = numpy.flatnonzero(last >= 0)
+    return period, first, cells, \
+        values[last[cells]].astype(numpy.float64)
+
+
+def moving_average(values, width):
+    import numpy
+    if width <= 1:
+        return values
+    sums = numpy.cumsum(numpy.concatenate(([0.0], values)))
+    half = width // 2
+    high = numpy.minimum(numpy.arange(len(values)) + width - half,
+                         len(values))
+    low = numpy.maximum(numpy.arange(len(values)) - half, 0)
+    return (sums[high] - sums[low]) / (high - low)
+
+
+def noise_floor(values, block):
+    """floor and noise of every value from blocks of block values"""
+    import numpy
+    count = len(values) // block
+    low, middle = numpy.percentile(
+        values[:count * block].reshape(count, block), [20, 50], axis=1)
+    centers = numpy.arange(count) * block + block / 2.0
+    rest = values[count * block:]
+    if len(rest):
+        rest_low, rest_middle = numpy.percentile(rest, [20, 50])
+        low = numpy.append(low, rest_low)
+        middle = numpy.append(middle, rest_middle)
+        centers = numpy.append(centers, count * block + len(rest) / 2.0)
+    positions = numpy.arange(len(values))
+    return numpy.interp(positions, centers, low), \
+        numpy.interp(positions, centers, middle - low)
+
+
+def hysteresis(signal, high, low):
+    """on from a value over high until the next one under low"""
+    import numpy
+    events = numpy.zeros(len(signal), numpy.int8)
+    events[signal < low] = -1
+    events[signal > high] = 1
+    last = numpy.where(events != 0, numpy.arange(len(signal)), 0)
+    last = numpy.maximum.accumulate(last)
+    return events[last] == 1
+
+
+def intervals(period, first, cells, values, settings=DEFAULTS):
+    """(starts, ends) arrays of the speaking intervals in a sample grid"""
+    import numpy
+    floor, noise = noise_floor(values, int(settings.block / period))
+    noise = numpy.maximum(noise, settings.min_noise)
+    signal = moving_average(values - floor,
+                            int(round(settings.window / period)))
+    speaking = hysteresis(signal, settings.on * noise,
+                          settings.off * noise)
+    # a gap in the data ends an interval
+    runs = numpy.flatnonzero(numpy.diff(cells) != 1) + 1
+    edges = numpy.diff(numpy.concatenate(([False], speaking, [False]))
+                       .astype(numpy.int8))
+    begin = numpy.flatnonzero(edges == 1)
+    end = numpy.flatnonzero(edges == -1)
+    if not len(begin):
+        return numpy.empty(0), numpy.empty(0)
+    if len(runs):
+        begin = numpy.union1d(begin, runs[speaking[runs] &
+                                          speaking[runs - 1]])
+        end = numpy.union1d(end, runs[speaking[runs] & speaking[runs - 1]])
+    starts = first + cells[begin] * period
+    ends = first + (cells[end - 1] + 1) * period
+    # close short pauses within a run of data, then drop short
+    # intervals
+    run = numpy.searchsorted(runs, begin, side='right')
+    pauses = starts[1:] - ends[:-1]
+    joined = numpy.concatenate(([True], (pauses >= settings.min_pause) |
+                                (run[1:] != run[:-1])))
+    starts = starts[joined]
+    ends = ends[numpy.concatenate((joined[1:], [True]))]
+    long_enough = ends - starts >= settings.min_speech
+    return starts[long_enough], ends[long_enough]
+
+
+def badge_intervals(job):
+    """member id and speaking intervals of one badge of a store"""
+    import numpy
+    root, badge, settings = job
+    store = AudioStore(root)
+    index = store.chunk_index(badge)
+    member_id = int(index['member_id'][-1]) if len(index) else None
+    grid = sample_grid(index, store.samples(badge)) if len(index) else None
+    if grid is None:
+        return badge, member_id, numpy.empty(0), numpy.empty(0)
+    starts, ends = intervals(*grid, settings=settings)
+    return badge, member_id, starts, ends
+
+
+def speaking_intervals(root, badges=None, settings=DEFAULTS, processes=None):
+    """
+    (badge, member id, starts, ends) of the badges of a store, computed
+    by a pool of processes
+    """
+    badges = badges or AudioStore(root).badges()
+    jobs = [(root, badge, settings) for badge in badges]
+    if processes == 1 or len(jobs) < 2:
+        return [badge_intervals(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(badge_intervals, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='speaking intervals of the badges of an audio store')
+    parser.add_argument('store', help='store directory (audio_store.py)')
+    parser.add_argument('--badge', action='append', dest='badges',
+                        help='only this badge')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', help='write badge, member id, start '
+                        'and end of every interval to this CSV file')
+    for name in Settings._fields:
+        parser.add_argument('--' + name.replace('_', '-'), type=float,
+                            default=getattr(DEFAULTS, name))
+    args = parser.parse_args()
+    settings = Settings(*[getattr(args, name) for name in Settings._fields])
+    results = speaking_intervals(args.store, args.badges, settings,
+                                 args.processes)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        if output is not None:
+            output.write("badge,member_id,start,end\n")
+        for badge, member_id, starts, ends in results:
+            print("{0} {1:>6} {2:>6} intervals {3:>10.1f} s speaking".format(
+                badge, member_id, len(starts), float((ends - starts).sum())))
+            if output is None:
+                continue
+            for start, end in zip(starts, ends):
+                output.write("{0},{1},{2:.3f},{3:.3f}\n".format(
+                    badge, member_id, start, end))
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
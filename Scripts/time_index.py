@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sparse time index of a hub log, for time range queries.
+
+The log is cut into blocks of at least MIN_BLOCK bytes, on line
+boundaries, each ending where the time bucket of a line changes. For
+every block the index holds one (bucket, block offset) entry per time
+bucket found in it. The bucket is the data timestamp (or the
+log_timestamp with --field log_timestamp) divided by --bucket seconds.
+The hub writes in log_timestamp order but data timestamps of some
+badges lag by hours, so a block can hold a few buckets and a bucket can
+be found in blocks far apart; only the blocks holding a bucket of the
+query are read.
+
+The index lives next to the log in <log>.<field>.tidx: a HEADER_FORMAT
+header (bucket width, bytes of the log indexed, number of entries and a
+digest of the first bytes of the log) followed by ENTRY_FORMAT entries,
+written whole under a temporary name and renamed over the old index, so
+an interrupted update leaves the previous index as it was. A log that
+grew is indexed from the start of its last block on; one that was
+replaced or cut is indexed again from the start, by update() or by a
+query that finds it so. Queries map the log and only look at the lines
+of the matching blocks, decoding those whose time falls in the range.
+
+    python Scripts/time_index.py actividad_2019-04-32/proximity_data.txt \\
+        --start 1554299800 --end 1554299900
+"""
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+from hub_log import TIMESTAMP_FIELD, HubLogReader
+
+FIELDS = {'timestamp': TIMESTAMP_FIELD,
+          'log_timestamp': re.compile(br'"log_timestamp":\s*(-?[\d.eE+-]+)')}
+MIN_BLOCK = 64 * 1024
+HEAD_SIZE = 4096
+MAGIC = b'TIDX'
+HEADER_FORMAT = '<4sdQQI20s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# bucket number, offset of the block
+ENTRY_FORMAT = '<qq'
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+READ_BUFFER = 1 << 20
+
+
+def head_digest(path, size):
+    """digest of the first size bytes of a file"""
+    with open(path, 'rb') as source:
+        return hashlib.sha1(source.read(size)).digest()
+
+
+class TimeIndex(object):
+    """
+    Time index of one log. update() brings it up to date with the log,
+    lines() and records() answer range queries from it.
+    """
+    def __init__(self, log_path, field='timestamp', bucket=60.0):
+        if field not in FIELDS:
+            raise ValueError("unknown time field: " + field)
+        self.log_path = log_path
+        self.field = field
+        self.pattern = FIELDS[field]
+        self.bucket = float(bucket)
+        self.path = '{0}.{1}.tidx'.format(log_path, field)
+        self.indexed = 0
+        self.entries = array('q')
+        self.__sorted = None
+        self.__load()
+
+    def update(self):
+        """index what was added to the log; returns the bytes read"""
+        size = os.path.getsize(self.log_path)
+        offset = self.__resume(size)
+        start = offset
+        with open(self.log_path, 'rb', READ_BUFFER) as log:
+            log.seek(offset)
+            block = offset
+            block_bucket = None
+            buckets = set()
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break
+                bucket = self.__bucket(line)
+                if bucket is not None:
+                    if block_bucket is not None and \
+                            bucket != block_bucket and \
+                            offset - block >= MIN_BLOCK:
+                        self.__add_block(block, buckets)
+                        block = offset
+                        buckets = set()
+                    block_bucket = bucket
+                    buckets.add(bucket)
+                offset += len(line)
+            self.__add_block(block, buckets)
+        self.indexed = offset
+        self.__save()
+        return offset - start
+
+    def blocks(self, start=None, end=None):
+        """(offset, end) byte ranges holding the lines of [start, end)"""
+        buckets, offsets = self.__by_bucket()
+        low = 0 if start is None else \
+            bisect.bisect_left(buckets, int(start // self.bucket))
+        high = len(buckets) if end is None else \
+            bisect.bisect_right(buckets, int(end // self.bucket))
+        starts = self.__block_starts()
+        ranges = []
+        for offset in sorted(set(offsets[low:high])):
+            position = bisect.bisect_right(starts, offset)
+            block_end = starts[position] if position < len(starts) \
+                else self.indexed
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], block_end)
+            else:
+                ranges.append((offset, block_end))
+        return ranges
+
+    def lines(self, start=None, end=None):
+        """
+        raw lines whose time lies in [start, end), in log order; a log
+        cut or replaced since the last update() is indexed again first
+        """
+        with open(self.log_path, 'rb') as log:
+            if self.indexed and self.__changed(log):
+                self.update()
+                if self.__changed(log):
+                    raise ValueError("{0} changed while being indexed"
+                                     .format(self.log_path))
+            if not self.indexed:
+                return
+            mapped = mmap.mmap(log.fileno(), self.indexed,
+                               access=mmap.ACCESS_READ)
+            try:
+                for offset, block_end in self.blocks(start, end):
+                    while offset < block_end:
+                        newline = mapped.find(b'\n', offset, block_end)
+                        if newline == -1:
+                            break
+                        line = mapped[offset:newline + 1]
+                        offset = newline + 1
+                        match = self.pattern.search(line)
+                        if match is None:
+                            continue
+                        timestamp = float(match.group(1))
+                        if start is not None and timestamp < start:
+                            continue
+                        if end is not None and timestamp >= end:
+                            continue
+                        yield line
+            finally:
+                mapped.close()
+
+    def records(self, start=None, end=None, **filters):
+        """records in [start, end), see HubLogReader for the filters"""
+        reader = HubLogReader(None, **filters)
+        return reader.records(self.lines(start, end))
+
+    def __bucket(self, line):
+        match = self.pattern.search(line)
+        if match is None:
+            return None
+        return int(float(match.group(1)) // self.bucket)
+
+    def __add_block(self, offset, buckets):
+        for bucket in sorted(buckets):
+            self.entries.extend((bucket, offset))
+        self.__sorted = None
+
+    def __by_bucket(self):
+        """entries sorted by bucket, as two lists"""
+        if self.__sorted is None:
+            pairs = sorted(zip(self.entries[0::2], self.entries[1::2]))
+            self.__sorted = ([bucket for bucket, _ in pairs],
+                             [offset for _, offset in pairs])
+        return self.__sorted
+
+    def __block_starts(self):
+        starts = []
+        for offset in self.entries[1::2]:
+            if not starts or starts[-1] != offset:
+                starts.append(offset)
+        return starts
+
+    def __changed(self, log):
+        """
+        True if an open log is shorter than what was indexed or does
+        not start as the indexed one did
+        """
+        if os.fstat(log.fileno()).st_size < self.indexed:
+            return True
+        log.seek(0)
+        head = log.read(min(self.indexed, HEAD_SIZE))
+        return hashlib.sha1(head).digest() != self.__head
+
+    def __resume(self, size):
+        """
+        offset to index from: the start of the last block (it may have
+        grown) of a log that only grew, 0 for a replaced or cut one
+        """
+        head_size = min(self.indexed, HEAD_SIZE)
+        if size < self.indexed or not self.entries or \
+                head_digest(self.log_path, head_size) != self.__head:
+            del self.entries[:]
+            self.__sorted = None
+            return 0
+        last = self.entries[-1]
+        while self.entries and self.entries[-1] == last:
+            del self.entries[-2:]
+        self.__sorted = None
+        return last
+
+    def __load(self):
+        self.__head = None
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as index:
+            magic, bucket, indexed, count, head_size, head = struct.unpack(
+                HEADER_FORMAT, index.read(HEADER_SIZE))
+            if magic != MAGIC or bucket != self.bucket:
+                return
+            entries = array('q')
+            try:
+                entries.fromfile(index, count * 2)
+            except EOFError:
+                return
+        if any(offset >= indexed for offset in entries[1::2]):
+            # not written by this version (see __save); index again
+            return
+        self.entries = entries
+        self.indexed = indexed
+        self.__head = head
+
+    def __save(self):
+        """
+        write the header and the entries to a new file and rename it
+        over the index, so an interrupted update leaves the previous
+        index as it was
+        """
+        head_size = min(self.indexed, HEAD_SIZE)
+        self.__head = head_digest(self.log_path, head_size)
+        with open(self.path + '.tmp', 'wb') as index:
+            index.write(struct.pack(HEADER_FORMAT, MAGIC, self.bucket,
+                                    self.indexed, len(self.entries) // 2,
+                                    head_size, self.__head))
+            self.entries.tofile(index)
+            index.flush()
+            os.fsync(index.fileno())
+        os.rename(self.path + '.tmp', self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='index hub logs by time and query time ranges')
+    parser.add_argument('logs', nargs='+', help='audio_data.txt or '
+                        'proximity_data.txt files')
+    parser.add_argument('--field', choices=sorted(FIELDS),
+                        default='timestamp', help='time of a record')
+    parser.add_argument('--bucket', type=float, default=60.0,
+                        help='seconds per time bucket')
+    parser.add_argument('--start', type=float, help='first time')
+    parser.add_argument('--end', type=float, help='time after the last')
+    args = parser.parse_args()
+    output = getattr(sys.stdout, 'buffer', sys.stdout)
+    for path in args.logs:
+        index = TimeIndex(path, args.field, args.bucket)
+        read = index.update()
+        if args.start is None and args.end is None:
+            print("{0}: {1} bytes indexed ({2} read), {3} entries".format(
+                path, index.indexed, read, len(index.entries) // 2))
+            continue
+        for line in index.lines(args.start, args.end):
+            output.write(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,50 +2,17 @@
 
 cd /home/pirate/badges_UCN/badges_UCN
 
-numero=true
+#Backup: los archivos del hub se guardan comprimidos en el archivo de
+#respaldo; los segmentos ya respaldados otro dia no se guardan de nuevo
+python3 Scripts/archive.py /home/pirate/backup/archivo add --prefix "actividad_UCN_$(date +'%d_%m_%Y')" /home/pirate/badges_UCN/openbadge-hub-py/data/audio_data.txt /home/pirate/badges_UCN/openbadge-hub-py/data/proximity_data.txt
+echo "Backup creado"
 
-while [ "$numero" = true ]
-do
-    #Validar si se inserto un numero o no
-	
-	echo "Escribe la fecha de la actividad: yyyy-mm-dd";
-	read fecha
-	
-	#Probar si existe la actividad
-	foo="actividad_"
-	foo+="$fecha"
-
-	if [ -d "$foo" ];
-	then
-		echo "La actividad ya existe, por favor escribe una nueva fecha."
-	else
-		numero=false
-	fi		
-done
-
-#Backup
-if [ ! -d "/home/pirate/backup/actividad_UCN_$(date +'%d_%m_%Y')" ];
-	then
-		mkdir "/home/pirate/backup/actividad_UCN_$(date +'%d_%m_%Y')"
-		cp "/home/pirate/badges_UCN/openbadge-hub-py/data/audio_data.txt" "/home/pirate/backup/actividad_UCN_$(date +'%d_%m_%Y')/audio_data.txt"
-		cp "/home/pirate/badges_UCN/openbadge-hub-py/data/proximity_data.txt" "/home/pirate/backup/actividad_UCN_$(date +'%d_%m_%Y')/proximity_data.txt"
-		echo "Backup creado"
-	else
-		echo "Backup ya creado"
-	fi		
-
-
-#Crear Carpeta de Actividad
-mkdir $foo
-
-echo "Actividad nueva creada."
-
-#Copiar data a la carpeta creada
-cd $foo
-cp /home/pirate/badges_UCN/openbadge-hub-py/data/proximity_data.txt proximity_data.txt
-cp /home/pirate/badges_UCN/openbadge-hub-py/data/audio_data.txt audio_data.txt
+#Agregar a las carpetas actividad_<fecha> solo los datos nuevos,
+#cada registro en la carpeta del dia en que llego al hub; el punto de
+#control queda en /home/pirate/backup, fuera del repositorio
+python3 Scripts/ingest.py --source-dir /home/pirate/badges_UCN/openbadge-hub-py/data --dest .
 
-cd ..
+echo "Actividades actualizadas."
 
 # UpToGit 0.1
 # Actualiza facilmente tu repositorio Git
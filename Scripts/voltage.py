@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental voltage rollups and battery forecast of every badge.
+
+Every audio and proximity record carries the voltage of its badge. For
+each badge this keeps, updated in O(1) per record:
+
+- min, mean and last voltage per minute (the last day of them), per
+  15 minutes (the last week) and over the whole session;
+- a discharge slope from a least squares fit of voltage over time in
+  which every reading weighs exp(-age / HALF_LIFE * ln 2), from five
+  running sums kept centred on the newest reading.
+
+Times are log_timestamps (the hub clock), as the clock of a badge can
+be off, and readings may come in any order (audio_data.txt, then the
+proximity_data.txt of the same hours). The state, with how far every
+log was read and the inode and a digest of the first bytes of each, is
+kept in a JSON file, so a run only reads what the hub appended since
+the last one (all of a log replaced in the meantime), and dying()
+answers which badges go under a voltage within some time from the kept
+state alone.
+
+    python Scripts/voltage.py voltaje.json actividad_2019-04-32/*.txt \\
+        --threshold 2.6 --within 3600
+"""
+import argparse
+import collections
+import json
+import math
+import os
+import time
+
+from hub_log import HubLogReader
+from ingest import HEAD_SIZE, head_digest
+
+# resolution (s) -> buckets kept
+RESOLUTIONS = collections.OrderedDict([(60, 24 * 60), (900, 7 * 24 * 4)])
+HALF_LIFE = 3600.0
+MIN_READINGS = 10
+
+Forecast = collections.namedtuple('Forecast', [
+    'badge', 'member_id', 'voltage', 'slope', 'seconds_left'])
+
+
+class BadgeVoltage(object):
+    """rollups and discharge fit of one badge"""
+    def __init__(self, state=None):
+        state = state or {}
+        self.member_id = state.get('member_id')
+        # min, sum, count, last, time of last
+        self.session = state.get('session')
+        self.buckets = dict(
+            (int(resolution), collections.OrderedDict(
+                (int(number), bucket) for number, bucket in
+                state.get('buckets', {}).get(str(resolution), [])))
+            for resolution in RESOLUTIONS)
+        # weight, time, voltage, time^2 and time * voltage sums, with
+        # times relative to the newest reading
+        self.sums = state.get('sums', [0.0] * 5)
+        self.newest = state.get('newest')
+        self.readings = state.get('readings', 0)
+
+    def add(self, timestamp, voltage):
+        self.readings += 1
+        self.session = self.__rolled(self.session, timestamp, voltage)
+        for resolution, buckets in self.buckets.items():
+            number = int(timestamp // resolution)
+            buckets[number] = self.__rolled(buckets.get(number), timestamp,
+                                            voltage)
+            while len(buckets) > RESOLUTIONS[resolution]:
+                buckets.popitem(last=False)
+        self.__fit(timestamp, voltage)
+
+    def rollups(self, resolution=None):
+        """
+        (start, min, mean, last) of the buckets of a resolution, or of
+        the session with none
+        """
+        if resolution is None:
+            rolled = [(None, self.session)] if self.session else []
+        else:
+            rolled = sorted((number * resolution, bucket) for number, bucket
+                            in self.buckets[resolution].items())
+        return [(start, low, total / count, last)
+                for start, (low, total, count, last, _) in rolled]
+
+    def slope(self):
+        """discharge in volts per second, None with too few readings"""
+        weight, times, volts, squares, products = self.sums
+        spread = weight * squares - times * times
+        if self.readings < MIN_READINGS or spread <= 0:
+            return None
+        return (weight * products - times * volts) / spread
+
+    def current(self):
+        """the fitted voltage at the newest reading"""
+        weight, times, volts = self.sums[:3]
+        slope = self.slope()
+        if slope is None:
+            return self.session[3] if self.session else None
+        return (volts - slope * times) / weight
+
+    def state(self):
+        return {'member_id': self.member_id, 'session': self.session,
+                'buckets': dict((str(resolution), list(buckets.items()))
+                                for resolution, buckets
+                                in self.buckets.items()),
+                'sums': self.sums, 'newest': self.newest,
+                'readings': self.readings}
+
+    @staticmethod
+    def __rolled(bucket, timestamp, voltage):
+        if bucket is None:
+            return [voltage, voltage, 1, voltage, timestamp]
+        low, total, count, last, last_time = bucket
+        if timestamp >= last_time:
+            last, last_time = voltage, timestamp
+        return [min(low, voltage), total + voltage, count + 1, last,
+                last_time]
+
+    def __fit(self, timestamp, voltage):
+        weight, times, volts, squares, products = self.sums
+        if self.newest is not None and timestamp > self.newest:
+            # age the sums and move their origin to the new reading
+            shift = timestamp - self.newest
+            decay = math.exp(-shift / HALF_LIFE * math.log(2))
+            squares = squares - 2 * shift * times + shift * shift * weight
+            products = products - shift * volts
+            times = times - shift * weight
+            weight, times, volts, squares, products = [
+                value * decay for value in
+                (weight, times, volts, squares, products)]
+            self.newest = timestamp
+        elif self.newest is None:
+            self.newest = timestamp
+        offset = timestamp - self.newest
+        # a reading older than the newest one comes in already aged
+        age = math.exp(offset / HALF_LIFE * math.log(2)) if offset < 0 \
+            else 1.0
+        self.sums = [weight + age, times + age * offset,
+                     volts + age * voltage,
+                     squares + age * offset * offset,
+                     products + age * offset * voltage]
+
+
+class VoltageMonitor(object):
+    """
+    BadgeVoltage of every badge, kept in a JSON state file with the
+    offsets read up to in every log
+    """
+    def __init__(self, path):
+        self.path = path
+        state = {'sources': {}, 'badges': {}}
+        if os.path.exists(path):
+            with open(path) as stored:
+                state = json.load(stored)
+        self.sources = state['sources']
+        self.badges = dict((badge, BadgeVoltage(badge_state))
+                           for badge, badge_state
+                           in state['badges'].items())
+
+    def ingest(self, log_path):
+        """add the readings appended to a log; returns how many"""
+        source = os.path.abspath(log_path)
+        stat = os.stat(source)
+        reader = HubLogReader(source,
+                              offset=self.__resume_offset(source, stat))
+        added = 0
+        for record in reader:
+            if record.voltage is None or not record.badge_address:
+                continue
+            self.add(record.badge_address, record.member_id,
+                     record.log_timestamp or record.timestamp,
+                     record.voltage)
+            added += 1
+        head_size = min(reader.offset, HEAD_SIZE)
+        self.sources[source] = {
+            'device': stat.st_dev, 'inode': stat.st_ino,
+            'offset': reader.offset, 'head_size': head_size,
+            'head': head_digest(source, head_size)}
+        return added
+
+    def add(self, badge_address, member_id, timestamp, voltage):
+        badge = badge_address.upper()
+        rollup = self.badges.get(badge)
+        if rollup is None:
+            rollup = self.badges[badge] = BadgeVoltage()
+        rollup.member_id = member_id
+        rollup.add(timestamp, voltage)
+
+    def forecast(self, threshold):
+        """Forecast of every badge, seconds_left None when not falling"""
+        forecasts = []
+        for badge, rollup in sorted(self.badges.items()):
+            voltage = rollup.current()
+            slope = rollup.slope()
+            seconds_left = None
+            if voltage is not None and voltage <= threshold:
+                seconds_left = 0.0
+            elif slope is not None and slope < 0:
+                seconds_left = (threshold - voltage) / slope
+            forecasts.append(Forecast(badge, rollup.member_id, voltage,
+                                      slope, seconds_left))
+        return forecasts
+
+    def dying(self, threshold, within=3600.0, now=None):
+        """
+        Forecasts of the badges going under threshold within `within`
+        seconds of now (by default, of the newest reading of each)
+        """
+        found = []
+        for forecast in self.forecast(threshold):
+            if forecast.seconds_left is None:
+                continue
+            left = forecast.seconds_left
+            if now is not None:
+                left -= now - self.badges[forecast.badge].newest
+            if left <= within:
+                found.append(forecast._replace(seconds_left=max(left, 0.0)))
+        return sorted(found, key=lambda forecast: forecast.seconds_left)
+
+    def __resume_offset(self, source, stat):
+        """where to go on reading, 0 for a new, replaced or cut log"""
+        known = self.sources.get(source)
+        if known is None:
+            return 0
+        if (known['device'], known['inode']) != (stat.st_dev, stat.st_ino):
+            return 0
+        if stat.st_size < known['offset']:
+            return 0
+        if head_digest(source, known['head_size']) != known['head']:
+            return 0
+        return known['offset']
+
+    def save(self):
+        state = {'sources': self.sources,
+                 'badges': dict((badge, rollup.state()) for badge, rollup
+                                in self.badges.items())}
+        with open(self.path + '.tmp', 'w') as stored:
+            json.dump(state, stored, sort_keys=True)
+            stored.flush()
+            os.fsync(stored.fileno())
+        os.rename(self.path + '.tmp', self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='voltage rollups and battery forecast of the badges')
+    parser.add_argument('state', help='state file')
+    parser.add_argument('logs', nargs='*', help='audio_data.txt or '
+                        'proximity_data.txt files to read the new '
+                        'readings of')
+    parser.add_argument('--threshold', type=float, default=2.6,
+                        help='voltage a badge stops working under')
+    parser.add_argument('--within', type=float, default=3600.0,
+                        help='seconds to look ahead')
+    parser.add_argument('--now', action='store_true',
+                        help='count the time left from now rather than '
+                        'from the last reading')
+    args = parser.parse_args()
+    monitor = VoltageMonitor(args.state)
+    for path in args.logs:
+        print("{0}: {1} new readings".format(path, monitor.ingest(path)))
+    monitor.save()
+    for forecast in monitor.forecast(args.threshold):
+        low, mean, last = monitor.badges[forecast.badge].rollups()[0][1:]
+        print("{0} {1:>6} last {2:.3f} min {3:.3f} mean {4:.3f} "
+              "{5:>8} mV/h".format(
+                  forecast.badge, forecast.member_id, last, low, mean,
+                  '-' if forecast.slope is None else
+                  '{0:+.1f}'.format(forecast.slope * 3.6e6)))
+    dying = monitor.dying(args.threshold, args.within,
+                          time.time() if args.now else None)
+    print("{0} badges under {1} V within {2:g} s".format(
+        len(dying), args.threshold, args.within))
+    for forecast in dying:
+        print("  {0} {1:>6} in {2:>8.0f} s".format(
+            forecast.badge, forecast.member_id, forecast.seconds_left))
+
+
+if __name__ == '__main__':
+    main()
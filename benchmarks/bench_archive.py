@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compression ratio and throughput of the hub log archive.
+
+    python benchmarks/bench_archive.py --megabytes 64
+
+A synthetic audio_data.txt is archived as the log of a first activity,
+then the same log with more data appended is archived as the log of a
+second one, as the old full copies did. Reported are the time and
+throughput of both additions, the bytes the second addition read and
+stored (only about the new data, as it resumes from the manifest of
+the first), the compression ratio, the time to stream the lines and
+records back and the time of random segment reads.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Scripts'))
+
+from archive import Archive  # noqa: E402
+
+BADGES = ['F2:1E:84:04:C5:B5', 'C1:7C:3B:1A:29:17', 'CB:F3:EB:7C:75:69',
+          'C3:07:63:12:43:47']
+
+
+def write_audio_log(path, size, start=1554299803.642, seed=1):
+    """append audio records to path until it holds size bytes"""
+    rand = random.Random(seed)
+    timestamp = start
+    with open(path, 'a') as log:
+        while log.tell() < size:
+            for member_id, badge in enumerate(BADGES, 641):
+                samples = [max(0, int(rand.gauss(4, 2)))
+                           for _ in range(114)]
+                log.write(json.dumps({
+                    'data': {'member': badge, 'badge_address': badge,
+                             'voltage': round(rand.uniform(2.8, 2.9), 3),
+                             'samples': samples, 'num_samples': 114,
+                             'timestamp': round(timestamp, 3),
+                             'member_id': member_id, 'sample_period': 50},
+                    'log_timestamp': round(timestamp + 20, 3),
+                    'type': 'audio received', 'log_index': -1}) + "\n")
+            timestamp += 5.7
+    return timestamp
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='archive benchmark')
+    parser.add_argument('--megabytes', type=float, default=64,
+                        help='size of the first log')
+    parser.add_argument('--growth', type=float, default=0.25,
+                        help='data appended for the second copy, as a '
+                        'fraction of the first log')
+    parser.add_argument('--level', type=int, default=6,
+                        help='zlib compression level')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='cat_bench_')
+    try:
+        log = os.path.join(workdir, 'audio_data.txt')
+        size = int(args.megabytes * 1024 * 1024)
+        end = write_audio_log(log, size)
+        archive = Archive(os.path.join(workdir, 'archive'), args.level)
+        first_size = os.path.getsize(log)
+        seconds, _ = timed(archive.add, 'actividad_1/audio_data.txt', log)
+        first = dict(archive.stats)
+        print("first copy:  {0:8.1f} MB in {1:6.2f}s ({2:6.1f} MB/s), "
+              "stored {3:8.1f} MB, ratio {4:5.2f}".format(
+                  first_size / 1e6, seconds, first_size / 1e6 / seconds,
+                  first['compressed'] / 1e6,
+                  float(first_size) / first['compressed']))
+
+        write_audio_log(log, first_size + int(size * args.growth), end,
+                        seed=2)
+        second_size = os.path.getsize(log)
+        seconds, _ = timed(archive.add, 'actividad_2/audio_data.txt', log)
+        new_bytes = archive.stats['compressed'] - first['compressed']
+        read_bytes = archive.stats['raw'] - first['raw']
+        print("second copy: {0:8.1f} MB in {1:6.2f}s, read {2:8.1f} MB, "
+              "stored {3:8.1f} MB more for {4:.1f} MB of new data".format(
+                  second_size / 1e6, seconds, read_bytes / 1e6,
+                  new_bytes / 1e6, (second_size - first_size) / 1e6))
+
+        seconds, _ = timed(lambda: sum(
+            len(line) for line in archive.lines('actividad_2/audio_data.txt')))
+        print("stream lines:   {0:6.2f}s ({1:6.1f} MB/s)".format(
+            seconds, second_size / 1e6 / seconds))
+        seconds, count = timed(lambda: sum(
+            1 for _ in archive.records('actividad_2/audio_data.txt',
+                                       member_ids=[641])))
+        print("stream records of one member: {0:6.2f}s, {1} records".format(
+            seconds, count))
+        segments = archive.manifest('actividad_2/audio_data.txt')['segments']
+        picks = [random.randrange(len(segments)) for _ in range(50)]
+        seconds, _ = timed(lambda: [archive.segment(
+            'actividad_2/audio_data.txt', pick) for pick in picks])
+        print("random segment read: {0:6.2f} ms ({1} segments)".format(
+            seconds / len(picks) * 1000, len(segments)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the installer: run_installer() in silent mode
+against a fake NetworkManager preloaded with stale connections, for a
+TTLS/PAP and a TLS profile and for each D-Bus backend.
+
+    python benchmarks/bench_installer.py --connections 300 --delay 0.002
+
+Every case starts a private bus, a fake NM and a fresh HOME, runs the
+installer twice in a child process (a first installation and a rerun
+with nothing changed) and reports for each run the wall time of the
+whole process, the D-Bus calls received by the fake NM by method, the
+subprocesses the installer spawned and the bytes written under
+~/.cat_installer. No real NetworkManager or system bus is needed;
+dbus-daemon, dbus-python with GLib (for the fake NM) and openssl (for
+the TLS profile's certificate) are.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_nm
+from bench_p12 import PASSWORD, make_p12
+from installer import load_installer
+
+PROFILES = {'ttls-pap': ('TTLS', 'PAP'), 'tls': ('TLS', '')}
+BACKENDS = ['dbus', 'asyncio']
+RUNS = ['install', 'rerun']
+
+
+def child(args):
+    """Run the installer in this process and write the result file"""
+    installer = load_installer()
+    installer.Config.eap_outer, installer.Config.eap_inner = \
+        PROFILES[args.profile]
+    sys.argv = [installer.__file__, '--silent', '--backend', args.backend,
+                '--username', 'bench@ucn.cl', '--password', PASSWORD]
+    if args.pfx_file:
+        sys.argv += ['--pfxfile', args.pfx_file]
+    status = 0
+    start = time.time()
+    try:
+        installer.run_installer()
+    except SystemExit as err:
+        status = err.code
+    result = {'status': status, 'run_installer': time.time() - start,
+              'subprocesses': len(installer.SUBPROCESSES)}
+    with open(args.child, 'w') as result_file:
+        json.dump(result, result_file)
+
+
+def cat_files(home):
+    """(inode, mtime, size) of every file under ~/.cat_installer"""
+    files = {}
+    top = os.path.join(home, '.cat_installer')
+    for directory, _, names in os.walk(top):
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files[path] = (stat.st_ino, stat.st_mtime, stat.st_size)
+    return files
+
+
+def bytes_written(before, after):
+    """sizes of the files that are new or were rewritten"""
+    return sum(size for path, (ino, mtime, size) in after.items()
+               if before.get(path) != (ino, mtime, size))
+
+
+def run_case(profile, backend, pfx_file, args):
+    """Install and rerun against a fresh fake NM; return a row per run"""
+    home = tempfile.mkdtemp(prefix='cat_bench_')
+    bus_proc, address = fake_nm.start_private_bus()
+    nm_proc = None
+    rows = []
+    try:
+        nm_proc = fake_nm.start_fake_nm(address, args.connections,
+                                        ssids=['eduroam'], delay=args.delay)
+        env = dict(os.environ, HOME=home, DBUS_SYSTEM_BUS_ADDRESS=address)
+        env.setdefault('USER', 'bench')
+        env.pop('DISPLAY', None)
+        command = [sys.executable, os.path.abspath(__file__),
+                   '--profile', profile, '--backend', backend,
+                   '--child', os.path.join(home, 'result.json')]
+        if pfx_file:
+            # silent mode expects the certificate in place
+            os.mkdir(os.path.join(home, '.cat_installer'), 0o700)
+            shutil.copy(pfx_file,
+                        os.path.join(home, '.cat_installer', 'user.p12'))
+            command += ['--pfx-file', pfx_file]
+        for run in RUNS:
+            fake_nm.reset_counts(address)
+            before = cat_files(home)
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call(command, env=env, stdout=devnull)
+            wall = time.time() - start
+            with open(os.path.join(home, 'result.json')) as result_file:
+                result = json.load(result_file)
+            if result['status']:
+                raise SystemExit("{0}/{1}: installer exited with {2}".format(
+                    profile, backend, result['status']))
+            rows.append((profile, backend, run, wall, result,
+                         fake_nm.call_counts(address),
+                         bytes_written(before, cat_files(home))))
+    finally:
+        if nm_proc is not None:
+            nm_proc.terminate()
+        bus_proc.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+    return rows
+
+
+def report(rows):
+    methods = sorted(set(method for row in rows for method in row[5]))
+    print("{0:<9} {1:<8} {2:<8} {3:>8} {4:>7} {5:>6} {6:>8}  {7}".format(
+        'profile', 'backend', 'run', 'wall', 'calls', 'procs', 'bytes',
+        'calls by method'))
+    for profile, backend, run, wall, result, counts, written in rows:
+        by_method = ' '.join('{0}={1}'.format(method, counts[method])
+                             for method in methods if method in counts)
+        print("{0:<9} {1:<8} {2:<8} {3:>7.3f}s {4:>7} {5:>6} {6:>8}  "
+              "{7}".format(profile, backend, run, wall,
+                           sum(counts.values()), result['subprocesses'],
+                           written, by_method))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='installer benchmark')
+    parser.add_argument('--connections', type=int, default=300,
+                        help='stale connections stored in the fake NM')
+    parser.add_argument('--delay', type=float, default=0.002,
+                        help='simulated latency of every call in seconds')
+    parser.add_argument('--profile', action='append', default=[],
+                        dest='profiles', choices=sorted(PROFILES),
+                        help='profile to run (default: all)')
+    parser.add_argument('--backend', action='append', default=[],
+                        dest='backends', choices=BACKENDS,
+                        help='backend to run (default: all)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--pfx-file', dest='pfx_file',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        args.profile = args.profiles[0]
+        args.backend = args.backends[0]
+        child(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='cat_bench_')
+    rows = []
+    try:
+        for profile in args.profiles or sorted(PROFILES):
+            pfx_file = None
+            if PROFILES[profile][0] == 'TLS':
+                pfx_file = make_p12(workdir, 'AES-256-CBC')
+            for backend in args.backends or BACKENDS:
+                rows.extend(run_case(profile, backend, pfx_file, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the dbus-python and asyncio NetworkManager backends of the
+installer on a fake NetworkManager that answers every call after a
+simulated system bus latency.
+
+    python benchmarks/bench_nm_backends.py --connections 300 --delay 0.005
+
+Each backend runs connect_to_nm() and add_connections() against its own
+fresh fake NM; both must leave the same set of stored SSIDs behind.
+"""
+import argparse
+import os
+import time
+
+import fake_nm
+from installer import load_installer, scratch_home, UserData
+
+BACKENDS = ['dbus', 'asyncio']
+
+
+def run_backend(installer, backend, args):
+    """Provision against a fresh fake NM and return timings and state"""
+    bus_proc, address = fake_nm.start_private_bus()
+    nm_proc = None
+    try:
+        nm_proc = fake_nm.start_fake_nm(
+            address, args.connections, ssids=args.ssids + args.del_ssids,
+            delay=args.delay)
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = address
+        if backend == 'asyncio':
+            config_tool = installer.CatNMAsyncConfigTool()
+        else:
+            config_tool = installer.CatNMConfigTool()
+        start = time.time()
+        if config_tool.connect_to_nm() is None:
+            raise SystemExit("{0}: cannot connect to the fake "
+                             "NetworkManager".format(backend))
+        connected = time.time()
+        config_tool.add_connections(UserData())
+        done = time.time()
+        counts = fake_nm.call_counts(address)
+        ssids = fake_nm.stored_ssids(address)
+    finally:
+        if nm_proc is not None:
+            nm_proc.terminate()
+        bus_proc.terminate()
+    return connected - start, done - connected, counts, ssids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NM backend benchmark')
+    parser.add_argument('--connections', type=int, default=300,
+                        help='stale connections stored in the fake NM')
+    parser.add_argument('--delay', type=float, default=0.005,
+                        help='simulated latency of every call in seconds')
+    parser.add_argument('--ssid', action='append', default=[],
+                        dest='ssids', help='SSID to install '
+                        '(default: eduroam)')
+    parser.add_argument('--del-ssid', action='append', default=[],
+                        dest='del_ssids', help='SSID to delete')
+    args = parser.parse_args()
+    args.ssids = args.ssids or ['eduroam']
+
+    installer = load_installer()
+    scratch_home(installer)
+    installer.Config.ssids = args.ssids
+    installer.Config.del_ssids = args.del_ssids
+
+    results = {}
+    for backend in BACKENDS:
+        results[backend] = run_backend(installer, backend, args)
+    print("{0:<8} {1:>10} {2:>16} {3:>8}".format(
+        'backend', 'connect', 'add_connections', 'calls'))
+    for backend in BACKENDS:
+        connect, add, counts, ssids = results[backend]
+        print("{0:<8} {1:>9.3f}s {2:>15.3f}s {3:>8}".format(
+            backend, connect, add, sum(counts.values())))
+    if results['dbus'][3] != results['asyncio'][3]:
+        raise SystemExit("backends left different connections behind")
+    print("stored connections match ({0})".format(len(results['dbus'][3])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Count the D-Bus calls CatNMConfigTool.add_connections makes against
+the fake NetworkManager preloaded with many stale Wi-Fi profiles.
+
+    python benchmarks/bench_nm_index.py --connections 300 --del-ssid old
+
+The per-SSID scan that add_connections used before the connection
+index issued ListConnections plus Introspect and GetSettings for
+every stored connection, for every SSID; that figure is printed for
+comparison.
+"""
+import argparse
+import os
+import time
+
+import fake_nm
+from installer import load_installer, scratch_home, UserData
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NM connection index '
+                                     'benchmark')
+    parser.add_argument('--connections', type=int, default=300,
+                        help='stale connections stored in the fake NM')
+    parser.add_argument('--ssid', action='append', default=[],
+                        help='SSID to install (default: eduroam)')
+    parser.add_argument('--del-ssid', action='append', default=[],
+                        help='SSID to delete')
+    args = parser.parse_args()
+    ssids = args.ssid or ['eduroam']
+
+    bus_proc, address = fake_nm.start_private_bus()
+    nm_proc = None
+    try:
+        nm_proc = fake_nm.start_fake_nm(address, args.connections,
+                                        ssids=ssids + args.del_ssid)
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = address
+        installer = load_installer()
+        scratch_home(installer)
+        installer.Config.ssids = ssids
+        installer.Config.del_ssids = args.del_ssid
+
+        config_tool = installer.CatNMConfigTool()
+        if config_tool.connect_to_nm() is None:
+            raise SystemExit("cannot connect to the fake NetworkManager")
+        fake_nm.reset_counts(address)
+        start = time.time()
+        config_tool.add_connections(UserData())
+        elapsed = time.time() - start
+        counts = fake_nm.call_counts(address)
+    finally:
+        if nm_proc is not None:
+            nm_proc.terminate()
+        bus_proc.terminate()
+
+    stored = args.connections + len(ssids) + len(args.del_ssid)
+    scans = len(ssids) + len(args.del_ssid)
+    legacy = scans * (1 + 2 * stored) + 2 * len(ssids)
+    print("stored connections: {0}".format(stored))
+    print("add_connections:    {0:.3f} s".format(elapsed))
+    for method in sorted(counts):
+        print("  {0:<16} {1:>6}".format(method, counts[method]))
+    print("total D-Bus calls:  {0}".format(sum(counts.values())))
+    print("per-SSID scan:      ~{0}".format(legacy))
+
+
+if __name__ == '__main__':
+    main()
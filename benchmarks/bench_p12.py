@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time N wrong import passwords followed by the correct one, with the
+way __process_p12 used to check them (read the file and run
+`openssl pkcs12` on every attempt) and with P12Engine.
+
+    python benchmarks/bench_p12.py --wrong 20
+
+A throw-away key and certificate are made with the openssl command.
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from installer import load_installer
+
+PASSWORD = 'correct horse'
+
+
+def make_p12(directory, cert_pbe):
+    """Create a PKCS#12 file with a self-signed user certificate"""
+    key = os.path.join(directory, 'key.pem')
+    cert = os.path.join(directory, 'cert.pem')
+    pfx = os.path.join(directory, 'user-{0}.p12'.format(cert_pbe))
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                           '-nodes', '-keyout', key, '-out', cert,
+                           '-days', '1', '-subj',
+                           '/CN=bench@ucn.cl/emailAddress=bench@ucn.cl'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    subprocess.check_call(['openssl', 'pkcs12', '-export', '-inkey', key,
+                           '-in', cert, '-out', pfx, '-certpbe', cert_pbe,
+                           '-passout', 'pass:' + PASSWORD])
+    return pfx
+
+
+def legacy_check(pfx_file, password):
+    """The former openssl code path of __process_p12"""
+    command = ['openssl', 'pkcs12', '-in', pfx_file, '-passin',
+               'pass:' + password, '-nokeys', '-clcerts']
+    shell_command = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+    out, err = shell_command.communicate()
+    if shell_command.returncode != 0:
+        return None
+    out_str = out.decode('utf-8').strip()
+    subject = re.split(r'\s*[/,]\s*',
+                       re.findall(r'subject=/?(.*)$', out_str,
+                                  re.MULTILINE)[0])
+    cert_prop = {}
+    for field in subject:
+        if field:
+            cert_field = re.split(r'\s*=\s*', field)
+            cert_prop[cert_field[0].lower()] = cert_field[1]
+    return cert_prop
+
+
+def run_legacy(pfx_file, passwords):
+    start = time.time()
+    for password in passwords:
+        subject = legacy_check(pfx_file, password)
+    return time.time() - start, subject
+
+
+def run_engine(installer, pfx_file, passwords):
+    del installer.SUBPROCESSES[:]
+    start = time.time()
+    engine = installer.P12Engine(pfx_file)
+    for password in passwords:
+        if engine.check_password(password):
+            subject = engine.subject()
+    return time.time() - start, subject, engine.backend, \
+        len(installer.SUBPROCESSES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='p12 password benchmark')
+    parser.add_argument('--wrong', type=int, default=20,
+                        help='number of wrong passwords tried first')
+    args = parser.parse_args()
+    passwords = ['wrong-%d' % i for i in range(args.wrong)] + [PASSWORD]
+    installer = load_installer()
+    directory = tempfile.mkdtemp(prefix='cat_p12_')
+    try:
+        for cert_pbe in ('NONE', 'AES-256-CBC'):
+            pfx_file = make_p12(directory, cert_pbe)
+            legacy_time, legacy_subject = run_legacy(pfx_file, passwords)
+            engine_time, subject, backend, forks = \
+                run_engine(installer, pfx_file, passwords)
+            if legacy_subject.get('cn') != subject.get('cn'):
+                raise SystemExit("subjects differ: {0} {1}".format(
+                    legacy_subject, subject))
+            print("cert bag {0}: {1} wrong + 1 correct password".format(
+                cert_pbe, args.wrong))
+            print("  openssl per attempt:  {0:8.1f} ms, {1} forks".format(
+                legacy_time * 1000, len(passwords)))
+            print("  P12Engine ({0}): {1:8.1f} ms, {2} forks".format(
+                backend, engine_time * 1000, forks))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput and peak memory of the badge data pipeline on synthetic
+workloads.
+
+    python benchmarks/bench_pipeline.py --hours 1 8 48 --badges 42
+
+For every workload (a session of that many hours written by
+workload.py) every stage runs in a child process of its own, in the
+order of STAGES, later stages using what earlier ones wrote:
+
+    parse      decode every record of both logs (hub_log)
+    dedup      merge the re-sent audio chunks (audio_merge)
+    index      build the time index of both logs (time_index) and run
+               100 random 10 minute queries on it
+    merge      two-pass clock corrected merge of both logs (hub_merge)
+    store      convert the audio log to the columnar store (audio_store)
+    aggregate  mean sample level of every badge per minute, read from
+               the store (needs NumPy)
+    speaking   speaking intervals of every badge from the store, over
+               a process pool (speaking, needs NumPy)
+    graph      proximity graph windows of 15 s, 1 min and 5 min
+               (proximity_graph)
+    reconcile  join both sides of the proximity observations per 15 s
+               (reconcile)
+    voltage    voltage rollups of both logs, saved, and the badges
+               going under 2.6 V within the hour (voltage)
+    archive    add both logs to a compressed archive (archive)
+
+Reported are the time of the stage, the log bytes and records it went
+through per second and the peak RSS of its process (the interpreter
+alone takes some 10 MB). --json writes the results to a file.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Scripts'))
+
+from workload import write_workload  # noqa: E402
+
+
+def log_paths(data):
+    return [os.path.join(data, 'audio_data.txt'),
+            os.path.join(data, 'proximity_data.txt')]
+
+
+def log_size(data):
+    return sum(os.path.getsize(path) for path in log_paths(data))
+
+
+def parse(data):
+    from hub_log import HubLogReader
+    records = 0
+    for path in log_paths(data):
+        for _ in HubLogReader(path):
+            records += 1
+    return records, log_size(data)
+
+
+def dedup(data):
+    from audio_merge import ChunkMerger, read_chunks
+    path = log_paths(data)[0]
+    merger = ChunkMerger()
+    for _ in merger.merge(read_chunks(path)):
+        pass
+    return merger.stats['chunks_read'], os.path.getsize(path)
+
+
+def index(data):
+    from time_index import TimeIndex
+    records = 0
+    rand = random.Random(1)
+    for path in log_paths(data):
+        time_index = TimeIndex(path)
+        time_index.update()
+        buckets = time_index.entries[0::2]
+        first = min(buckets) * time_index.bucket
+        last = max(buckets) * time_index.bucket
+        for _ in range(100):
+            start = rand.uniform(first, max(first, last - 600))
+            for _ in time_index.records(start, start + 600):
+                records += 1
+    return records, log_size(data)
+
+
+def merge(data):
+    from hub_log import HubLogReader
+    from hub_merge import ClockOffsets, HubMerger
+    offsets = ClockOffsets()
+    for path in log_paths(data):
+        for record in HubLogReader(path):
+            offsets.add(record)
+    merger = HubMerger(offsets)
+    for _ in merger.merge([HubLogReader(path) for path in log_paths(data)]):
+        pass
+    return merger.stats['records'], 2 * log_size(data)
+
+
+def store(data):
+    from audio_store import AudioStore
+    path = log_paths(data)[0]
+    return AudioStore(os.path.join(data, 'store')).ingest(path), \
+        os.path.getsize(path)
+
+
+def aggregate(data):
+    import numpy
+    from audio_store import AudioStore
+    audio_store = AudioStore(os.path.join(data, 'store'))
+    samples = 0
+    size = 0
+    for badge in audio_store.badges():
+        times, values = audio_store.slice(badge, None, None)
+        minutes = ((times - times.min()) // 60).astype(numpy.int64)
+        counts = numpy.bincount(minutes)
+        sums = numpy.bincount(minutes, weights=values)
+        seen = counts > 0
+        levels = sums[seen] / counts[seen]
+        samples += len(values)
+        size += values.nbytes + levels.nbytes
+    return samples, size
+
+
+def speaking(data):
+    import numpy  # noqa: F401
+    from audio_store import AudioStore
+    from speaking import speaking_intervals
+    root = os.path.join(data, 'store')
+    speaking_intervals(root)
+    samples = 0
+    size = 0
+    for badge in AudioStore(root).badges():
+        values = AudioStore(root).samples(badge)
+        samples += len(values)
+        size += values.nbytes
+    return samples, size
+
+
+def graph(data):
+    from proximity_graph import ProximityGraph, read_scans
+    path = log_paths(data)[1]
+    graphs = [ProximityGraph(width) for width in (15, 60, 300)]
+    for scan in read_scans(path):
+        for proximity_graph in graphs:
+            proximity_graph.add(scan)
+    for proximity_graph in graphs:
+        proximity_graph.flush()
+    return graphs[0].stats['scans'], os.path.getsize(path)
+
+
+def reconcile(data):
+    from proximity_graph import read_scans
+    from reconcile import Reconciler
+    path = log_paths(data)[1]
+    reconciler = Reconciler()
+    for _ in reconciler.pairs(read_scans(path)):
+        pass
+    return reconciler.stats['scans'], os.path.getsize(path)
+
+
+def voltage(data):
+    from voltage import VoltageMonitor
+    monitor = VoltageMonitor(os.path.join(data, 'voltage.json'))
+    readings = sum(monitor.ingest(path) for path in log_paths(data))
+    monitor.save()
+    monitor.dying(2.6)
+    return readings, log_size(data)
+
+
+def archive(data):
+    from archive import Archive
+    log_archive = Archive(os.path.join(data, 'archive'))
+    for path in log_paths(data):
+        log_archive.add(os.path.basename(path), path)
+    return log_archive.stats['segments'], log_size(data)
+
+
+STAGES = [('parse', parse), ('dedup', dedup), ('index', index),
+          ('merge', merge), ('store', store), ('aggregate', aggregate),
+          ('speaking', speaking), ('graph', graph), ('reconcile', reconcile),
+          ('voltage', voltage), ('archive', archive)]
+
+
+def child(stage, data):
+    """run one stage in this process and print its result"""
+    start = time.time()
+    try:
+        records, size = dict(STAGES)[stage](data)
+    except ImportError as err:
+        print(json.dumps({'skipped': str(err)}))
+        return
+    print(json.dumps({'seconds': time.time() - start, 'records': records,
+                      'bytes': size}))
+
+
+def run_stage(stage, data):
+    """result of a stage run in a child process, with its peak RSS"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', stage,
+         '--data', data], stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    process.stdout.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    if status:
+        return {'failed': status}
+    result = json.loads(output.decode('utf-8'))
+    # kilobytes on Linux
+    result['peak_rss'] = usage.ru_maxrss * 1024
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pipeline benchmark')
+    parser.add_argument('--hours', type=float, nargs='+',
+                        default=[1, 8, 48], help='session lengths')
+    parser.add_argument('--badges', type=int, default=42)
+    parser.add_argument('--stage', action='append', dest='stages',
+                        choices=[name for name, _ in STAGES],
+                        help='only these stages')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.data)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='badge_bench_')
+    results = []
+    try:
+        for hours in args.hours:
+            data = os.path.join(workdir, '{0:g}h'.format(hours))
+            start = time.time()
+            write_workload(data, badges=args.badges, hours=hours)
+            print("{0:g} h, {1} badges: {2:.1f} MB of logs written in "
+                  "{3:.1f}s".format(hours, args.badges,
+                                    log_size(data) / 1e6,
+                                    time.time() - start))
+            for stage, _ in STAGES:
+                if args.stages and stage not in args.stages:
+                    continue
+                result = run_stage(stage, data)
+                result.update({'hours': hours, 'badges': args.badges,
+                               'stage': stage})
+                results.append(result)
+                if 'seconds' not in result:
+                    print("  {0:<10} {1}".format(
+                        stage, result.get('skipped') or
+                        'failed: {0}'.format(result.get('failed'))))
+                    continue
+                seconds = max(result['seconds'], 1e-9)
+                print("  {0:<10} {1:8.2f}s {2:8.1f} MB/s {3:10.0f} rec/s "
+                      "{4:8.1f} MB peak RSS".format(
+                          stage, result['seconds'],
+                          result['bytes'] / 1e6 / seconds,
+                          result['records'] / seconds,
+                          result['peak_rss'] / 1e6))
+            shutil.rmtree(data, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sharded parallel decoding of a hub log against decoding it in one
+process.
+
+    python benchmarks/bench_sharded.py --hours 8 --processes 1 2 4 8
+
+A synthetic session (workload.py) is written once. Its audio log is
+decoded with a plain HubLogReader loop, then with parse_sharded() for
+every number of processes, for the count and columns tasks. Reported
+are the shards the log is cut into, the time, the throughput and the
+speedup over the single process loop; the merged results are checked
+against those of the loop.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Scripts'))
+
+from hub_log import HubLogReader  # noqa: E402
+from sharded import TASKS, parse_sharded, shard_count  # noqa: E402
+from workload import write_workload  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sharded decoding benchmark')
+    parser.add_argument('--hours', type=float, default=4.0,
+                        help='length of the session')
+    parser.add_argument('--badges', type=int, default=42)
+    parser.add_argument('--processes', type=int, nargs='+',
+                        help='pool sizes (default: 1, 2, 4... up to the '
+                        'CPUs)')
+    args = parser.parse_args()
+    cpus = multiprocessing.cpu_count()
+    processes = args.processes or sorted(set(
+        [1 << power for power in range(cpus.bit_length())] + [cpus]))
+    workdir = tempfile.mkdtemp(prefix='badge_bench_')
+    try:
+        path = write_workload(workdir, badges=args.badges,
+                              hours=args.hours)[0]
+        size = os.path.getsize(path) / 1e6
+        print("{0:.1f} MB audio log, {1} CPUs".format(size, cpus))
+        for task in ['count', 'columns']:
+            start = time.time()
+            expected = TASKS[task][0](HubLogReader(path))
+            single = time.time() - start
+            print("{0}: one process {1:7.2f}s {2:7.1f} MB/s".format(
+                task, single, size / single))
+            for count in processes:
+                start = time.time()
+                result = parse_sharded(path, task, count)
+                seconds = time.time() - start
+                print("  {0:>3} processes {1:>4} shards {2:7.2f}s "
+                      "{3:7.1f} MB/s x{4:.2f}{5}".format(
+                          count, shard_count(os.path.getsize(path), count),
+                          seconds, size / seconds, single / seconds,
+                          '' if result == expected else ' MISMATCH'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of the bulk wpa_supplicant config generation.
+
+    python benchmarks/bench_wpa_bulk.py --users 50000 --hosts 2000
+
+A CSV manifest with the given number of users (every tenth password
+contains quotes and backslashes) is written to a temporary directory,
+then converted into one combined file and into one file per host.
+Peak RSS is reported to show that memory does not grow with the
+manifest.
+"""
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from installer import load_installer
+
+
+def write_manifest(path, users, hosts):
+    with open(path, 'w') as manifest:
+        manifest.write('username,password,host\n')
+        for i in range(users):
+            password = 'pw-%d' % i
+            if i % 10 == 0:
+                password = '"pa""ss\\%d"' % i
+            manifest.write('user%d@ucn.cl,%s,hub%d\n'
+                           % (i, password, i % hosts))
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bulk wpa conf benchmark')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--hosts', type=int, default=2000)
+    args = parser.parse_args()
+    installer = load_installer()
+    directory = tempfile.mkdtemp(prefix='cat_wpa_')
+    try:
+        manifest = os.path.join(directory, 'manifest.csv')
+        write_manifest(manifest, args.users, args.hosts)
+        print("manifest: {0} users, {1} hosts, {2:.1f} MB, "
+              "peak RSS {3:.1f} MB".format(
+                  args.users, args.hosts,
+                  os.path.getsize(manifest) / 1e6, peak_rss_mb()))
+        for combined in (True, False):
+            output = os.path.join(directory,
+                                  'all.conf' if combined else 'hosts')
+            wpa_conf = installer.WpaConf('/etc/cat_installer/ca.pem')
+            start = time.time()
+            count = wpa_conf.create_bulk_wpa_conf(
+                installer.Config.ssids, manifest, output, combined)
+            elapsed = time.time() - start
+            print("{0:<9} {1:>7} users {2:8.2f} s {3:10.0f} users/s "
+                  "peak RSS {4:.1f} MB".format(
+                      'combined' if combined else 'per host', count,
+                      elapsed, count / elapsed, peak_rss_mb()))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
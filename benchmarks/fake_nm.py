@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A NetworkManager stand-in for benchmarking the eduroam installer.
+
+It runs on a private dbus-daemon, owns the org.freedesktop.NetworkManager
+name there and implements the part of the NM API the installer uses:
+the Version property, Settings.ListConnections/AddConnection and
+Settings.Connection.GetSettings/Delete. Every method call (including
+Introspect) is counted; the counters are exposed through the
+org.freedesktop.NetworkManager.FakeStats interface.
+
+Run it directly (it prints nothing, the caller waits for the bus name):
+
+    python fake_nm.py --address unix:path=... --connections 300
+
+or use start_private_bus() and start_fake_nm() from a benchmark script.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+NM_NAME = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+SETTINGS_PATH = "/org/freedesktop/NetworkManager/Settings"
+SETTINGS_IFACE = "org.freedesktop.NetworkManager.Settings"
+CONNECTION_IFACE = "org.freedesktop.NetworkManager.Settings.Connection"
+STATS_IFACE = "org.freedesktop.NetworkManager.FakeStats"
+PROPS_IFACE = "org.freedesktop.DBus.Properties"
+
+
+def start_private_bus():
+    """
+    Start a dbus-daemon with the session configuration and return
+    the process and its address
+    """
+    proc = subprocess.Popen(['dbus-daemon', '--session', '--nofork',
+                             '--print-address=1'],
+                            stdout=subprocess.PIPE)
+    address = proc.stdout.readline().decode('utf-8').strip()
+    if not address:
+        proc.kill()
+        raise RuntimeError("dbus-daemon did not report its address")
+    return proc, address
+
+
+def start_fake_nm(address, connections=0, version='1.10.6', ssids=(),
+                  delay=0.0):
+    """
+    Start the fake NM in a child process and wait until it owns its name
+    """
+    command = [sys.executable, os.path.abspath(__file__),
+               '--address', address, '--connections', str(connections),
+               '--version', version, '--delay', str(delay)]
+    for ssid in ssids:
+        command += ['--ssid', ssid]
+    proc = subprocess.Popen(command)
+    import dbus
+    bus = dbus.bus.BusConnection(address)
+    deadline = time.time() + 30
+    while not bus.name_has_owner(NM_NAME):
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("fake NetworkManager did not start")
+        time.sleep(0.05)
+    bus.close()
+    return proc
+
+
+def call_counts(address):
+    """Return the per-method call counters of a running fake NM"""
+    import dbus
+    bus = dbus.bus.BusConnection(address)
+    stats = dbus.Interface(bus.get_object(NM_NAME, NM_PATH,
+                                          introspect=False), STATS_IFACE)
+    counts = dict((str(k), int(v)) for k, v in stats.GetCallCounts().items())
+    bus.close()
+    return counts
+
+
+def stored_ssids(address):
+    """Return the sorted SSIDs of all connections stored in a fake NM"""
+    import dbus
+    bus = dbus.bus.BusConnection(address)
+    stats = dbus.Interface(bus.get_object(NM_NAME, NM_PATH,
+                                          introspect=False), STATS_IFACE)
+    ssids = [str(ssid) for ssid in stats.GetSsids()]
+    bus.close()
+    return ssids
+
+
+def reset_counts(address):
+    """Zero the call counters of a running fake NM"""
+    import dbus
+    bus = dbus.bus.BusConnection(address)
+    stats = dbus.Interface(bus.get_object(NM_NAME, NM_PATH,
+                                          introspect=False), STATS_IFACE)
+    stats.ResetCallCounts()
+    bus.close()
+
+
+def wifi_settings(ssid, uuid_str):
+    """Minimal settings of a stored wireless connection"""
+    import dbus
+    return dbus.Dictionary({
+        'connection': dbus.Dictionary({
+            'type': '802-11-wireless', 'id': ssid, 'uuid': uuid_str},
+            signature='sv'),
+        '802-11-wireless': dbus.Dictionary({
+            'ssid': dbus.ByteArray(ssid.encode('utf8'))}, signature='sv'),
+        }, signature='sa{sv}')
+
+
+def serve(args):
+    """Export the fake service and run the main loop"""
+    import uuid
+    import dbus
+    import dbus.service
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(args.address)
+    counts = {}
+
+    def count(name):
+        counts[name] = counts.get(name, 0) + 1
+
+    def respond(name, reply_cb, error_cb, func, *fargs):
+        """
+        count the call and reply after the simulated bus latency;
+        replies are scheduled on the main loop so that concurrent
+        callers overlap just like they would on a slow system bus
+        """
+        count(name)
+
+        def finish():
+            try:
+                result = func(*fargs)
+            except dbus.exceptions.DBusException as exc:
+                error_cb(exc)
+                return False
+            if result is None:
+                reply_cb()
+            else:
+                reply_cb(result)
+            return False
+        if args.delay:
+            GLib.timeout_add(int(args.delay * 1000), finish)
+        else:
+            finish()
+
+    class Counted(dbus.service.Object):
+        """Object that counts introspection calls as well"""
+        @dbus.service.method(dbus.INTROSPECTABLE_IFACE, in_signature='',
+                             out_signature='s',
+                             path_keyword='object_path',
+                             connection_keyword='connection')
+        def Introspect(self, object_path, connection):
+            count('Introspect')
+            return dbus.service.Object.Introspect(self, object_path,
+                                                  connection)
+
+    class Connection(Counted):
+        def __init__(self, settings_obj, path, settings):
+            Counted.__init__(self, bus, path)
+            self.settings_obj = settings_obj
+            self.path = path
+            self.settings = settings
+
+        @dbus.service.method(CONNECTION_IFACE, in_signature='',
+                             out_signature='a{sa{sv}}',
+                             async_callbacks=('reply_cb', 'error_cb'))
+        def GetSettings(self, reply_cb, error_cb):
+            respond('GetSettings', reply_cb, error_cb, lambda: self.settings)
+
+        @dbus.service.method(CONNECTION_IFACE, in_signature='',
+                             out_signature='',
+                             async_callbacks=('reply_cb', 'error_cb'))
+        def Delete(self, reply_cb, error_cb):
+            respond('Delete', reply_cb, error_cb, self.delete)
+
+        def delete(self):
+            if self.path not in self.settings_obj.connections:
+                raise dbus.exceptions.DBusException(
+                    'Connection already deleted',
+                    name='org.freedesktop.NetworkManager.Settings.'
+                    'InvalidConnection')
+            self.Removed()
+            self.settings_obj.remove(self.path)
+
+        @dbus.service.signal(CONNECTION_IFACE, signature='')
+        def Removed(self):
+            pass
+
+    class Settings(Counted):
+        def __init__(self):
+            Counted.__init__(self, bus, SETTINGS_PATH)
+            self.connections = {}
+            self.serial = 0
+
+        def add(self, settings):
+            path = "%s/%d" % (SETTINGS_PATH, self.serial)
+            self.serial += 1
+            self.connections[path] = Connection(self, path, settings)
+            return path
+
+        def remove(self, path):
+            conn = self.connections.pop(path)
+            conn.remove_from_connection()
+            self.ConnectionRemoved(path)
+
+        @dbus.service.method(SETTINGS_IFACE, in_signature='',
+                             out_signature='ao',
+                             async_callbacks=('reply_cb', 'error_cb'))
+        def ListConnections(self, reply_cb, error_cb):
+            respond('ListConnections', reply_cb, error_cb,
+                    lambda: dbus.Array(sorted(self.connections),
+                                       signature='o'))
+
+        @dbus.service.method(SETTINGS_IFACE, in_signature='a{sa{sv}}',
+                             out_signature='o',
+                             async_callbacks=('reply_cb', 'error_cb'))
+        def AddConnection(self, settings, reply_cb, error_cb):
+            respond('AddConnection', reply_cb, error_cb, self.add_new,
+                    settings)
+
+        def add_new(self, settings):
+            path = self.add(settings)
+            self.NewConnection(path)
+            return dbus.ObjectPath(path)
+
+        @dbus.service.signal(SETTINGS_IFACE, signature='o')
+        def NewConnection(self, path):
+            pass
+
+        @dbus.service.signal(SETTINGS_IFACE, signature='o')
+        def ConnectionRemoved(self, path):
+            pass
+
+    class Manager(Counted):
+        def __init__(self):
+            Counted.__init__(self, bus, NM_PATH)
+
+        @dbus.service.method(PROPS_IFACE, in_signature='ss',
+                             out_signature='v',
+                             async_callbacks=('reply_cb', 'error_cb'))
+        def Get(self, interface, prop, reply_cb, error_cb):
+            respond('Get', reply_cb, error_cb, self.get, interface, prop)
+
+        def get(self, interface, prop):
+            if interface == NM_NAME and prop == 'Version':
+                return args.version
+            raise dbus.exceptions.DBusException(
+                'No such property ' + prop,
+                name='org.freedesktop.DBus.Error.InvalidArgs')
+
+        @dbus.service.method(STATS_IFACE, in_signature='',
+                             out_signature='a{su}')
+        def GetCallCounts(self):
+            return dbus.Dictionary(counts, signature='su')
+
+        @dbus.service.method(STATS_IFACE, in_signature='',
+                             out_signature='')
+        def ResetCallCounts(self):
+            counts.clear()
+
+        @dbus.service.method(STATS_IFACE, in_signature='',
+                             out_signature='as')
+        def GetSsids(self):
+            ssids = []
+            for conn in settings.connections.values():
+                wifi = conn.settings.get('802-11-wireless', {})
+                ssids.append(bytes(bytearray(wifi.get('ssid', [])))
+                             .decode('utf-8', 'replace'))
+            return dbus.Array(sorted(ssids), signature='s')
+
+    manager = Manager()
+    settings = Settings()
+    for i in range(args.connections):
+        settings.add(wifi_settings("stale-ssid-%d" % i, str(uuid.uuid4())))
+    for ssid in args.ssid:
+        settings.add(wifi_settings(ssid, str(uuid.uuid4())))
+    bus.request_name(NM_NAME)
+    loop = GLib.MainLoop()
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    del manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake NetworkManager')
+    parser.add_argument('--address', required=True,
+                        help='address of the bus to serve on')
+    parser.add_argument('--connections', type=int, default=0,
+                        help='number of stale wireless connections')
+    parser.add_argument('--ssid', action='append', default=[],
+                        help='preload a connection for this SSID')
+    parser.add_argument('--version', default='1.10.6',
+                        help='reported NetworkManager version')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='seconds to sleep in every call, simulating '
+                        'a slow system bus')
+    serve(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
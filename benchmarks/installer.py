@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the installer benchmarks: loading the installer
+script as a module and preparing a throw-away HOME for it.
+"""
+import os
+import sys
+import tempfile
+
+INSTALLER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'eduroam-linux-UCdN.py')
+
+
+def load_installer(path=INSTALLER):
+    """
+    Import the installer script without running it; run_installer()
+    is only called when the script is executed directly
+    """
+    path = os.path.abspath(path)
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source('cat_installer', path)
+    spec = importlib.util.spec_from_file_location('cat_installer', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['cat_installer'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def scratch_home(installer):
+    """
+    Point HOME at a new temporary directory holding the CA file the
+    installer expects and return its path
+    """
+    home = tempfile.mkdtemp(prefix='cat_bench_')
+    os.environ['HOME'] = home
+    os.environ.setdefault('USER', 'bench')
+    os.mkdir(os.path.join(home, '.cat_installer'), 0o700)
+    with open(os.path.join(home, '.cat_installer', 'ca.pem'), 'w') as cert:
+        cert.write(installer.Config.CA + "\n")
+    return home
+
+
+class UserData(object):
+    """Stand-in for InstallerData carrying only the credentials"""
+    def __init__(self, username='bench@ucn.cl', password='secret'):
+        self.username = username
+        self.password = password
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic hub logs, in the format of actividad_2019-04-32, for
+benchmarks.
+
+The badges of badges_to_load.csv (made-up ones past the 42 of the
+roster) sit in a room and wander around. The hub polls every badge
+every POLL_PERIOD seconds and logs, in order:
+
+- the audio chunks of 114 samples at 50 ms filled since the last poll,
+  the chunk still being filled included with the samples it has so far
+  (with probability `resend`) and sent again in full at the next poll;
+- the proximity scans made since the last poll, one every 15 s, with
+  the badges heard and an RSSI falling with the distance, plus gaussian
+  noise of `rssi_noise` dB.
+
+Samples stay around a noise floor of 3 while nobody speaks and go up
+while the wearer speaks, in turns of a few seconds. Voltages go down
+slowly over the session. log_timestamp is the poll time, timestamps are
+the badge time, a fraction of the badges (`unsynced`) start with a
+clock 60000 s behind until their first poll.
+
+    python benchmarks/workload.py --badges 42 --hours 8 --output data
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Scripts'))
+
+from badge_registry import BadgeRegistry, int_to_mac  # noqa: E402
+
+ROSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'badges_to_load.csv')
+START = 1554299803.642
+CHUNK_SAMPLES = 114
+SAMPLE_PERIOD = 50
+SCAN_PERIOD = 15
+POLL_PERIOD = 20.0
+ROOM = 12.0
+UNSET_CLOCK = 60680.0
+# per noise and speech level, samples to slice chunks from
+POOL_SIZE = 4096
+
+
+def roster_badges(count, roster=ROSTER):
+    """(MAC address, member id) of count badges"""
+    registry = BadgeRegistry.load(roster)
+    badges = [(int_to_mac(registry.macs[row]), registry.member_ids[row])
+              for row in range(len(registry))]
+    rand = random.Random(count)
+    while len(badges) < count:
+        address = int_to_mac(0xC00000000000 | rand.getrandbits(40))
+        if registry.member_id(address) is None:
+            registry.add(address, 1000 + len(badges))
+            badges.append((address, 1000 + len(badges)))
+    return badges[:count]
+
+
+class Badge(object):
+    """state of one simulated badge"""
+    def __init__(self, address, member_id, rand, start, unsynced):
+        self.address = address
+        self.member_id = member_id
+        self.rand = rand
+        self.x = rand.uniform(0, ROOM)
+        self.y = rand.uniform(0, ROOM)
+        self.voltage = rand.uniform(2.9, 3.0)
+        self.clock = -UNSET_CLOCK if unsynced else 0.0
+        # the chunk being filled and the next scan
+        self.chunk = start + rand.uniform(0, 5)
+        self.scan = (int(start) // SCAN_PERIOD + 1) * SCAN_PERIOD
+        self.speaking_until = start
+        self.silent_until = start + rand.expovariate(1 / 20.0)
+        # samples of the chunk being filled sent so far
+        self.sent = []
+
+    def walk(self, seconds):
+        step = 0.05 * math.sqrt(seconds)
+        self.x = min(ROOM, max(0.0, self.x + self.rand.gauss(0, step)))
+        self.y = min(ROOM, max(0.0, self.y + self.rand.gauss(0, step)))
+        self.voltage -= seconds * 2e-6 * self.rand.uniform(0.5, 1.5)
+
+
+class Workload(object):
+    """
+    Generator of the audio and proximity lines of a session of
+    `hours` hours
+    """
+    def __init__(self, badges=42, hours=1.0, start=START, resend=0.9,
+                 rssi_noise=4.0, unsynced=0.05, seed=1):
+        self.rand = random.Random(seed)
+        self.start = start
+        self.end = start + hours * 3600
+        self.resend = resend
+        self.rssi_noise = rssi_noise
+        self.badges = [Badge(address, member_id, self.rand, start,
+                             self.rand.random() < unsynced)
+                       for address, member_id in roster_badges(badges)]
+        self.quiet = [max(0, int(self.rand.gauss(3, 1.2)))
+                      for _ in range(POOL_SIZE)]
+        self.loud = [max(0, int(self.rand.gauss(24, 9)))
+                     for _ in range(POOL_SIZE)]
+
+    def polls(self):
+        """(poll time, badge) in poll order"""
+        count = len(self.badges)
+        time = self.start
+        while time < self.end:
+            for number, badge in enumerate(self.badges):
+                yield time + POLL_PERIOD * number / count, badge
+            time += POLL_PERIOD
+
+    def write(self, audio, proximity):
+        """write the logs to two open files; returns the lines written"""
+        lines = 0
+        for poll, badge in self.polls():
+            log_time = poll
+            for record in self.__audio(badge, poll):
+                log_time += 0.0035
+                audio.write(self.__line('audio received', log_time, record))
+                lines += 1
+            for record in self.__scans(badge, poll):
+                log_time += 0.0035
+                proximity.write(self.__line('proximity received', log_time,
+                                            record))
+                lines += 1
+            badge.clock = 0.0
+        return lines
+
+    def __line(self, kind, log_time, data):
+        return json.dumps({'data': data, 'log_timestamp': round(log_time, 3),
+                           'type': kind, 'log_index': -1}) + "\n"
+
+    def __data(self, badge, timestamp):
+        return {'member': badge.address, 'badge_address': badge.address,
+                'member_id': badge.member_id,
+                'voltage': round(badge.voltage, 3),
+                'timestamp': round(timestamp + badge.clock, 3)}
+
+    def __audio(self, badge, poll):
+        period = SAMPLE_PERIOD / 1000.0
+        chunk_time = CHUNK_SAMPLES * period
+        records = []
+        while badge.chunk + chunk_time <= poll:
+            records.append(self.__chunk(badge, CHUNK_SAMPLES))
+            badge.chunk += chunk_time
+        badge.walk(POLL_PERIOD)
+        filled = int((poll - badge.chunk) / period)
+        if filled > 0 and self.rand.random() < self.resend:
+            records.append(self.__chunk(badge, filled))
+        return records
+
+    def __chunk(self, badge, count):
+        data = self.__data(badge, badge.chunk)
+        period = SAMPLE_PERIOD / 1000.0
+        samples = badge.sent[:count]
+        time = badge.chunk + len(samples) * period
+        while len(samples) < count:
+            if time >= badge.silent_until:
+                badge.speaking_until = time + \
+                    self.rand.expovariate(1 / 4.0)
+                badge.silent_until = badge.speaking_until + \
+                    self.rand.expovariate(1 / 20.0)
+            if time < badge.speaking_until:
+                pool = self.loud
+                span = int((badge.speaking_until - time) / period) + 1
+            else:
+                pool = self.quiet
+                span = int((badge.silent_until - time) / period) + 1
+            span = min(span, count - len(samples))
+            first = self.rand.randrange(POOL_SIZE - span)
+            samples.extend(pool[first:first + span])
+            time += span * period
+        badge.sent = samples if count < CHUNK_SAMPLES else []
+        data.update({'sample_period': SAMPLE_PERIOD, 'num_samples': count,
+                     'samples': samples})
+        return data
+
+    def __scans(self, badge, poll):
+        records = []
+        while badge.scan <= poll:
+            data = self.__data(badge, badge.scan)
+            distances = {}
+            for other in self.badges:
+                if other is badge:
+                    continue
+                meters = math.hypot(badge.x - other.x, badge.y - other.y)
+                rssi = -55 - 20 * math.log10(max(meters, 0.5)) + \
+                    self.rand.gauss(0, self.rssi_noise)
+                if rssi > -95:
+                    distances[str(other.member_id)] = {
+                        'rssi': int(round(rssi)),
+                        'count': self.rand.randint(1, 4)}
+            data['rssi_distances'] = distances
+            records.append(data)
+            badge.scan += SCAN_PERIOD
+        return records
+
+
+def write_workload(directory, **parameters):
+    """write audio_data.txt and proximity_data.txt into directory"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = [os.path.join(directory, 'audio_data.txt'),
+             os.path.join(directory, 'proximity_data.txt')]
+    with open(paths[0], 'w') as audio, open(paths[1], 'w') as proximity:
+        Workload(**parameters).write(audio, proximity)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='write synthetic hub logs')
+    parser.add_argument('--output', default='.',
+                        help='directory to write the logs to')
+    parser.add_argument('--badges', type=int, default=42)
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--start', type=float, default=START)
+    parser.add_argument('--resend', type=float, default=0.9,
+                        help='probability of sending the chunk being '
+                        'filled at a poll')
+    parser.add_argument('--rssi-noise', type=float, default=4.0,
+                        help='standard deviation of the RSSI, dB')
+    parser.add_argument('--unsynced', type=float, default=0.05,
+                        help='fraction of badges starting with their '
+                        'clock not set')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    paths = write_workload(args.output, badges=args.badges,
+                           hours=args.hours, start=args.start,
+                           resend=args.resend, rssi_noise=args.rssi_noise,
+                           unsynced=args.unsynced, seed=args.seed)
+    for path in paths:
+        print("{0}: {1} bytes".format(path, os.path.getsize(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,25 +40,35 @@ The script is meant to run both under python 2.7 and python3. It tests
 for the crucial dbus module and if it does not find it and if it is not
 running python3 it will try rerunning iself again with python3.
 """
-import argparse
-import base64
-import getpass
-import os
-import re
-import subprocess
-import sys
-import uuid
-from shutil import copyfile
+import time
+# the clock is started before the other imports so that --profile-startup
+# can time them, hence the noqa on each
+CLOCK = getattr(time, 'monotonic', time.time)
+START_TIME = CLOCK()
+import argparse  # noqa: E402
+import base64  # noqa: E402
+import getpass  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import uuid  # noqa: E402
+from contextlib import contextmanager  # noqa: E402
+from shutil import copyfile  # noqa: E402
 
 NM_AVAILABLE = True
 CRYPTO_AVAILABLE = True
 DEBUG_ON = False
-DEV_NULL = open("/dev/null", "w")
-STDERR_REDIR = DEV_NULL
+DEV_NULL = None
+SUBPROCESSES = []
+dbus = None
+crypto = None
 
 
 def debug(msg):
-    """Print debugging messages to stdout"""
+    """Print debugging messages to stdout and add them to the trace"""
+    if TRACE.enabled:
+        TRACE.event('debug', str(msg))
     if not DEBUG_ON:
         return
     print("DEBUG:" + str(msg))
@@ -71,11 +81,241 @@ def missing_dbus():
     NM_AVAILABLE = False
 
 
+class StartupProfile(object):
+    """
+    Import and phase timings printed by --profile-startup
+    """
+    def __init__(self):
+        self.enabled = False
+        self.imports = [('standard library', CLOCK() - START_TIME)]
+        self.phases = []
+
+    @contextmanager
+    def importing(self, name):
+        """time a lazy module import"""
+        start = CLOCK()
+        try:
+            yield
+        finally:
+            self.imports.append((name, CLOCK() - start))
+
+    @contextmanager
+    def phase(self, name):
+        """time a phase of the installer run"""
+        start = CLOCK()
+        try:
+            with TRACE.span('phase', name):
+                yield
+        finally:
+            self.phases.append((name, CLOCK() - start))
+
+    def report(self):
+        """print the breakdown"""
+        if not self.enabled:
+            return
+        print("Startup profile (ms):")
+        print("  imports:")
+        for name, seconds in self.imports:
+            print("    {0:<28} {1:9.2f}".format(name, seconds * 1000))
+        print("  phases:")
+        for name, seconds in self.phases:
+            print("    {0:<28} {1:9.2f}".format(name, seconds * 1000))
+        print("  {0:<30} {1:9.2f}".format("total",
+                                          (CLOCK() - START_TIME) * 1000))
+        print("  subprocesses spawned: {0}".format(len(SUBPROCESSES)))
+
+
+PROFILE = StartupProfile()
+
+
+class NullSpan(object):
+    """the span handed out while tracing is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class TraceSpan(object):
+    """a span being timed, written out when it ends"""
+    def __init__(self, tracer, kind, name, fields):
+        self.tracer = tracer
+        self.record = fields
+        fields['kind'] = kind
+        fields['name'] = name
+
+    def __enter__(self):
+        self.tracer.push(self.record)
+        self.record['start'] = CLOCK()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record['end'] = CLOCK()
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        self.tracer.pop(self.record)
+        return False
+
+
+class Tracer(object):
+    """
+    Spans written as JSON lines by --trace: the phases of the run,
+    the steps inside them, every D-Bus call (every batch for the asyncio
+    backend) and every subprocess, plus the debug messages as events.
+    Each line has kind, name, start and end (CLOCK seconds), ms, the id
+    of the span and of the enclosing one, and the thread. While tracing
+    is off span() only returns a shared no-op context manager.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.summary = 0
+        self.spans = []
+        self.serial = 0
+        self.local = None
+        self.lock = None
+
+    def enable(self, path=None, summary=0):
+        """start tracing to path ('-' for stderr) and/or for a summary"""
+        import threading
+        if path == '-':
+            self.output = sys.stderr
+        elif path:
+            self.output = open(path, 'a')
+        self.summary = summary
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.enabled = True
+
+    def span(self, kind, name, **fields):
+        """context manager timing one span"""
+        if not self.enabled:
+            return NULL_SPAN
+        return TraceSpan(self, kind, name, fields)
+
+    def event(self, kind, name, **fields):
+        """a span without duration"""
+        with self.span(kind, name, **fields):
+            pass
+
+    def push(self, record):
+        """assign the span an id and make it the current one"""
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        with self.lock:
+            self.serial += 1
+            record['id'] = self.serial
+        record['parent'] = stack[-1]['id'] if stack else None
+        stack.append(record)
+
+    def pop(self, record):
+        """end the current span and write it out"""
+        import json
+        import threading
+        self.local.stack.pop()
+        record['ms'] = round((record['end'] - record['start']) * 1000, 3)
+        record['thread'] = threading.current_thread().name
+        with self.lock:
+            if self.output is not None:
+                self.output.write(json.dumps(record, sort_keys=True) + "\n")
+                self.output.flush()
+            if self.summary and record['kind'] != 'debug':
+                self.spans.append(record)
+
+    def report(self):
+        """print the slowest spans and the total time per span name"""
+        if not self.summary:
+            return
+        print("Slowest spans (ms):")
+        for record in sorted(self.spans, key=lambda rec: rec['ms'],
+                             reverse=True)[:self.summary]:
+            print("  {0:<10} {1:<32} {2:10.2f}".format(
+                record['kind'], record['name'][:32], record['ms']))
+        totals = {}
+        for record in self.spans:
+            key = (record['kind'], record['name'])
+            count, total = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, total + record['ms'])
+        print("Total per span name (ms):")
+        for (kind, name), (count, total) in sorted(
+                totals.items(), key=lambda item: item[1][1],
+                reverse=True)[:self.summary]:
+            print("  {0:<10} {1:<32} {2:6}x {3:10.2f}".format(
+                kind, name[:32], count, total))
+
+
+TRACE = Tracer()
+
+
+def stderr_redir():
+    """/dev/null for the stderr of dialog programs, opened on first use"""
+    global DEV_NULL
+    if DEV_NULL is None:
+        DEV_NULL = open(os.devnull, "w")
+    return DEV_NULL
+
+
+def import_dbus():
+    """
+    Import the dbus module on first use. Without it python2 reruns the
+    installer with python3, python3 marks NetworkManager as unavailable.
+    """
+    global dbus
+    if dbus is not None:
+        return True
+    if not NM_AVAILABLE:
+        return False
+    try:
+        with PROFILE.importing('dbus'):
+            import dbus
+    except ImportError:
+        if sys.version_info.major == 3:
+            missing_dbus()
+            return False
+        try:
+            spawn_call(['python3'] + sys.argv)
+        except:
+            missing_dbus()
+        sys.exit(0)
+    return True
+
+
+def import_crypto():
+    """
+    Import OpenSSL.crypto on first use, return None if it is missing
+    """
+    global crypto
+    global CRYPTO_AVAILABLE
+    if crypto is None and CRYPTO_AVAILABLE:
+        try:
+            with PROFILE.importing('OpenSSL.crypto'):
+                from OpenSSL import crypto
+        except ImportError:
+            CRYPTO_AVAILABLE = False
+    return crypto
+
+
 def byte_to_string(barray):
     """conversion utility"""
     return "".join([chr(x) for x in barray])
 
 
+def nm_version_name(version):
+    """map the NetworkManager version string to the supported API level"""
+    if re.match(r'^1\.', version):
+        return "1.0"
+    if re.match(r'^0\.9', version):
+        return "0.9"
+    if re.match(r'^0\.8', version):
+        return "0.8"
+    return Messages.unknown_version
+
+
 def get_input(prompt):
     if sys.version_info.major < 3:
         return raw_input(prompt)
@@ -85,56 +325,174 @@ def get_input(prompt):
 debug(sys.version_info.major)
 
 
-try:
-    import dbus
-except ImportError:
-    if sys.version_info.major == 3:
-        missing_dbus()
-    if sys.version_info.major < 3:
+def spawn(command, data=None, **kwargs):
+    """
+    subprocess.Popen and communicate, keeping count of the programs the
+    run started; returns the process and its output
+    """
+    SUBPROCESSES.append(command[0])
+    with TRACE.span('subprocess', command[0]):
+        process = subprocess.Popen(command, **kwargs)
+        out, err = process.communicate(data)
+    return process, out, err
+
+
+def spawn_call(command, **kwargs):
+    """subprocess.call keeping count of the programs the run started"""
+    SUBPROCESSES.append(command[0])
+    with TRACE.span('subprocess', command[0]):
+        return subprocess.call(command, **kwargs)
+
+
+class Capabilities(object):
+    """
+    Detection of the dialog programs and of the desktop environment.
+    Executables are looked up in PATH in-process instead of forking
+    `which`, and xprop is only run when the session variables do not
+    tell the desktop. Results are cached in memory and in
+    ~/.cache/cat_installer/capabilities.json under a key made of the
+    relevant environment variables and the modification times of the
+    PATH directories, so installing or removing a program, or changing
+    the session, invalidates them. New results are only written to the
+    file by save(), once at the end of the run.
+    """
+    env_vars = ('DISPLAY', 'WAYLAND_DISPLAY', 'PATH', 'KDE_FULL_SESSION',
+                'GNOME_DESKTOP_SESSION_ID', 'XDG_CURRENT_DESKTOP',
+                'DESKTOP_SESSION')
+
+    def __init__(self, cache_file=None):
+        if cache_file is None:
+            cache_dir = os.environ.get('XDG_CACHE_HOME') or \
+                os.path.join(os.environ.get('HOME', '/'), '.cache')
+            cache_file = os.path.join(cache_dir, 'cat_installer',
+                                      'capabilities.json')
+        self.cache_file = cache_file
+        self.key = None
+        self.results = None
+        self.changed = False
+
+    def env_key(self):
+        """the key the cached results are valid for"""
+        parts = [name + '=' + os.environ.get(name, '')
+                 for name in self.env_vars]
+        for path_dir in os.environ.get('PATH', '').split(os.pathsep):
+            try:
+                parts.append(path_dir + ':' +
+                             str(os.stat(path_dir or '.').st_mtime))
+            except OSError:
+                pass
+        return '\n'.join(parts)
+
+    def invalidate(self):
+        """drop the cached results"""
+        self.key = None
+        self.results = None
+        self.changed = False
         try:
-            subprocess.call(['python3'] + sys.argv)
-        except:
-            missing_dbus()
-        sys.exit(0)
+            os.remove(self.cache_file)
+        except OSError:
+            pass
 
-try:
-    from OpenSSL import crypto
-except ImportError:
-    CRYPTO_AVAILABLE = False
+    def which(self, program):
+        """full path of an executable in PATH or '' if there is none"""
+        results = self.__results()
+        if program not in results['which']:
+            results['which'][program] = find_executable(program)
+            self.changed = True
+        return results['which'][program]
+
+    def desktop_environment(self):
+        """kde, gnome, xfce or generic"""
+        results = self.__results()
+        if results.get('desktop') is None:
+            results['desktop'] = self.__detect_desktop_environment()
+            self.changed = True
+        return results['desktop']
+
+    def __results(self):
+        key = self.env_key()
+        if self.results is not None and self.key == key:
+            return self.results
+        self.key = key
+        self.results = self.__load(key)
+        if self.results is None:
+            debug("capability cache miss")
+            self.results = {'key': key, 'which': {}, 'desktop': None}
+        return self.results
+
+    def __load(self, key):
+        import json
+        try:
+            with open(self.cache_file) as cache:
+                results = json.load(cache)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(results, dict) or results.get('key') != key:
+            return None
+        return results
+
+    def save(self):
+        """write the results to the cache file if any were added"""
+        import json
+        if not self.changed:
+            return
+        self.changed = False
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w') as cache:
+                json.dump(self.results, cache)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError):
+            debug("cannot write the capability cache")
+
+    # the method below was partially copied
+    # from https://ubuntuforums.org/showthread.php?t=1139057
+    def __detect_desktop_environment(self):
+        desktop_environment = 'generic'
+        current = os.environ.get('XDG_CURRENT_DESKTOP', '').lower()
+        if os.environ.get('KDE_FULL_SESSION') == 'true':
+            desktop_environment = 'kde'
+        elif os.environ.get('GNOME_DESKTOP_SESSION_ID'):
+            desktop_environment = 'gnome'
+        elif 'xfce' in current.split(':'):
+            desktop_environment = 'xfce'
+        elif os.environ.get('DISPLAY') and self.which('xprop'):
+            try:
+                shell_command, out, err = spawn(
+                    ['xprop', '-root', '_DT_SAVE_MODE'],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                info = out.decode('utf-8').strip()
+            except (OSError, RuntimeError):
+                pass
+            else:
+                if ' = "xfce4"' in info:
+                    desktop_environment = 'xfce'
+        return desktop_environment
+
+
+def find_executable(program):
+    """
+    Look up an executable in PATH like `which` does, without forking
+    """
+    for path_dir in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(path_dir, program)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return ''
 
 
-if sys.version_info.major == 3 and sys.version_info.minor >= 8:
-    import distro
-else:
-    import platform
+CAPABILITIES = Capabilities()
 
 
-# the function below was partially copied
-# from https://ubuntuforums.org/showthread.php?t=1139057
 def detect_desktop_environment():
     """
     Detect what desktop type is used. This method is prepared for
     possible future use with password encryption on supported distros
     """
-    desktop_environment = 'generic'
-    if os.environ.get('KDE_FULL_SESSION') == 'true':
-        desktop_environment = 'kde'
-    elif os.environ.get('GNOME_DESKTOP_SESSION_ID'):
-        desktop_environment = 'gnome'
-    else:
-        try:
-            shell_command = subprocess.Popen(['xprop', '-root',
-                                              '_DT_SAVE_MODE'],
-                                             stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE)
-            out, err = shell_command.communicate()
-            info = out.decode('utf-8').strip()
-        except (OSError, RuntimeError):
-            pass
-        else:
-            if ' = "xfce4"' in info:
-                desktop_environment = 'xfce'
-    return desktop_environment
+    return CAPABILITIES.desktop_environment()
 
 
 def get_system():
@@ -144,8 +502,12 @@ def get_system():
     that can handle this well.
     """
     if sys.version_info.major == 3 and sys.version_info.minor >= 8:
+        with PROFILE.importing('distro'):
+            import distro
         system = distro.linux_distribution()
     else:
+        with PROFILE.importing('platform'):
+            import platform
         system = platform.linux_distribution()
     desktop = detect_desktop_environment()
     return [system[0], system[1], desktop]
@@ -173,7 +535,60 @@ def run_installer():
                         help='set silent flag')
     parser.add_argument('--pfxfile', action='store', dest='pfx_file',
                         help='set path to user certificate file')
-    args = parser.parse_args()
+    parser.add_argument('--backend', action='store', dest='backend',
+                        choices=['dbus', 'asyncio'], default='dbus',
+                        help='NetworkManager D-Bus backend; asyncio sends '
+                        'independent calls concurrently (needs dbus_next)')
+    parser.add_argument('--wpa-manifest', action='store',
+                        dest='wpa_manifest',
+                        help='write wpa_supplicant configs for all users '
+                        'in a CSV or JSON lines manifest and exit')
+    parser.add_argument('--wpa-output', action='store', dest='wpa_output',
+                        default='cat_installer_wpa',
+                        help='output directory (one file per host) or, '
+                        'with --wpa-combined, output file')
+    parser.add_argument('--wpa-combined', action='store_true',
+                        dest='wpa_combined', default=False,
+                        help='write all manifest users into one file')
+    parser.add_argument('--wpa-ca-cert', action='store', dest='wpa_ca_cert',
+                        help='CA certificate path used in bulk configs')
+    parser.add_argument('--offline-root', action='append',
+                        dest='offline_roots', default=[],
+                        help='write NetworkManager keyfiles into the root '
+                        'directory of a mounted image instead of using '
+                        'D-Bus; may be repeated')
+    parser.add_argument('--offline-user', action='store',
+                        dest='offline_user', default='pirate',
+                        help='image user owning the connections')
+    parser.add_argument('--offline-home', action='store',
+                        dest='offline_home',
+                        help='home directory of the image user')
+    parser.add_argument('--jobs', '-j', action='store', type=int,
+                        dest='jobs', default=4,
+                        help='images provisioned in parallel')
+    parser.add_argument('--daemon', action='store', dest='daemon_socket',
+                        help='keep running and provision the silent-mode '
+                        'requests received on this Unix socket')
+    parser.add_argument('--daemon-request', action='store',
+                        dest='daemon_request',
+                        help='send the --username, --password and '
+                        '--pfxfile values to the daemon listening on this '
+                        'socket and exit')
+    parser.add_argument('--trace', action='store', dest='trace',
+                        help='write timing spans as JSON lines to this '
+                        'file (- for stderr)')
+    parser.add_argument('--trace-summary', action='store', nargs='?',
+                        type=int, const=10, default=0, dest='trace_summary',
+                        help='print the N slowest spans (default 10) at '
+                        'the end')
+    parser.add_argument('--profile-startup', action='store_true',
+                        dest='profile_startup', default=False,
+                        help='print import and phase timings')
+    with PROFILE.phase('arguments'):
+        args = parser.parse_args()
+    PROFILE.enabled = args.profile_startup
+    if args.trace or args.trace_summary:
+        TRACE.enable(args.trace, args.trace_summary)
     if args.debug:
         DEBUG_ON = True
         print("Running debug mode")
@@ -186,28 +601,328 @@ def run_installer():
         silent = args.silent
     if args.pfx_file:
         pfx_file = args.pfx_file
-    debug(get_system())
-    debug("Calling InstallerData")
-    installer_data = InstallerData(silent=silent, username=username,
+    try:
+        if DEBUG_ON:
+            with PROFILE.phase('system detection'):
+                debug(get_system())
+        if args.wpa_manifest:
+            try:
+                with PROFILE.phase('create_bulk_wpa_conf'):
+                    count = WpaConf(args.wpa_ca_cert).create_bulk_wpa_conf(
+                        Config.ssids, args.wpa_manifest, args.wpa_output,
+                        args.wpa_combined)
+            except ValueError as err:
+                print(err)
+                sys.exit(1)
+            print("{0} users written to {1}".format(count, args.wpa_output))
+            return
+        if args.offline_roots:
+            with PROFILE.phase('provision_images'):
+                if not provision_offline(args, username, password, pfx_file):
+                    sys.exit(1)
+            return
+        if args.daemon_request:
+            reply = daemon_request(args.daemon_request, username, password,
+                                   pfx_file)
+            print(reply.get('message', reply['status']))
+            if reply['status'] != 'ok':
+                sys.exit(1)
+            return
+        if args.daemon_socket:
+            with PROFILE.phase('daemon startup'):
+                daemon = ProvisioningDaemon(args.daemon_socket,
+                                            args.backend)
+                if not daemon.start():
+                    sys.exit(1)
+            PROFILE.report()
+            daemon.serve_forever()
+            return
+        if sys.version_info.major < 3 and args.backend == 'dbus':
+            # rerun with python3 before any user interaction
+            import_dbus()
+        debug("Calling InstallerData")
+        with PROFILE.phase('InstallerData'):
+            installer_data = InstallerData(silent=silent, username=username,
+                                           password=password,
+                                           pfx_file=pfx_file)
+
+        # test dbus connection
+        with PROFILE.phase('connect_to_nm'):
+            if args.backend == 'asyncio':
+                config_tool = CatNMAsyncConfigTool()
+                NM_AVAILABLE = config_tool.connect_to_nm() is not None
+            elif NM_AVAILABLE:
+                config_tool = CatNMConfigTool()
+                if config_tool.connect_to_nm() is None:
+                    NM_AVAILABLE = False
+        if not NM_AVAILABLE:
+            # no dbus so ask if the user will want wpa_supplicant config
+            if installer_data.ask(Messages.save_wpa_conf, Messages.cont, 1):
+                sys.exit(1)
+        with PROFILE.phase('get_user_cred'):
+            installer_data.get_user_cred()
+        with PROFILE.phase('save_ca'):
+            installer_data.save_ca()
+        if NM_AVAILABLE:
+            with PROFILE.phase('add_connections'):
+                config_tool.add_connections(installer_data)
+        else:
+            with PROFILE.phase('create_wpa_conf'):
+                wpa_config = WpaConf()
+                wpa_config.create_wpa_conf(Config.ssids, installer_data)
+        installer_data.show_info(Messages.installation_finished)
+    finally:
+        debug("subprocesses spawned: {0} {1}".format(
+            len(SUBPROCESSES), SUBPROCESSES))
+        CAPABILITIES.save()
+        PROFILE.report()
+        TRACE.report()
+
+
+def provision_offline(args, username, password, pfx_file):
+    """
+    Provision mounted images with the credentials given on the command
+    line; no questions are asked
+    """
+    if Config.eap_outer != 'TLS' and not (username and password):
+        print("--username and --password are required with --offline-root")
+        return False
+    installer_data = InstallerData(silent=True, username=username,
                                    password=password, pfx_file=pfx_file)
-
-    # test dbus connection
-    if NM_AVAILABLE:
-        config_tool = CatNMConfigTool()
-        if config_tool.connect_to_nm() is None:
-            NM_AVAILABLE = False
-    if not NM_AVAILABLE:
-        # no dbus so ask if the user will want wpa_supplicant config
-        if installer_data.ask(Messages.save_wpa_conf, Messages.cont, 1):
-            sys.exit(1)
+    if Config.eap_outer == 'TLS' and Config.eap_inner != 'SILVERBULLET':
+        try:
+            copyfile(pfx_file, os.environ['HOME'] +
+                     '/.cat_installer/user.p12')
+        except (IOError, OSError):
+            print(Messages.user_cert_missing)
+            return False
     installer_data.get_user_cred()
-    installer_data.save_ca()
-    if NM_AVAILABLE:
-        config_tool.add_connections(installer_data)
-    else:
-        wpa_config = WpaConf()
-        wpa_config.create_wpa_conf(Config.ssids, installer_data)
-    installer_data.show_info(Messages.installation_finished)
+    failed = False
+    for root, error in provision_images(args.offline_roots,
+                                        args.offline_user,
+                                        args.offline_home, installer_data,
+                                        args.jobs):
+        if error is None:
+            print("provisioned " + root)
+        else:
+            failed = True
+            print("failed {0}: {1}".format(root, error))
+    return not failed
+
+
+class ProvisioningDaemon(object):
+    """
+    Long-running silent-mode installer. One NetworkManager connection,
+    the detected NM version and the connection index are kept for the
+    whole life of the daemon; requests arrive on a Unix socket as JSON
+    lines with the username, password and pfx_file keys and get a JSON
+    line with status ('ok' or 'error') and message back. Requests are
+    handled in threads and provisioning is serialized per SSID: the
+    connection of an SSID is replaced by one request at a time, while
+    other requests go on with other SSIDs. Every request works on its
+    own copy of the config tool, sharing the bus and the connection
+    index, and a personal PFX is copied to a file of its own per SSID
+    (user-<digest of the SSID>.p12), written under the lock of that
+    SSID, so that a connection always refers to the certificate it was
+    added with. The files all requests share (the CA certificate, a
+    SilverBullet PFX) and the deletion of Config.del_ssids go under one
+    more lock.
+    """
+    request_fields = ('username', 'password', 'pfx_file')
+
+    def __init__(self, socket_path, backend='dbus'):
+        import threading
+        self.socket_path = socket_path
+        self.backend = backend
+        self.config_tool = None
+        self.server = None
+        # the shared files, del_ssids and ssid_locks itself
+        self.lock = threading.Lock()
+        self.ssid_locks = {}
+
+    def start(self):
+        """
+        connect to NetworkManager, build the connection index and
+        listen on the socket
+        """
+        try:
+            import socketserver
+        except ImportError:
+            import SocketServer as socketserver
+        cat_dir = os.environ.get('HOME') + '/.cat_installer'
+        if not os.path.isdir(cat_dir):
+            os.mkdir(cat_dir, 0o700)
+        if self.backend == 'asyncio':
+            self.config_tool = CatNMAsyncConfigTool()
+        else:
+            self.__glib_main_loop()
+            self.config_tool = CatNMConfigTool()
+        if self.config_tool.connect_to_nm() is None:
+            print(Messages.dbus_error)
+            return False
+        self.config_tool.connection_index()
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """one JSON request and reply per line"""
+            def handle(self):
+                import json
+                for line in iter(self.rfile.readline, b''):
+                    try:
+                        request = json.loads(line.decode('utf-8'))
+                        if not isinstance(request, dict):
+                            raise ValueError("request is not an object")
+                    except ValueError as err:
+                        reply = {'status': 'error', 'message': str(err)}
+                    else:
+                        try:
+                            reply = daemon.provision(request)
+                        except Exception as err:
+                            debug("request failed: {0!r}".format(err))
+                            reply = {'status': 'error',
+                                     'message': "internal error"}
+                    self.wfile.write(json.dumps(reply).encode('utf-8') +
+                                     b'\n')
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        umask = os.umask(0o077)
+        try:
+            self.server = Server(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+        debug("listening on " + self.socket_path)
+        return True
+
+    def serve_forever(self):
+        """handle requests until interrupted"""
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            os.unlink(self.socket_path)
+
+    def provision(self, request):
+        """
+        install the connections for one request; returns the reply
+        """
+        with TRACE.span('request', 'provision'):
+            return self.__provision(request)
+
+    def __provision(self, request):
+        for field in self.request_fields:
+            if request.get(field) is None:
+                request[field] = ''
+            elif not isinstance(request[field], type(u'')):
+                return {'status': 'error',
+                        'message': "{0} must be a string".format(field)}
+        username = request['username']
+        password = request['password']
+        pfx_file = request['pfx_file']
+        personal_pfx = Config.eap_outer == 'TLS' and \
+            Config.eap_inner != 'SILVERBULLET'
+        if not personal_pfx and not (username and password):
+            return {'status': 'error',
+                    'message': "username and password are required"}
+        p12 = None
+        if personal_pfx:
+            try:
+                p12 = P12Engine(pfx_file)
+            except (IOError, OSError):
+                return {'status': 'error',
+                        'message': Messages.user_cert_missing}
+            if not p12.check_password(password):
+                return {'status': 'error',
+                        'message': Messages.incorrect_password}
+        import copy
+        try:
+            installer_data = InstallerData(silent=True, username=username,
+                                           password=password,
+                                           pfx_file=pfx_file)
+            # the password has been accepted already
+            installer_data.p12 = p12
+            with self.lock:
+                installer_data.get_user_cred()
+                installer_data.save_ca()
+            for ssid in Config.ssids:
+                with self.__ssid_lock(ssid):
+                    config_tool = copy.copy(self.config_tool)
+                    if p12 is not None:
+                        config_tool.pfx_file = self.ssid_pfx(ssid)
+                        copyfile(pfx_file, config_tool.pfx_file)
+                    config_tool.add_connections(installer_data, [ssid], [])
+            with self.lock:
+                copy.copy(self.config_tool).add_connections(
+                    installer_data, [], Config.del_ssids)
+        except SystemExit as err:
+            return {'status': 'error',
+                    'message': "installer exit status {0}".format(err.code)}
+        except (IOError, OSError) as err:
+            return {'status': 'error', 'message': str(err)}
+        return {'status': 'ok', 'message': Messages.installation_finished}
+
+    @staticmethod
+    def ssid_pfx(ssid):
+        """the copy of the personal PFX the connection of an SSID uses"""
+        import hashlib
+        return '{0}/.cat_installer/user-{1}.p12'.format(
+            os.environ['HOME'],
+            hashlib.sha1(ssid.encode('utf-8')).hexdigest()[:16])
+
+    def __ssid_lock(self, ssid):
+        import threading
+        with self.lock:
+            return self.ssid_locks.setdefault(ssid, threading.Lock())
+
+    @staticmethod
+    def __glib_main_loop():
+        """
+        run a GLib main loop in a thread so that the connection index
+        follows the changes made by other NM clients
+        """
+        import threading
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop, threads_init
+            from gi.repository import GLib
+        except ImportError:
+            debug("no GLib main loop, connection signals are not followed")
+            return
+        threads_init()
+        DBusGMainLoop(set_as_default=True)
+        thread = threading.Thread(target=GLib.MainLoop().run)
+        thread.daemon = True
+        thread.start()
+
+
+def daemon_request(socket_path, username, password, pfx_file):
+    """
+    send one provisioning request to a running daemon and return its
+    reply
+    """
+    import json
+    import socket
+    request = {'username': username, 'password': password,
+               'pfx_file': os.path.abspath(pfx_file) if pfx_file else ''}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        reply = client.makefile('rb').readline()
+    except socket.error as err:
+        return {'status': 'error', 'message': str(err)}
+    finally:
+        client.close()
+    try:
+        return json.loads(reply.decode('utf-8'))
+    except ValueError:
+        return {'status': 'error', 'message': "no reply from the daemon"}
 
 
 class Messages(object):
@@ -279,6 +994,481 @@ class Config(object):
     hint_user_input = False
 
 
+class ProvisioningState(object):
+    """
+    Digests of what earlier runs applied, kept in
+    ~/.cat_installer/state.json: the CA certificate, the user PFX, the
+    wpa_supplicant config and, per SSID, the connection settings (which
+    cover the servers, the EAP settings and the credentials) together
+    with the NetworkManager path of the connection. A rerun compares
+    against them and only changes what differs; the file itself is
+    only rewritten when an entry changes. As the connection settings
+    and the wpa_supplicant config hold the password, the digests are
+    HMACs keyed with random bytes kept apart in state.key, so that
+    state.json alone does not allow guessing the password. Entries are
+    read and recorded under a lock, for the threads of the daemon.
+    """
+    def __init__(self, path=None):
+        import threading
+        self.path = path
+        self.entries = None
+        self.key = None
+        self.lock = threading.RLock()
+
+    def digest(self, *values):
+        """digest of JSON-serializable values; byte arrays as lists"""
+        import json
+        data = json.dumps(values, sort_keys=True, default=list)
+        return self.__hash(data.encode('utf-8'))
+
+    def get(self, key):
+        """the recorded entry or None"""
+        with self.lock:
+            return self.__entries().get(key)
+
+    def unchanged(self, key, digest):
+        """True if the recorded digest equals the given one"""
+        entry = self.get(key)
+        return entry is not None and entry.get('digest') == digest
+
+    def record(self, key, digest, **extra):
+        """record an applied item, saving the state if it changed"""
+        entry = dict(extra, digest=digest)
+        with self.lock:
+            entries = self.__entries()
+            if entries.get(key) != entry:
+                entries[key] = entry
+                self.save()
+
+    def file_current(self, key, path, data):
+        """
+        True if an earlier run wrote data to path and the file still
+        holds it
+        """
+        digest = self.__hash(data)
+        if not self.unchanged(key, digest):
+            return False
+        try:
+            with open(path, 'rb') as current:
+                return self.__hash(current.read()) == digest
+        except (IOError, OSError):
+            return False
+
+    def record_file(self, key, data):
+        """record the content written to a file"""
+        self.record(key, self.__hash(data))
+
+    def save(self):
+        """write the state file"""
+        import json
+        try:
+            with self.lock, atomic_open(self.__path()) as state:
+                json.dump(self.entries, state, sort_keys=True)
+        except (IOError, OSError):
+            debug("cannot write the provisioning state")
+
+    def __path(self):
+        if self.path is None:
+            return os.environ.get('HOME') + '/.cat_installer/state.json'
+        return self.path
+
+    def __hash(self, data):
+        import hashlib
+        import hmac
+        with self.lock:
+            if self.key is None:
+                self.key = self.__load_key()
+        return hmac.new(self.key, data, hashlib.sha256).hexdigest()
+
+    def __load_key(self):
+        """
+        the key in state.key, created on first use; the new key is
+        linked into place so that concurrent first uses all end up with
+        the one that got there first. Without a key file the digests
+        never match and everything is applied again.
+        """
+        key_file = os.path.join(os.path.dirname(self.__path()),
+                                'state.key')
+        tmp_file = '{0}.{1}.tmp'.format(key_file, uuid.uuid4().hex)
+        key = os.urandom(32)
+        try:
+            if not os.path.exists(key_file):
+                with open_private(tmp_file, 'wb') as stored:
+                    stored.write(key)
+                    stored.flush()
+                    os.fsync(stored.fileno())
+                try:
+                    os.link(tmp_file, key_file)
+                except OSError:
+                    pass
+                os.remove(tmp_file)
+            with open(key_file, 'rb') as stored:
+                stored_key = stored.read()
+        except (IOError, OSError):
+            debug("cannot read or write the provisioning state key")
+            return key
+        return stored_key if len(stored_key) == 32 else key
+
+    def __entries(self):
+        if self.entries is None:
+            import json
+            try:
+                with open(self.__path()) as state:
+                    self.entries = json.load(state)
+            except (IOError, OSError, ValueError):
+                self.entries = {}
+            if not isinstance(self.entries, dict):
+                self.entries = {}
+        return self.entries
+
+
+STATE = ProvisioningState()
+
+
+class P12Engine(object):
+    """
+    Password checks and subject extraction for the user PKCS#12 file.
+    The file is read once and kept in memory, the accepted password and
+    the certificate subject are memoized, so password retries neither
+    re-read the file nor start openssl. The cryptography module is used
+    if available, then pyOpenSSL; without either the password is checked
+    against the PKCS#12 MAC in pure python and the subject is read from
+    the certificate bag. Only when that bag is encrypted openssl is run,
+    once, after the password has been accepted.
+    """
+    oid_data = '1.2.840.113549.1.7.1'
+    oid_cert_bag = '1.2.840.113549.1.12.10.1.3'
+    oid_x509_cert = '1.2.840.113549.1.9.22.1'
+    oid_local_key_id = '1.2.840.113549.1.9.21'
+    subject_oids = {'2.5.4.3': 'cn', '1.2.840.113549.1.9.1': 'emailaddress'}
+    digest_oids = {'1.3.14.3.2.26': 'sha1',
+                   '2.16.840.1.101.3.4.2.4': 'sha224',
+                   '2.16.840.1.101.3.4.2.1': 'sha256',
+                   '2.16.840.1.101.3.4.2.2': 'sha384',
+                   '2.16.840.1.101.3.4.2.3': 'sha512'}
+
+    def __init__(self, pfx_file):
+        with open(pfx_file, 'rb') as pfx:
+            self.data = pfx.read()
+        self.backend = None
+        self.password = None
+        self.certificate = None
+        self.cert_subject = None
+
+    def check_password(self, password):
+        """
+        test the import password; the first accepted one is remembered
+        """
+        if self.password is not None:
+            return password == self.password
+        if self.backend is None:
+            self.backend = self.__select_backend()
+            debug("p12 backend: " + self.backend)
+        if self.backend == 'cryptography':
+            accepted = self.__check_cryptography(password)
+        elif self.backend == 'pyopenssl':
+            accepted = self.__check_pyopenssl(password)
+        else:
+            accepted = self.__check_mac(password)
+        if accepted:
+            self.password = password
+        return accepted
+
+    def subject(self):
+        """
+        cn and emailaddress of the user certificate subject, after
+        a password has been accepted
+        """
+        if self.cert_subject is None:
+            if self.certificate is None:
+                self.cert_subject = self.__openssl_subject()
+            else:
+                self.cert_subject = self.certificate
+        return self.cert_subject
+
+    @staticmethod
+    def __select_backend():
+        try:
+            # imported rather than looked up, so that a broken install
+            # falls back and the import cost shows in --profile-startup
+            with PROFILE.importing('cryptography'):
+                from cryptography.hazmat.primitives.serialization \
+                    import pkcs12  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return 'cryptography'
+        if import_crypto() is not None:
+            return 'pyopenssl'
+        return 'python'
+
+    def __check_cryptography(self, password):
+        from cryptography.hazmat.primitives.serialization import pkcs12
+        from cryptography.x509.oid import NameOID
+        try:
+            key, cert, extra = pkcs12.load_key_and_certificates(
+                self.data, password.encode('utf8'))
+        except (ValueError, TypeError):
+            return False
+        self.certificate = {}
+        if cert is not None:
+            for oid, name in ((NameOID.COMMON_NAME, 'cn'),
+                              (NameOID.EMAIL_ADDRESS, 'emailaddress')):
+                attrs = cert.subject.get_attributes_for_oid(oid)
+                if attrs:
+                    self.certificate[name] = attrs[0].value
+        return True
+
+    def __check_pyopenssl(self, password):
+        try:
+            p12 = crypto.load_pkcs12(self.data, password)
+        except:
+            return False
+        subject = p12.get_certificate().get_subject()
+        self.certificate = {}
+        if subject.commonName:
+            self.certificate['cn'] = subject.commonName
+        if subject.emailAddress:
+            self.certificate['emailaddress'] = subject.emailAddress
+        return True
+
+    def __check_mac(self, password):
+        """
+        verify the PFX MAC (RFC 7292) with the PKCS#12 key derivation;
+        files this parser does not understand are checked with openssl
+        """
+        import hashlib
+        import hmac
+        data = bytearray(self.data)
+        try:
+            pfx = self.__children(data, 0, len(data))[0]
+            version, auth_safe, mac_data = \
+                self.__children(data, pfx[1], pfx[2])[:3]
+            content_type, content = \
+                self.__children(data, auth_safe[1], auth_safe[2])
+            if self.__oid(data, content_type) != self.oid_data:
+                raise ValueError("signed PFX")
+            auth_safe_data = self.__children(data, content[1], content[2])[0]
+            if auth_safe_data[0] != 0x04:
+                raise ValueError("BER encoded PFX")
+            mac_fields = self.__children(data, mac_data[1], mac_data[2])
+            digest_info = self.__children(data, mac_fields[0][1],
+                                          mac_fields[0][2])
+            digest_alg = self.__children(data, digest_info[0][1],
+                                         digest_info[0][2])[0]
+            hash_name = self.digest_oids[self.__oid(data, digest_alg)]
+            digest = bytes(data[digest_info[1][1]:digest_info[1][2]])
+            salt = data[mac_fields[1][1]:mac_fields[1][2]]
+            iterations = 1
+            if len(mac_fields) > 2:
+                iterations = self.__integer(data, mac_fields[2])
+        except (IndexError, KeyError, ValueError) as err:
+            debug("pure python p12 check not possible: " + str(err))
+            return self.__openssl_check(password)
+        key = pkcs12_kdf(hash_name, password, salt, 3, iterations,
+                         hashlib.new(hash_name).digest_size)
+        mac = hmac.new(bytes(key), bytes(data[auth_safe_data[1]:
+                                              auth_safe_data[2]]),
+                       getattr(hashlib, hash_name)).digest()
+        if not hmac.compare_digest(mac, digest):
+            return False
+        self.certificate = self.__plain_certificate(data, auth_safe_data)
+        return True
+
+    def __plain_certificate(self, data, auth_safe_data):
+        """
+        subject of the user certificate if it is stored unencrypted,
+        None otherwise
+        """
+        found = None
+        try:
+            safe = self.__children(data, auth_safe_data[1],
+                                   auth_safe_data[2])[0]
+            for content_info in self.__children(data, safe[1], safe[2]):
+                content_type, content = self.__children(
+                    data, content_info[1], content_info[2])[:2]
+                if self.__oid(data, content_type) != self.oid_data:
+                    continue
+                octets = self.__children(data, content[1], content[2])[0]
+                bags = self.__children(data, octets[1], octets[2])[0]
+                for bag in self.__children(data, bags[1], bags[2]):
+                    fields = self.__children(data, bag[1], bag[2])
+                    if self.__oid(data, fields[0]) != self.oid_cert_bag:
+                        continue
+                    cert_bag = self.__children(data, fields[1][1],
+                                               fields[1][2])[0]
+                    cert_id, cert_value = self.__children(
+                        data, cert_bag[1], cert_bag[2])
+                    if self.__oid(data, cert_id) != self.oid_x509_cert:
+                        continue
+                    cert = self.__children(data, cert_value[1],
+                                           cert_value[2])[0]
+                    subject = self.__cert_subject(data, cert)
+                    attrs = b''
+                    if len(fields) > 2:
+                        attrs = bytes(data[fields[2][1]:fields[2][2]])
+                    if found is None or \
+                            self.__der_oid(self.oid_local_key_id) in attrs:
+                        found = subject
+        except (IndexError, ValueError):
+            return None
+        return found
+
+    def __cert_subject(self, data, cert):
+        # cert is the OCTET STRING holding the DER certificate
+        certificate = self.__children(data, cert[1], cert[2])[0]
+        tbs = self.__children(data, certificate[1], certificate[2])[0]
+        fields = self.__children(data, tbs[1], tbs[2])
+        if fields[0][0] == 0xa0:
+            fields = fields[1:]
+        subject = {}
+        # serial, signature, issuer, validity, subject
+        for rdn in self.__children(data, fields[4][1], fields[4][2]):
+            for attr in self.__children(data, rdn[1], rdn[2]):
+                oid, value = self.__children(data, attr[1], attr[2])[:2]
+                name = self.subject_oids.get(self.__oid(data, oid))
+                if name:
+                    raw = bytes(data[value[1]:value[2]])
+                    if value[0] == 0x1e:
+                        subject[name] = raw.decode('utf-16-be')
+                    elif value[0] == 0x14:
+                        subject[name] = raw.decode('latin-1')
+                    else:
+                        subject[name] = raw.decode('utf-8')
+        return subject
+
+    def __openssl_check(self, password):
+        command = ['openssl', 'pkcs12', '-passin', 'pass:' + password,
+                   '-nokeys', '-clcerts']
+        try:
+            shell_command, out, err = spawn(command, self.data,
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+        except OSError:
+            return False
+        if shell_command.returncode != 0:
+            return False
+        self.certificate = self.__parse_openssl_subject(
+            out.decode('utf-8').strip())
+        return True
+
+    def __openssl_subject(self):
+        debug("using openssl")
+        self.certificate = {}
+        if self.password is not None:
+            self.__openssl_check(self.password)
+        return self.certificate
+
+    @staticmethod
+    def __parse_openssl_subject(out_str):
+        subject_lines = re.findall(r'subject=/?(.*)$', out_str, re.MULTILINE)
+        cert_prop = {}
+        if not subject_lines:
+            return cert_prop
+        for field in re.split(r'\s*[/,]\s*', subject_lines[0]):
+            if field:
+                cert_field = re.split(r'\s*=\s*', field)
+                if len(cert_field) > 1:
+                    cert_prop[cert_field[0].lower()] = cert_field[1]
+        return cert_prop
+
+    @staticmethod
+    def __element(data, pos):
+        """tag, content start and content end of the DER element at pos"""
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            num = length & 0x7f
+            if num == 0:
+                raise ValueError("indefinite length")
+            length = 0
+            for byte in data[pos:pos + num]:
+                length = length << 8 | byte
+            pos += num
+        if pos + length > len(data):
+            raise ValueError("truncated element")
+        return tag, pos, pos + length
+
+    def __children(self, data, start, end):
+        elements = []
+        while start < end:
+            element = self.__element(data, start)
+            elements.append(element)
+            start = element[2]
+        return elements
+
+    @staticmethod
+    def __oid(data, element):
+        if element[0] != 0x06:
+            raise ValueError("OID expected")
+        raw = data[element[1]:element[2]]
+        parts = [raw[0] // 40, raw[0] % 40]
+        value = 0
+        for byte in raw[1:]:
+            value = value << 7 | (byte & 0x7f)
+            if not byte & 0x80:
+                parts.append(value)
+                value = 0
+        return '.'.join(str(part) for part in parts)
+
+    @staticmethod
+    def __der_oid(oid):
+        parts = [int(part) for part in oid.split('.')]
+        raw = bytearray([parts[0] * 40 + parts[1]])
+        for part in parts[2:]:
+            chunk = bytearray([part & 0x7f])
+            part >>= 7
+            while part:
+                chunk.insert(0, part & 0x7f | 0x80)
+                part >>= 7
+            raw.extend(chunk)
+        return bytes(bytearray([0x06, len(raw)]) + raw)
+
+    @staticmethod
+    def __integer(data, element):
+        value = 0
+        for byte in data[element[1]:element[2]]:
+            value = value << 8 | byte
+        return value
+
+
+def pkcs12_kdf(hash_name, password, salt, id_byte, iterations, size):
+    """
+    PKCS#12 key derivation (RFC 7292 appendix B.2); the password is
+    taken as a BMPString with the terminating null character
+    """
+    import hashlib
+    new_hash = getattr(hashlib, hash_name)
+    block = new_hash().block_size
+    pwd = bytearray((password + u'\0').encode('utf-16-be')) \
+        if password else bytearray()
+    salt = bytearray(salt)
+
+    def fill(value):
+        if not value:
+            return bytearray()
+        count = (len(value) + block - 1) // block * block
+        return bytearray((value * (count // len(value) + 1))[:count])
+    diversifier = bytearray([id_byte] * block)
+    in_data = fill(salt) + fill(pwd)
+    key = bytearray()
+    while len(key) < size:
+        digest = new_hash(bytes(diversifier + in_data)).digest()
+        for _ in range(iterations - 1):
+            digest = new_hash(digest).digest()
+        key.extend(bytearray(digest))
+        extra = fill(bytearray(digest))[:block]
+        for pos in range(0, len(in_data), block):
+            carry = 1
+            for i in range(block - 1, -1, -1):
+                carry += in_data[pos + i] + extra[i]
+                in_data[pos + i] = carry & 0xff
+                carry >>= 8
+    return key[:size]
+
+
 class InstallerData(object):
     """
     General user interaction handling, supports zenity, kdialog and
@@ -291,6 +1481,7 @@ class InstallerData(object):
         self.password = password
         self.silent = silent
         self.pfx_file = pfx_file
+        self.p12 = None
         debug("starting constructor")
         if silent:
             self.graphics = 'tty'
@@ -319,9 +1510,14 @@ class InstallerData(object):
         (create directory if needed)
         """
         certfile = os.environ.get('HOME') + '/.cat_installer/ca.pem'
+        data = (Config.CA + "\n").encode('utf-8')
+        if STATE.file_current('ca', certfile, data):
+            debug("cert unchanged")
+            return
         debug("saving cert")
-        with open(certfile, 'w') as cert:
-            cert.write(Config.CA + "\n")
+        with open(certfile, 'wb') as cert:
+            cert.write(data)
+        STATE.record_file('ca', data)
 
     def ask(self, question, prompt='', default=None):
         """
@@ -356,7 +1552,7 @@ class InstallerData(object):
         elif self.graphics == 'kdialog':
             command = ['kdialog', '--yesno', question + "\n\n" + prompt,
                        '--title=', Config.title]
-        returncode = subprocess.call(command, stderr=STDERR_REDIR)
+        returncode = spawn_call(command, stderr=stderr_redir())
         return returncode
 
     def show_info(self, data):
@@ -374,7 +1570,7 @@ class InstallerData(object):
             command = ['kdialog', '--msgbox', data]
         else:
             sys.exit(1)
-        subprocess.call(command, stderr=STDERR_REDIR)
+        spawn_call(command, stderr=stderr_redir())
 
     def confirm_exit(self):
         """
@@ -397,7 +1593,7 @@ class InstallerData(object):
             command = ['kdialog', '--sorry', text]
         else:
             sys.exit(1)
-        subprocess.call(command, stderr=STDERR_REDIR)
+        spawn_call(command, stderr=stderr_redir())
 
     def prompt_nonempty_string(self, show, prompt, val=''):
         """
@@ -436,9 +1632,9 @@ class InstallerData(object):
 
         output = ''
         while not output:
-            shell_command = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE)
-            out, err = shell_command.communicate()
+            shell_command, out, err = spawn(command,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
             output = out.decode('utf-8').strip()
             if shell_command.returncode == 1:
                 self.confirm_exit()
@@ -484,79 +1680,55 @@ class InstallerData(object):
         self.password = password
 
     def __get_graphics_support(self):
+        with TRACE.span('step', 'graphics detection'):
+            self.__detect_graphics()
+
+    def __detect_graphics(self):
         if os.environ.get('DISPLAY') is not None:
-            shell_command = subprocess.Popen(['which', 'zenity'],
-                                             stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE)
-            shell_command.wait()
-            if shell_command.returncode == 0:
+            if CAPABILITIES.which('zenity'):
                 self.graphics = 'zenity'
+            elif CAPABILITIES.which('kdialog'):
+                self.graphics = 'kdialog'
             else:
-                shell_command = subprocess.Popen(['which', 'kdialog'],
-                                                 stdout=subprocess.PIPE,
-                                                 stderr=subprocess.PIPE)
-                shell_command.wait()
-                # out, err = shell_command.communicate()
-                if shell_command.returncode == 0:
-                    self.graphics = 'kdialog'
-                else:
-                    self.graphics = 'tty'
+                self.graphics = 'tty'
         else:
             self.graphics = 'tty'
 
     def __process_p12(self):
+        with TRACE.span('step', 'process_p12'):
+            return self.__check_p12()
+
+    def __check_p12(self):
         debug('process_p12')
-        pfx_file = os.environ['HOME'] + '/.cat_installer/user.p12'
-        if CRYPTO_AVAILABLE:
-            debug("using crypto")
+        if self.p12 is None:
             try:
-                p12 = crypto.load_pkcs12(open(pfx_file, 'rb').read(),
-                                         self.password)
-            except:
-                debug("incorrect password")
-                return False
-            else:
-                if Config.use_other_tls_id:
-                    return True
-                try:
-                    self.username = p12.get_certificate().\
-                        get_subject().commonName
-                except:
-                    self.username = p12.get_certificate().\
-                        get_subject().emailAddress
-                return True
-        else:
-            debug("using openssl")
-            command = ['openssl', 'pkcs12', '-in', pfx_file, '-passin',
-                       'pass:' + self.password, '-nokeys', '-clcerts']
-            shell_command = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE)
-            out, err = shell_command.communicate()
-            if shell_command.returncode != 0:
+                self.p12 = P12Engine(os.environ['HOME'] +
+                                     '/.cat_installer/user.p12')
+            except (IOError, OSError):
+                debug("cannot read the user certificate file")
                 return False
-            if Config.use_other_tls_id:
-                return True
-            out_str = out.decode('utf-8').strip()
-            subject = re.split(r'\s*[/,]\s*',
-                               re.findall(r'subject=/?(.*)$',
-                                          out_str, re.MULTILINE)[0])
-            cert_prop = {}
-            for field in subject:
-                if field:
-                    cert_field = re.split(r'\s*=\s*', field)
-                    cert_prop[cert_field[0].lower()] = cert_field[1]
-            if cert_prop['cn'] and re.search(r'@', cert_prop['cn']):
-                debug('Using cn: ' + cert_prop['cn'])
-                self.username = cert_prop['cn']
-            elif cert_prop['emailaddress'] and \
-                    re.search(r'@', cert_prop['emailaddress']):
-                debug('Using email: ' + cert_prop['emailaddress'])
-                self.username = cert_prop['emailaddress']
-            else:
-                self.username = ''
-                self.alert("Unable to extract username "
-                           "from the certificate")
+        if not self.p12.check_password(self.password):
+            debug("incorrect password")
+            return False
+        if Config.use_other_tls_id:
             return True
+        subject = self.p12.subject()
+        common_name = subject.get('cn', '')
+        email = subject.get('emailaddress', '')
+        if '@' in common_name:
+            debug('Using cn: ' + common_name)
+            self.username = common_name
+        elif '@' in email:
+            debug('Using email: ' + email)
+            self.username = email
+        elif common_name:
+            debug('Using cn: ' + common_name)
+            self.username = common_name
+        else:
+            self.username = ''
+            self.alert("Unable to extract username "
+                       "from the certificate")
+        return True
 
     def __select_p12_file(self):
         """
@@ -595,23 +1767,28 @@ class InstallerData(object):
                        ' | *.p12 *.P12 *.pfx *.PFX', '--file-filter=' +
                        Messages.all_filter + ' | *',
                        '--title=' + Messages.p12_title]
-            shell_command = subprocess.Popen(command, stdout=subprocess.PIPE,
+            shell_command, cert, err = spawn(command,
+                                             stdout=subprocess.PIPE,
                                              stderr=subprocess.PIPE)
-            cert, err = shell_command.communicate()
         if self.graphics == 'kdialog':
             command = ['kdialog', '--getopenfilename',
                        '.', '*.p12 *.P12 *.pfx *.PFX | ' +
                        Messages.p12_filter, '--title', Messages.p12_title]
-            shell_command = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                             stderr=STDERR_REDIR)
-            cert, err = shell_command.communicate()
+            shell_command, cert, err = spawn(command,
+                                             stdout=subprocess.PIPE,
+                                             stderr=stderr_redir())
         return cert.decode('utf-8').strip()
 
     def __save_sb_pfx(self):
         """write the user PFX file"""
         certfile = os.environ.get('HOME') + '/.cat_installer/user.p12'
+        data = base64.b64decode(Config.sb_user_file)
+        if STATE.file_current('sb_pfx', certfile, data):
+            debug("user PFX unchanged")
+            return
         with open(certfile, 'wb') as cert:
-            cert.write(base64.b64decode(Config.sb_user_file))
+            cert.write(data)
+        STATE.record_file('sb_pfx', data)
 
     def __get_p12_cred(self):
         """get the password for the PFX file"""
@@ -697,36 +1874,338 @@ class InstallerData(object):
         return True
 
 
+WPA_PLAIN_STRING = re.compile(r'^[\x20\x21\x23-\x5b\x5d-\x7e]*$')
+
+
+def wpa_string(value):
+    """
+    Format a string value for wpa_supplicant.conf. Values that cannot
+    be written verbatim between double quotes (quotes, backslashes,
+    non-ASCII or control characters) are written as an unquoted hex
+    string, which wpa_supplicant accepts for every string field.
+    """
+    if WPA_PLAIN_STRING.match(value):
+        return '"' + value + '"'
+    return ''.join('{0:02x}'.format(byte)
+                   for byte in bytearray(value.encode('utf-8')))
+
+
 class WpaConf(object):
     """
     Prepare and save wpa_supplicant config file
     """
-    def __prepare_network_block(self, ssid, user_data):
-        altsubj_match = "altsubject_match=\"%s\"" % ";".join(Config.servers)
-        out = """network={
-        ssid=""" + ssid + """
+    # files kept open in the per host mode of create_bulk_wpa_conf
+    max_open_files = 64
+
+    def __init__(self, ca_cert=None):
+        if ca_cert is None:
+            ca_cert = os.environ.get('HOME') + '/.cat_installer/ca.pem'
+        self.ca_cert = ca_cert
+        self.template = None
+
+    def __compile_template(self, ssids):
+        """
+        Render everything that does not depend on the user once; a
+        network block is then the concatenation of the parts with the
+        identity and the password
+        """
+        template = []
+        for ssid in ssids:
+            head = """network={
+        ssid=""" + wpa_string(ssid) + """
         key_mgmt=WPA-EAP
         pairwise=CCMP
         group=CCMP TKIP
         eap=""" + Config.eap_outer + """
-        ca_cert=\"""" + os.environ.get('HOME') + """/.cat_installer/ca.pem\"
-        identity=\"""" + user_data.username + """\"
-        altsubject_match=\"""" + altsubj_match + """\"
-        phase2=\"auth=""" + Config.eap_inner + """\"
-        password=\"""" + user_data.password + """\"
-        anonymous_identity=\"""" + Config.anonymous_identity + """\"
+        ca_cert=""" + wpa_string(self.ca_cert) + """
+        identity="""
+            middle = """
+        altsubject_match=""" + wpa_string(";".join(Config.servers)) + """
+        phase2=""" + wpa_string("auth=" + Config.eap_inner) + """
+        password="""
+            tail = """
+        anonymous_identity=""" + wpa_string(Config.anonymous_identity) + """
 }
-    """
-        return out
+"""
+            template.append((head, middle, tail))
+        self.template = template
+
+    def __prepare_network_blocks(self, username, password):
+        identity = wpa_string(username)
+        password = wpa_string(password)
+        return ''.join([head + identity + middle + password + tail
+                        for head, middle, tail in self.template])
 
     def create_wpa_conf(self, ssids, user_data):
         """Create and save the wpa_supplicant config file"""
         wpa_conf = os.environ.get('HOME') + \
             '/.cat_installer/cat_installer.conf'
-        with open(wpa_conf, 'w') as conf:
-            for ssid in ssids:
-                net = self.__prepare_network_block(ssid, user_data)
-                conf.write(net)
+        self.__compile_template(ssids)
+        data = self.__prepare_network_blocks(user_data.username,
+                                             user_data.password)
+        if STATE.file_current('wpa_conf', wpa_conf, data.encode('utf-8')):
+            debug("wpa_supplicant config unchanged")
+            return
+        with atomic_open(wpa_conf) as conf:
+            conf.write(data)
+        STATE.record_file('wpa_conf', data.encode('utf-8'))
+
+    def create_bulk_wpa_conf(self, ssids, manifest, output, combined=False):
+        """
+        Stream the users of a manifest into wpa_supplicant config files:
+        one combined file, or one file per host in the output directory.
+        Every file is written under a temporary name and renamed into
+        place when complete. Returns the number of users written.
+        """
+        self.__compile_template(ssids)
+        count = 0
+        if combined:
+            with atomic_open(output) as conf:
+                for user in read_user_manifest(manifest):
+                    conf.write(self.__prepare_network_blocks(
+                        user['username'], user['password']))
+                    count += 1
+            return count
+        if not os.path.isdir(output):
+            os.makedirs(output, 0o700)
+        from collections import OrderedDict
+        suffix = '.conf.{0}.tmp'.format(os.getpid())
+        open_files = OrderedDict()
+        try:
+            for user in read_user_manifest(manifest):
+                host = re.sub(r'[^A-Za-z0-9._@-]', '_',
+                              user.get('host') or user['username'])
+                conf = open_files.pop(host, None)
+                if conf is None:
+                    if len(open_files) >= self.max_open_files:
+                        # the first entry is the least recently used host
+                        open_files.popitem(last=False)[1].close()
+                    conf = open_private(os.path.join(output, host + suffix),
+                                        'a')
+                open_files[host] = conf
+                conf.write(self.__prepare_network_blocks(
+                    user['username'], user['password']))
+                count += 1
+        except BaseException:
+            for conf in open_files.values():
+                conf.close()
+            for name in os.listdir(output):
+                if name.endswith(suffix):
+                    os.remove(os.path.join(output, name))
+            raise
+        for conf in open_files.values():
+            conf.close()
+        for name in os.listdir(output):
+            if name.endswith(suffix):
+                tmp_file = os.path.join(output, name)
+                fsync_file(tmp_file)
+                os.rename(tmp_file, tmp_file[:-len(suffix)] + '.conf')
+        return count
+
+
+def open_private(path, mode='w'):
+    """open a file for writing, readable by the owner only"""
+    flags = os.O_WRONLY | os.O_CREAT
+    if 'a' in mode:
+        flags |= os.O_APPEND
+    else:
+        flags |= os.O_TRUNC
+    return os.fdopen(os.open(path, flags, 0o600), mode, 1 << 20)
+
+
+def fsync_file(path):
+    """flush a file written earlier to the disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_open(path):
+    """
+    Write a file under a temporary name and rename it into place once
+    it is complete, so readers never see a partial file
+    """
+    # unique per call, as the daemon threads write the state file
+    tmp_file = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    conf = open_private(tmp_file)
+    try:
+        yield conf
+        conf.flush()
+        os.fsync(conf.fileno())
+    except BaseException:
+        conf.close()
+        os.remove(tmp_file)
+        raise
+    conf.close()
+    os.rename(tmp_file, path)
+
+
+def read_user_manifest(manifest):
+    """
+    Yield the users of a manifest one at a time as dictionaries with
+    username, password and optionally host. JSON lines files (.jsonl,
+    .json) hold one object per line; other files are read as CSV and
+    need a header naming the columns. A leading byte order mark is
+    ignored. A line without a username or a password raises ValueError
+    naming the manifest and the line.
+    """
+    import io
+    if manifest.endswith('.jsonl') or manifest.endswith('.json'):
+        import json
+        with io.open(manifest, encoding='utf-8-sig') as lines:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    user = json.loads(line)
+                except ValueError:
+                    user = None
+                yield manifest_user(manifest, number, user)
+        return
+    import csv
+    with io.open(manifest, encoding='utf-8-sig', newline='') as lines:
+        rows = csv.reader(lines)
+        columns = None
+        for row in rows:
+            if not row:
+                continue
+            if columns is None:
+                columns = [field.strip().lower() for field in row]
+                if 'username' not in columns or 'password' not in columns:
+                    raise ValueError(
+                        "{0}:{1}: the header must name the username and "
+                        "password columns".format(manifest, rows.line_num))
+                continue
+            yield manifest_user(manifest, rows.line_num,
+                                dict(zip(columns, row)))
+
+
+def manifest_user(manifest, number, user):
+    """a user read from a manifest, checked for username and password"""
+    if not isinstance(user, dict):
+        raise ValueError("{0}:{1}: not a user object".format(manifest,
+                                                             number))
+    for field in ('username', 'password'):
+        if not user.get(field):
+            raise ValueError("{0}:{1}: no {2}".format(manifest, number,
+                                                      field))
+    return user
+
+
+class NMConnectionIndex(object):
+    """
+    Snapshot of the stored NetworkManager connections mapping wireless
+    SSIDs to connection object paths. The snapshot is taken once per run
+    with a single ListConnections call and one GetSettings call for each
+    connection; afterwards it is kept current from our own Delete and
+    AddConnection calls and from the NewConnection/Removed signals
+    (the latter are only delivered when a main loop is running).
+    """
+    connection_interface = \
+        "org.freedesktop.NetworkManager.Settings.Connection"
+
+    def __init__(self, config_tool):
+        import threading
+        self.config_tool = config_tool
+        self.ssid_paths = {}
+        self.path_ssid = {}
+        # the signal handlers run in the GLib thread of the daemon
+        self.lock = threading.Lock()
+
+    def connection(self, path):
+        """
+        get the connection interface for a connection path; the proxy
+        is not introspected, which saves a D-Bus round trip per connection
+        """
+        con_proxy = self.config_tool.bus.get_object(
+            self.config_tool.system_service_name, path, introspect=False)
+        return dbus.Interface(con_proxy, self.connection_interface)
+
+    def load(self):
+        """
+        read all stored connections and index the wireless ones
+        """
+        with self.lock:
+            self.ssid_paths = {}
+            self.path_ssid = {}
+        try:
+            with TRACE.span('dbus', 'ListConnections'):
+                conns = self.config_tool.settings.ListConnections()
+        except dbus.exceptions.DBusException:
+            print(Messages.dbus_error)
+            exit(3)
+        for path in conns:
+            self.__read_connection(path)
+        debug("indexed {0} wireless connections out of {1}".format(
+            len(self.path_ssid), len(conns)))
+
+    def watch(self):
+        """
+        follow connections added and removed by other NM clients
+        """
+        try:
+            self.config_tool.settings.connect_to_signal(
+                'NewConnection', self.__new_connection_signal)
+            self.config_tool.bus.add_signal_receiver(
+                self.__removed_signal, signal_name='Removed',
+                dbus_interface=self.config_tool.connection_interface_name,
+                path_keyword='path')
+        except dbus.exceptions.DBusException:
+            debug("cannot subscribe to connection signals")
+
+    def paths(self, ssid):
+        """
+        connection paths stored for the given SSID
+        """
+        with self.lock:
+            return list(self.ssid_paths.get(ssid, ()))
+
+    def connection_added(self, path, ssid):
+        """
+        register a new connection
+        """
+        path = str(path)
+        with self.lock:
+            if path in self.path_ssid:
+                return
+            self.path_ssid[path] = ssid
+            self.ssid_paths.setdefault(ssid, []).append(path)
+
+    def connection_removed(self, path):
+        """
+        forget a removed connection
+        """
+        path = str(path)
+        with self.lock:
+            ssid = self.path_ssid.pop(path, None)
+            if ssid is None:
+                return
+            paths = self.ssid_paths[ssid]
+            paths.remove(path)
+            if not paths:
+                del self.ssid_paths[ssid]
+
+    def __read_connection(self, path):
+        try:
+            with TRACE.span('dbus', 'GetSettings', path=str(path)):
+                connection_settings = self.connection(path).GetSettings()
+        except dbus.exceptions.DBusException:
+            return
+        if connection_settings['connection']['type'] != '802-11-wireless':
+            return
+        ssid = bytearray(connection_settings['802-11-wireless']['ssid'])
+        self.connection_added(path, ssid.decode('utf-8', 'replace'))
+
+    def __new_connection_signal(self, path):
+        if str(path) not in self.path_ssid:
+            self.__read_connection(path)
+
+    def __removed_signal(self, path=None):
+        if path is not None:
+            self.connection_removed(path)
 
 
 class CatNMConfigTool(object):
@@ -743,13 +2222,17 @@ class CatNMConfigTool(object):
         self.settings = None
         self.user_data = None
         self.bus = None
+        self.index = None
 
     def connect_to_nm(self):
         """
         connect to DBus
         """
+        if not import_dbus():
+            return None
         try:
-            self.bus = dbus.SystemBus()
+            with TRACE.span('dbus', 'SystemBus'):
+                self.bus = dbus.SystemBus()
         except dbus.exceptions.DBusException:
             print("Can't connect to DBus")
             return None
@@ -786,12 +2269,14 @@ class CatNMConfigTool(object):
         debug("NM connection worked")
         return True
 
-    def __check_opts(self):
+    def check_opts(self):
         """
         set certificate files paths and test for existence of the CA cert
         """
         self.cacert_file = os.environ['HOME'] + '/.cat_installer/ca.pem'
-        self.pfx_file = os.environ['HOME'] + '/.cat_installer/user.p12'
+        if self.pfx_file is None:
+            # the daemon sets one per SSID
+            self.pfx_file = os.environ['HOME'] + '/.cat_installer/user.p12'
         if not os.path.isfile(self.cacert_file):
             print(Messages.cert_error)
             sys.exit(2)
@@ -804,114 +2289,598 @@ class CatNMConfigTool(object):
             proxy = self.bus.get_object(
                 self.system_service_name, "/org/freedesktop/NetworkManager")
             props = dbus.Interface(proxy, "org.freedesktop.DBus.Properties")
-            version = props.Get("org.freedesktop.NetworkManager", "Version")
+            with TRACE.span('dbus', 'Get', property='Version'):
+                version = props.Get("org.freedesktop.NetworkManager",
+                                    "Version")
         except dbus.exceptions.DBusException:
             version = "0.8"
-        if re.match(r'^1\.', version):
-            self.nm_version = "1.0"
-            return
-        if re.match(r'^0\.9', version):
-            self.nm_version = "0.9"
-            return
-        if re.match(r'^0\.8', version):
-            self.nm_version = "0.8"
-            return
-        self.nm_version = Messages.unknown_version
+        self.nm_version = nm_version_name(version)
+
+    def connection_index(self):
+        """
+        return the connection index, building it on first use
+        """
+        if self.index is None:
+            self.index = NMConnectionIndex(self)
+            self.index.load()
+            self.index.watch()
+        return self.index
 
     def __delete_existing_connection(self, ssid):
         """
         checks and deletes earlier connection
         """
-        try:
-            conns = self.settings.ListConnections()
-        except dbus.exceptions.DBusException:
-            print(Messages.dbus_error)
-            exit(3)
-        for each in conns:
-            con_proxy = self.bus.get_object(self.system_service_name, each)
-            connection = dbus.Interface(
-                con_proxy,
-                "org.freedesktop.NetworkManager.Settings.Connection")
+        index = self.connection_index()
+        for path in index.paths(ssid):
+            connection = index.connection(path)
             try:
-                connection_settings = connection.GetSettings()
-                if connection_settings['connection']['type'] == '802-11-' \
-                                                                'wireless':
-                    conn_ssid = byte_to_string(
-                        connection_settings['802-11-wireless']['ssid'])
-                    if conn_ssid == ssid:
-                        debug("deleting connection: " + conn_ssid)
-                        connection.Delete()
+                debug("deleting connection: " + ssid)
+                with TRACE.span('dbus', 'Delete', path=path):
+                    connection.Delete()
             except dbus.exceptions.DBusException:
                 pass
+            index.connection_removed(path)
 
-    def __add_connection(self, ssid):
-        debug("Adding connection: " + ssid)
-        server_alt_subject_name_list = dbus.Array(Config.servers)
-        server_name = Config.server_match
+    def connection_user(self):
+        """
+        the user the connections are restricted to
+        """
+        return os.environ.get('USER')
+
+    def connection_settings(self, ssid):
+        """
+        Build the connection settings for an SSID as plain Python values;
+        byte arrays are given as bytearray objects so that every backend
+        can convert them to its own types
+        """
         if self.nm_version == "0.9" or self.nm_version == "1.0":
             match_key = 'altsubject-matches'
-            match_value = server_alt_subject_name_list
+            match_value = list(Config.servers)
         else:
             match_key = 'subject-match'
-            match_value = server_name
-        s_8021x_data = {
+            match_value = Config.server_match
+        s_8021x = {
             'eap': [Config.eap_outer.lower()],
             'identity': self.user_data.username,
-            'ca-cert': dbus.ByteArray(
+            'ca-cert': bytearray(
                 "file://{0}\0".format(self.cacert_file).encode('utf8')),
             match_key: match_value}
         if Config.eap_outer == 'PEAP' or Config.eap_outer == 'TTLS':
-            s_8021x_data['password'] = self.user_data.password
-            s_8021x_data['phase2-auth'] = Config.eap_inner.lower()
+            s_8021x['password'] = self.user_data.password
+            s_8021x['phase2-auth'] = Config.eap_inner.lower()
             if Config.anonymous_identity != '':
-                s_8021x_data['anonymous-identity'] = Config.anonymous_identity
-            s_8021x_data['password-flags'] = 0
+                s_8021x['anonymous-identity'] = Config.anonymous_identity
+            s_8021x['password-flags'] = 0
         if Config.eap_outer == 'TLS':
-            s_8021x_data['client-cert'] = dbus.ByteArray(
+            s_8021x['client-cert'] = bytearray(
                 "file://{0}\0".format(self.pfx_file).encode('utf8'))
-            s_8021x_data['private-key'] = dbus.ByteArray(
+            s_8021x['private-key'] = bytearray(
                 "file://{0}\0".format(self.pfx_file).encode('utf8'))
-            s_8021x_data['private-key-password'] = self.user_data.password
-            s_8021x_data['private-key-password-flags'] = 0
-        s_con = dbus.Dictionary({
-            'type': '802-11-wireless',
-            'uuid': str(uuid.uuid4()),
-            'permissions': ['user:' +
-                            os.environ.get('USER')],
-            'id': ssid
-            })
-        s_wifi = dbus.Dictionary({
-            'ssid': dbus.ByteArray(ssid.encode('utf8')),
-            'security': '802-11-wireless-security'
-            })
-        s_wsec = dbus.Dictionary({
-            'key-mgmt': 'wpa-eap',
-            'proto': ['rsn'],
-            'pairwise': ['ccmp'],
-            'group': ['ccmp', 'tkip']
-            })
-        s_8021x = dbus.Dictionary(s_8021x_data)
-        s_ip4 = dbus.Dictionary({'method': 'auto'})
-        s_ip6 = dbus.Dictionary({'method': 'auto'})
-        con = dbus.Dictionary({
-            'connection': s_con,
-            '802-11-wireless': s_wifi,
-            '802-11-wireless-security': s_wsec,
+            s_8021x['private-key-password'] = self.user_data.password
+            s_8021x['private-key-password-flags'] = 0
+        return {
+            'connection': {
+                'type': '802-11-wireless',
+                'uuid': str(uuid.uuid4()),
+                'permissions': ['user:' + self.connection_user()],
+                'id': ssid
+            },
+            '802-11-wireless': {
+                'ssid': bytearray(ssid.encode('utf8')),
+                'security': '802-11-wireless-security'
+            },
+            '802-11-wireless-security': {
+                'key-mgmt': 'wpa-eap',
+                'proto': ['rsn'],
+                'pairwise': ['ccmp'],
+                'group': ['ccmp', 'tkip']
+            },
             '802-1x': s_8021x,
-            'ipv4': s_ip4,
-            'ipv6': s_ip6
-            })
-        self.settings.AddConnection(con)
+            'ipv4': {'method': 'auto'},
+            'ipv6': {'method': 'auto'}
+        }
+
+    def connection_ssids(self, paths):
+        """
+        SSIDs of the stored connections at the given paths, None for
+        paths that are gone
+        """
+        ssids = []
+        for path in paths:
+            con_proxy = self.bus.get_object(self.system_service_name, path,
+                                            introspect=False)
+            connection = dbus.Interface(
+                con_proxy, NMConnectionIndex.connection_interface)
+            try:
+                with TRACE.span('dbus', 'GetSettings', path=str(path)):
+                    settings = connection.GetSettings()
+                ssid = settings['802-11-wireless']['ssid']
+            except (dbus.exceptions.DBusException, KeyError):
+                ssids.append(None)
+            else:
+                ssids.append(bytearray(ssid).decode('utf-8', 'replace'))
+        return ssids
+
+    def connection_plan(self, ssids=None):
+        """
+        Settings and digests of the connections of ssids (by default
+        Config.ssids) that differ from what the provisioning state
+        records as applied; connections recorded with the same settings
+        are kept if NetworkManager still has them
+        """
+        planned = []
+        for ssid in Config.ssids if ssids is None else ssids:
+            settings = self.connection_settings(ssid)
+            digest_settings = dict(settings)
+            digest_settings['connection'] = dict(settings['connection'])
+            del digest_settings['connection']['uuid']
+            planned.append((ssid, settings,
+                            STATE.digest(self.nm_version, digest_settings)))
+        recorded = [STATE.get('connection:' + ssid) or {}
+                    for ssid, settings, digest in planned]
+        candidates = [pos for pos, (ssid, settings, digest)
+                      in enumerate(planned)
+                      if recorded[pos].get('digest') == digest and
+                      recorded[pos].get('path')]
+        found = self.connection_ssids([recorded[pos]['path']
+                                       for pos in candidates])
+        unchanged = [pos for pos, ssid in zip(candidates, found)
+                     if ssid == planned[pos][0]]
+        for pos in unchanged:
+            debug("connection unchanged: " + planned[pos][0])
+        return [plan for pos, plan in enumerate(planned)
+                if pos not in unchanged]
+
+    def __add_connection(self, ssid, settings):
+        debug("Adding connection: " + ssid)
+        con = dbus.Dictionary()
+        for group, values in settings.items():
+            s_group = dbus.Dictionary()
+            for key, value in values.items():
+                if isinstance(value, bytearray):
+                    value = dbus.ByteArray(bytes(value))
+                elif isinstance(value, list):
+                    value = dbus.Array(value)
+                s_group[key] = value
+            con[group] = s_group
+        with TRACE.span('dbus', 'AddConnection', ssid=ssid):
+            path = self.settings.AddConnection(con)
+        self.connection_index().connection_added(path, ssid)
+        return path
+
+    def add_connections(self, user_data, ssids=None, del_ssids=None):
+        """
+        Delete and then add the connections of ssids and delete those of
+        del_ssids (by default Config.ssids and Config.del_ssids)
+        """
+        self.check_opts()
+        self.user_data = user_data
+        if del_ssids is None:
+            del_ssids = Config.del_ssids
+        for ssid, settings, digest in self.connection_plan(ssids):
+            self.__delete_existing_connection(ssid)
+            path = self.__add_connection(ssid, settings)
+            STATE.record('connection:' + ssid, digest, path=str(path))
+        del_digest = STATE.digest(del_ssids)
+        if del_ssids and not STATE.unchanged('del_ssids', del_digest):
+            for ssid in del_ssids:
+                self.__delete_existing_connection(ssid)
+            STATE.record('del_ssids', del_digest)
+
+
+class OfflineNMConfigTool(CatNMConfigTool):
+    """
+    Write the NetworkManager configuration as keyfiles into the root
+    directory of a mounted system image, without D-Bus. The settings are
+    the ones CatNMConfigTool sends to NetworkManager, the CA certificate
+    (and the user certificate for TLS) are installed into the home
+    directory of the image user.
+    """
+    # keyfile group names of the settings
+    keyfile_groups = {'802-11-wireless': 'wifi',
+                      '802-11-wireless-security': 'wifi-security'}
+    connections_dir = 'etc/NetworkManager/system-connections'
+
+    def __init__(self, root, user, home=None):
+        CatNMConfigTool.__init__(self)
+        self.root = root
+        self.user = user
+        if home is None:
+            home = '/root' if user == 'root' else '/home/' + user
+        self.home = home
+        self.nm_version = "1.0"
+        self.uid = None
+        self.gid = None
+
+    def connect_to_nm(self):
+        """
+        check the image root and look up the image user
+        """
+        if not os.path.isdir(self.root):
+            print("Not a directory: " + self.root)
+            return None
+        try:
+            with open(os.path.join(self.root, 'etc/passwd')) as passwd:
+                for line in passwd:
+                    fields = line.split(':')
+                    if len(fields) > 3 and fields[0] == self.user:
+                        self.uid = int(fields[2])
+                        self.gid = int(fields[3])
+                        break
+        except (IOError, OSError, ValueError):
+            pass
+        if self.uid is None:
+            debug("user {0} not found in the image".format(self.user))
+        return True
+
+    def check_opts(self):
+        """
+        install the certificate files into the image; the settings refer
+        to their paths inside the image
+        """
+        self.cacert_file = self.home + '/.cat_installer/ca.pem'
+        self.pfx_file = self.home + '/.cat_installer/user.p12'
+        cat_dir = self.__image_path(self.home + '/.cat_installer')
+        if not os.path.isdir(cat_dir):
+            os.makedirs(cat_dir, 0o700)
+        self.__chown(cat_dir)
+        with atomic_open(self.__image_path(self.cacert_file)) as cert:
+            cert.write(Config.CA + "\n")
+        self.__chown(self.__image_path(self.cacert_file))
+        if Config.eap_outer == 'TLS':
+            user_pfx = os.environ['HOME'] + '/.cat_installer/user.p12'
+            copyfile(user_pfx, self.__image_path(self.pfx_file))
+            os.chmod(self.__image_path(self.pfx_file), 0o600)
+            self.__chown(self.__image_path(self.pfx_file))
 
     def add_connections(self, user_data):
-        """Delete and then add connections to the system"""
-        self.__check_opts()
+        """Delete and then add connections to the image"""
+        self.check_opts()
         self.user_data = user_data
+        conn_dir = self.__image_path('/' + self.connections_dir)
+        if not os.path.isdir(conn_dir):
+            os.makedirs(conn_dir, 0o755)
+        stale = Config.ssids + Config.del_ssids
+        for name in os.listdir(conn_dir):
+            path = os.path.join(conn_dir, name)
+            if os.path.isfile(path) and keyfile_ssid(path) in stale:
+                debug("deleting connection: " + name)
+                os.remove(path)
         for ssid in Config.ssids:
-            self.__delete_existing_connection(ssid)
-            self.__add_connection(ssid)
-        for ssid in Config.del_ssids:
-            self.__delete_existing_connection(ssid)
+            debug("Adding connection: " + ssid)
+            name = re.sub(r'[^A-Za-z0-9._-]', '_', ssid) + '.nmconnection'
+            path = os.path.join(conn_dir, name)
+            with atomic_open(path) as keyfile:
+                keyfile.write(self.keyfile(self.connection_settings(ssid)))
+            if os.getuid() == 0:
+                os.chown(path, 0, 0)
+
+    def connection_user(self):
+        """
+        the user the connections are restricted to
+        """
+        return self.user
+
+    def keyfile(self, settings):
+        """render connection settings in the NetworkManager keyfile format"""
+        lines = []
+        for group in ('connection', '802-11-wireless',
+                      '802-11-wireless-security', '802-1x', 'ipv4', 'ipv6'):
+            if group not in settings:
+                continue
+            if lines:
+                lines.append('')
+            lines.append('[' + self.keyfile_groups.get(group, group) + ']')
+            for key in sorted(settings[group]):
+                value = settings[group][key]
+                if group == 'connection' and key == 'type':
+                    value = self.keyfile_groups.get(value, value)
+                lines.append(key + '=' + keyfile_value(value))
+        return '\n'.join(lines) + '\n'
+
+    def __image_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def __chown(self, path):
+        if self.uid is not None and os.getuid() == 0:
+            os.chown(path, self.uid, self.gid)
+
+
+def keyfile_value(value):
+    """
+    Format a setting value for a keyfile: lists are joined with ';',
+    certificate blobs become paths, byte arrays are written as text
+    when they are printable and as a list of byte values otherwise
+    """
+    def escape(text, in_list=False):
+        text = text.replace('\\', '\\\\').replace('\n', '\\n') \
+            .replace('\t', '\\t').replace('\r', '\\r')
+        if in_list:
+            text = text.replace(';', '\\;')
+        if text.startswith(' '):
+            text = '\\s' + text[1:]
+        return text
+    if isinstance(value, bytearray):
+        if value.startswith(b'file://') and value.endswith(b'\0'):
+            return escape(value[7:-1].decode('utf-8'))
+        try:
+            text = value.decode('utf-8')
+        except UnicodeDecodeError:
+            text = None
+        if text is not None and re.match(r'^[^\x00-\x1f;\\]*$', text):
+            return text
+        return ''.join(str(byte) + ';' for byte in value)
+    if isinstance(value, list):
+        return ''.join(escape(item, True) + ';' for item in value)
+    return escape(str(value))
+
+
+def keyfile_ssid(path):
+    """the SSID of a wireless keyfile, None for other connections"""
+    group = None
+    try:
+        with open(path, 'rb') as keyfile:
+            for line in keyfile:
+                line = line.strip()
+                if line.startswith(b'['):
+                    group = line.strip(b'[]')
+                elif group in (b'wifi', b'802-11-wireless') and \
+                        line.startswith(b'ssid='):
+                    ssid = line[5:]
+                    if re.match(br'^(\d+;)+$', ssid):
+                        ssid = bytearray(int(byte) for byte
+                                         in ssid.split(b';')[:-1])
+                    return bytes(ssid).decode('utf-8', 'replace')
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def provision_images(roots, user, home, user_data, jobs=4):
+    """
+    Write the configuration into several mounted images in parallel;
+    returns a list of (root, error message or None)
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def provision(root):
+        config_tool = OfflineNMConfigTool(root, user, home)
+        if config_tool.connect_to_nm() is None:
+            return root, "not a directory"
+        try:
+            config_tool.add_connections(user_data)
+        except (IOError, OSError) as err:
+            return root, str(err)
+        return root, None
+    pool = ThreadPool(max(1, min(jobs, len(roots))))
+    try:
+        return pool.map(provision, roots)
+    finally:
+        pool.close()
+
+
+class CatNMAsyncConfigTool(CatNMConfigTool):
+    """
+    Prepare and save NetworkManager configuration over an asyncio
+    D-Bus connection (requires python3 and the dbus_next module).
+    Calls that do not depend on each other are sent together and their
+    replies awaited as a batch: the GetSettings calls for all stored
+    connections, and the deletion of earlier connections together with
+    the addition of the new ones.
+    """
+    # stay well below the max_replies_per_connection limit of the
+    # system bus
+    max_pending = 64
+
+    def __init__(self):
+        import threading
+        CatNMConfigTool.__init__(self)
+        self.loop = None
+        self.settings_path = None
+        self.settings_interface_name = None
+        # the loop runs for one thread at a time; the copies the daemon
+        # makes share it
+        self.run_lock = threading.Lock()
+
+    def connect_to_nm(self):
+        """
+        connect to DBus
+        """
+        try:
+            import asyncio
+            from dbus_next.aio import MessageBus
+            from dbus_next import BusType
+        except ImportError:
+            debug("Cannot import asyncio or the dbus_next module")
+            return None
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.bus = self.loop.run_until_complete(
+                MessageBus(bus_type=BusType.SYSTEM).connect())
+        except Exception:
+            print("Can't connect to DBus")
+            return None
+        self.system_service_name = "org.freedesktop.NetworkManager"
+        reply = self.__run([self.__message(
+            "/org/freedesktop/NetworkManager",
+            "org.freedesktop.DBus.Properties", "Get", "ss",
+            ["org.freedesktop.NetworkManager", "Version"])])[0]
+        if self.__failed(reply):
+            self.nm_version = nm_version_name("0.8")
+        else:
+            self.nm_version = nm_version_name(reply.body[0].value)
+        debug("NM version: " + self.nm_version)
+        if self.nm_version == "0.9" or self.nm_version == "1.0":
+            self.settings_service_name = self.system_service_name
+            self.connection_interface_name = \
+                "org.freedesktop.NetworkManager.Settings.Connection"
+            self.settings_path = "/org/freedesktop/NetworkManager/Settings"
+            self.settings_interface_name = \
+                "org.freedesktop.NetworkManager.Settings"
+        elif self.nm_version == "0.8":
+            self.settings_service_name = "org.freedesktop.NetworkManager"
+            self.connection_interface_name = "org.freedesktop.NetworkMana" \
+                                             "gerSettings.Connection"
+            self.settings_path = "/org/freedesktop/NetworkManagerSettings"
+            self.settings_interface_name = \
+                "org.freedesktop.NetworkManagerSettings"
+        else:
+            print(Messages.nm_not_supported)
+            return None
+        debug("NM connection worked")
+        return True
+
+    def connection_index(self):
+        """
+        return the connection index, reading the settings of all
+        stored connections concurrently on first use
+        """
+        if self.index is not None:
+            return self.index
+        self.index = NMConnectionIndex(self)
+        reply = self.__run([self.__message(
+            self.settings_path, self.settings_interface_name,
+            "ListConnections")])[0]
+        if self.__failed(reply):
+            print(Messages.dbus_error)
+            exit(3)
+        conns = reply.body[0]
+        replies = self.__run([self.__message(
+            path, NMConnectionIndex.connection_interface, "GetSettings")
+                              for path in conns])
+        for path, reply in zip(conns, replies):
+            if self.__failed(reply):
+                continue
+            connection_settings = reply.body[0]
+            if connection_settings['connection']['type'].value != \
+                    '802-11-wireless':
+                continue
+            ssid = bytearray(connection_settings['802-11-wireless']['ssid']
+                             .value)
+            self.index.connection_added(path,
+                                        ssid.decode('utf-8', 'replace'))
+        debug("indexed {0} wireless connections out of {1}".format(
+            len(self.index.path_ssid), len(conns)))
+        return self.index
+
+    def add_connections(self, user_data, ssids=None, del_ssids=None):
+        """
+        Delete and then add the connections of ssids and delete those of
+        del_ssids (by default Config.ssids and Config.del_ssids)
+        """
+        self.check_opts()
+        self.user_data = user_data
+        if del_ssids is None:
+            del_ssids = Config.del_ssids
+        plan = self.connection_plan(ssids)
+        ssids = [ssid for ssid, settings, digest in plan]
+        del_digest = STATE.digest(del_ssids)
+        del_changed = bool(del_ssids) and \
+            not STATE.unchanged('del_ssids', del_digest)
+        if not plan and not del_changed:
+            return
+        index = self.connection_index()
+        stale = []
+        for ssid in ssids + (del_ssids if del_changed else []):
+            for path in index.paths(ssid):
+                if path not in stale:
+                    debug("deleting connection: " + ssid)
+                    stale.append(path)
+        messages = [
+            self.__message(path, NMConnectionIndex.connection_interface,
+                           "Delete")
+            for path in stale]
+        for ssid, settings, digest in plan:
+            debug("Adding connection: " + ssid)
+            messages.append(self.__message(
+                self.settings_path, self.settings_interface_name,
+                "AddConnection", "a{sa{sv}}",
+                [self.__variant_settings(settings)]))
+        replies = self.__run(messages)
+        for path in stale:
+            index.connection_removed(path)
+        added = replies[len(stale):]
+        for (ssid, settings, digest), reply in zip(plan, added):
+            if self.__failed(reply):
+                print(Messages.dbus_error)
+                exit(3)
+            index.connection_added(reply.body[0], ssid)
+            STATE.record('connection:' + ssid, digest, path=reply.body[0])
+        if del_changed:
+            STATE.record('del_ssids', del_digest)
+
+    def connection_ssids(self, paths):
+        """
+        SSIDs of the stored connections at the given paths, None for
+        paths that are gone; the settings are requested concurrently
+        """
+        replies = self.__run([self.__message(
+            path, NMConnectionIndex.connection_interface, "GetSettings")
+                              for path in paths])
+        ssids = []
+        for reply in replies:
+            try:
+                ssid = reply.body[0]['802-11-wireless']['ssid'].value
+            except (IndexError, KeyError, TypeError):
+                ssids.append(None)
+            else:
+                ssids.append(bytearray(ssid).decode('utf-8', 'replace'))
+        return ssids
+
+    def __message(self, path, interface, member, signature='', body=None):
+        from dbus_next import Message
+        return Message(destination=self.system_service_name, path=path,
+                       interface=interface, member=member,
+                       signature=signature, body=body or [])
+
+    def __run(self, messages):
+        """
+        send the messages without waiting for each reply, at most
+        max_pending at a time, and return the replies in order
+        """
+        import asyncio
+        replies = []
+        for pos in range(0, len(messages), self.max_pending):
+            batch = messages[pos:pos + self.max_pending]
+            members = {}
+            for msg in batch:
+                members[msg.member] = members.get(msg.member, 0) + 1
+            with self.run_lock, TRACE.span('dbus', 'batch',
+                                           calls=len(batch),
+                                           members=members):
+                # the daemon calls in from its request threads
+                asyncio.set_event_loop(self.loop)
+                replies.extend(self.loop.run_until_complete(asyncio.gather(
+                    *[self.bus.call(msg) for msg in batch])))
+        return replies
+
+    @staticmethod
+    def __failed(reply):
+        from dbus_next import MessageType
+        if reply.message_type == MessageType.ERROR:
+            debug("DBus error: " + str(reply.error_name))
+            return True
+        return False
+
+    @staticmethod
+    def __variant_settings(settings):
+        from dbus_next import Variant
+        con = {}
+        for group, values in settings.items():
+            s_group = {}
+            for key, value in values.items():
+                if isinstance(value, bytearray):
+                    value = Variant('ay', bytes(value))
+                elif isinstance(value, list):
+                    value = Variant('as', value)
+                elif isinstance(value, int):
+                    value = Variant('u', value)
+                else:
+                    value = Variant('s', value)
+                s_group[key] = value
+            con[group] = s_group
+        return con
 
 
 Messages.quit = "¿Deseas abandonar?"
@@ -1003,4 +2972,5 @@ mED5pttPlRWsvl43QEwJowU1Hnjca2u5p+gH6vDZYJaWWBNajM69g/4EN3UocPPo
 FClpgb1aueJ26EBp3FKC11jrsz1hXu0f9KNMdv3OeC/hNx77DRm78t0=
 -----END CERTIFICATE-----
 """
-run_installer()
+if __name__ == '__main__':
+    run_installer()
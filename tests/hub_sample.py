@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Small hub logs for the tests of the Scripts: the sample activity of the
+repository and lines written one by one with the record layout of
+hub_log.py.
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'Scripts'))
+
+from hub_log import (AudioChunk, ProximityScan, RssiDistance,  # noqa: E402
+                     audio_record, proximity_record)
+
+SAMPLE = os.path.join(ROOT, 'actividad_2019-04-32')
+SAMPLE_AUDIO = os.path.join(SAMPLE, 'audio_data.txt')
+SAMPLE_PROXIMITY = os.path.join(SAMPLE, 'proximity_data.txt')
+
+
+def audio_line(badge, member_id, timestamp, samples, log_timestamp=None,
+               period=50, voltage=2.9):
+    """an 'audio received' line; log_timestamp defaults to timestamp"""
+    chunk = AudioChunk(badge, badge, member_id, timestamp, period,
+                       len(samples), list(samples), voltage,
+                       timestamp if log_timestamp is None else log_timestamp,
+                       -1)
+    return json.dumps(audio_record(chunk)) + "\n"
+
+
+def scan_line(badge, member_id, timestamp, heard=(), log_timestamp=None,
+              voltage=2.9):
+    """
+    a 'proximity received' line; heard lists (member id, rssi, count)
+    """
+    scan = ProximityScan(badge, badge, member_id, timestamp,
+                         tuple(RssiDistance(*seen) for seen in heard),
+                         voltage,
+                         timestamp if log_timestamp is None else log_timestamp,
+                         -1)
+    return json.dumps(proximity_record(scan)) + "\n"
+
+
+def write_lines(path, lines, mode='a'):
+    with open(path, mode) as log:
+        log.writelines(lines)
+    return path
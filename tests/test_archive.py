@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Archive from archive.py over small hub logs in a temporary directory,
+read back and compared with the logs.
+
+    python -m pytest tests/test_archive.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_AUDIO, audio_line, write_lines
+
+import archive
+from archive import Archive
+from hub_log import HubLogReader
+
+START = 1554299803.0
+
+
+def chunk_lines(first, count):
+    return [audio_line('F2:1E:84:04:C5:B5', 641, START + number,
+                       [number % 50] * 40) for number in range(first,
+                                                               first + count)]
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='archive_')
+        self.root = os.path.join(self.workdir, 'archivo')
+        self.log = os.path.join(self.workdir, 'audio_data.txt')
+        self.sizes = archive.MIN_SEGMENT, archive.MAX_SEGMENT
+        # segments of a few lines
+        archive.MIN_SEGMENT, archive.MAX_SEGMENT = 2048, 8192
+
+    def tearDown(self):
+        archive.MIN_SEGMENT, archive.MAX_SEGMENT = self.sizes
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def content(self, store, name):
+        return b''.join(store.lines(name))
+
+    def log_content(self):
+        with open(self.log, 'rb') as log:
+            return log.read()
+
+    def test_sample_log(self):
+        store = Archive(self.root)
+        store.add('actividad/audio_data.txt', SAMPLE_AUDIO)
+        self.assertEqual(store.names(), ['actividad/audio_data.txt'])
+        with open(SAMPLE_AUDIO, 'rb') as log:
+            self.assertEqual(self.content(store, 'actividad/audio_data.txt'),
+                             log.read())
+        self.assertEqual(
+            list(store.records('actividad/audio_data.txt', member_ids=[641],
+                               start=1554299800, end=1554299900)),
+            list(HubLogReader(SAMPLE_AUDIO, member_ids=[641],
+                              start=1554299800, end=1554299900)))
+
+    def test_daily_backups(self):
+        write_lines(self.log, chunk_lines(0, 300))
+        Archive(self.root).add('dia1/audio_data.txt', self.log)
+        size = os.path.getsize(self.log)
+        write_lines(self.log, chunk_lines(300, 100))
+        store = Archive(self.root)
+        store.add('dia2/audio_data.txt', self.log)
+        # the new lines and the last segment of the day before
+        self.assertLess(store.stats['raw'], os.path.getsize(self.log) -
+                        size + archive.MAX_SEGMENT)
+        self.assertEqual(self.content(store, 'dia2/audio_data.txt'),
+                         self.log_content())
+        self.assertEqual(len(self.content(store, 'dia1/audio_data.txt')),
+                         size)
+        manifest = store.manifest('dia2/audio_data.txt')
+        self.assertEqual(manifest['size'], os.path.getsize(self.log))
+        self.assertEqual(sum(entry['lines'] for entry
+                             in manifest['segments']), 400)
+
+    def test_rewritten_log(self):
+        write_lines(self.log, chunk_lines(0, 300))
+        Archive(self.root).add('dia1/audio_data.txt', self.log)
+        # the same bytes at the end, other ones at the start
+        data = bytearray(self.log_content())
+        data[10:14] = b'9999'
+        with open(self.log, 'wb') as log:
+            log.write(bytes(data))
+        write_lines(self.log, chunk_lines(300, 10))
+        store = Archive(self.root)
+        store.add('dia2/audio_data.txt', self.log)
+        self.assertEqual(store.stats['raw'], os.path.getsize(self.log))
+        self.assertEqual(self.content(store, 'dia2/audio_data.txt'),
+                         self.log_content())
+
+    def test_cut_log(self):
+        write_lines(self.log, chunk_lines(0, 300))
+        Archive(self.root).add('dia1/audio_data.txt', self.log)
+        write_lines(self.log, chunk_lines(1000, 20), mode='w')
+        store = Archive(self.root)
+        store.add('dia2/audio_data.txt', self.log)
+        self.assertEqual(self.content(store, 'dia2/audio_data.txt'),
+                         self.log_content())
+
+    def test_time_range(self):
+        write_lines(self.log, chunk_lines(0, 300))
+        store = Archive(self.root)
+        store.add('dia1/audio_data.txt', self.log)
+        lines = list(store.lines('dia1/audio_data.txt', START + 100,
+                                 START + 110))
+        self.assertLess(len(lines), 300)
+        records = list(store.records('dia1/audio_data.txt',
+                                     start=START + 100, end=START + 110))
+        self.assertEqual([record.timestamp for record in records],
+                         [START + number for number in range(100, 110)])
+
+    def test_shared_segments(self):
+        write_lines(self.log, chunk_lines(0, 300))
+        store = Archive(self.root)
+        store.add('a/audio_data.txt', self.log)
+        stored = store.stats['stored']
+        copy = os.path.join(self.workdir, 'copy.txt')
+        shutil.copy(self.log, copy)
+        store.add('b/audio_data.txt', copy)
+        self.assertEqual(store.stats['stored'], stored)
+        self.assertEqual(store.manifest('a/audio_data.txt'),
+                         store.manifest('b/audio_data.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
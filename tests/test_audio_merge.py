@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+ChunkMerger over the sample activity and small hub logs in a temporary
+directory with chunks sent again, overlapping and out of order.
+
+    python -m pytest tests/test_audio_merge.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_AUDIO, audio_line, write_lines
+
+from audio_merge import ChunkMerger, chunk_end, read_chunks
+
+BADGE = 'F2:1E:84:04:C5:B5'
+OTHER = 'C1:7C:3B:1A:29:17'
+START = 1554299803.0
+
+
+class ChunkMergerTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='audio_merge_')
+        self.log = os.path.join(self.workdir, 'audio_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def merged(self, lines, horizon=120.0):
+        write_lines(self.log, lines)
+        merger = ChunkMerger(horizon)
+        return merger, list(merger.merge(read_chunks(self.log)))
+
+    def check_stream(self, chunks):
+        """
+        every badge in time order, with no sample given twice (chunks
+        may touch within half a sample period)
+        """
+        ends = {}
+        for chunk in chunks:
+            slack = chunk.sample_period / 2000.0
+            self.assertGreaterEqual(chunk.timestamp,
+                                    ends.get(chunk.badge_address, 0) - slack)
+            self.assertEqual(chunk.num_samples, len(chunk.samples))
+            ends[chunk.badge_address] = chunk_end(chunk)
+
+    def test_sample_log(self):
+        merger = ChunkMerger()
+        chunks = list(merger.merge(read_chunks(SAMPLE_AUDIO)))
+        self.check_stream(chunks)
+        stats = merger.stats
+        self.assertEqual(stats['chunks_read'], 35)
+        self.assertEqual(stats['samples_read'], stats['samples_given'] +
+                         stats['samples_discarded'])
+        self.assertEqual(stats['samples_given'],
+                         sum(len(chunk.samples) for chunk in chunks))
+        # F2:1E:84:04:C5:B5 @ 1554299803.642 arrives with 2 samples and
+        # then with 114
+        first = [chunk for chunk in chunks
+                 if abs(chunk.timestamp - 1554299803.642) < 1e-6]
+        self.assertEqual(len(first), 1)
+        self.assertGreater(len(first[0].samples), 2)
+
+    def test_resent_chunk(self):
+        merger, chunks = self.merged([
+            audio_line(BADGE, 641, START, [1] * 2, log_timestamp=START + 1),
+            audio_line(BADGE, 641, START, [2] * 40, log_timestamp=START + 3),
+            audio_line(BADGE, 641, START, [3] * 40, log_timestamp=START + 2),
+            audio_line(BADGE, 641, START, [4] * 10, log_timestamp=START + 4)])
+        chunk, = chunks
+        # the longest, and of those the one received last
+        self.assertEqual(chunk.samples, [2] * 40)
+        self.assertEqual(merger.stats['chunks_discarded'], 3)
+        self.assertGreater(merger.stats['bytes_discarded'], 0)
+
+    def test_overlap_trimmed(self):
+        # a chunk of 2 s and one from 1 s on that holds 1 s more
+        merger, chunks = self.merged([
+            audio_line(BADGE, 641, START, list(range(40))),
+            audio_line(BADGE, 641, START + 1, list(range(20, 60)))])
+        self.check_stream(chunks)
+        self.assertEqual([chunk.timestamp for chunk in chunks],
+                         [START, START + 2])
+        self.assertEqual(sum((chunk.samples for chunk in chunks), []),
+                         list(range(60)))
+        self.assertEqual(merger.stats['samples_discarded'], 20)
+
+    def test_badges_and_order(self):
+        lines = []
+        for number in (3, 1, 0, 2):
+            lines.append(audio_line(BADGE, 641, START + number * 2,
+                                    [number] * 40))
+            lines.append(audio_line(OTHER, 633, START + number * 2 + 0.5,
+                                    [number] * 40))
+        merger, chunks = self.merged(lines)
+        self.check_stream(chunks)
+        for badge in (BADGE, OTHER):
+            self.assertEqual([chunk.samples[0] for chunk in chunks
+                              if chunk.badge_address == badge],
+                             [0, 1, 2, 3])
+
+    def test_horizon(self):
+        # chunks are given as soon as the badge is a horizon past them
+        merger = ChunkMerger(horizon=10)
+        write_lines(self.log, [audio_line(BADGE, 641, START + number * 2,
+                                          [number] * 40)
+                               for number in range(50)])
+        given = 0
+        for chunk, size in read_chunks(self.log):
+            given += len(merger.add(chunk, size))
+            self.assertLessEqual(len(merger.pending[BADGE]), 7)
+        self.assertEqual(given + len(merger.flush()), 50)
+        # a chunk older than the horizon is given at once and counted
+        late = next(read_chunks(self.log))
+        self.assertEqual(merger.add(*late), [late[0]])
+        self.assertEqual(merger.stats['late_chunks'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+AudioStore conversion of small hub logs into a temporary directory,
+read back through its memory maps. Skipped without NumPy.
+
+    python -m pytest tests/test_audio_store.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_AUDIO, audio_line, write_lines
+
+from audio_store import AudioStore, badge_dir
+from badge_registry import BadgeRegistry
+from hub_log import read_records
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BADGE = 'F2:1E:84:04:C5:B5'
+START = 1554299803.0
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class AudioStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='audio_store_')
+        self.root = os.path.join(self.workdir, 'store')
+        self.log = os.path.join(self.workdir, 'audio_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def write(self, chunks, badge=BADGE, member_id=641):
+        write_lines(self.log, [
+            audio_line(badge, member_id, timestamp, samples)
+            for timestamp, samples in chunks])
+
+    def test_sample_log(self):
+        store = AudioStore(self.root)
+        chunks = list(read_records(SAMPLE_AUDIO))
+        self.assertEqual(store.ingest(SAMPLE_AUDIO), len(chunks))
+        self.assertEqual(store.ingest(SAMPLE_AUDIO), 0)
+        store = AudioStore(self.root)
+        for badge in store.badges():
+            expected = [chunk for chunk in chunks
+                        if chunk.badge_address.upper() == badge]
+            self.assertEqual(len(store.chunk_index(badge)), len(expected))
+            self.assertEqual(store.samples(badge).tolist(), sum(
+                (chunk.samples for chunk in expected), []))
+
+    def test_incremental(self):
+        self.write([(START, [1, 2, 3])])
+        store = AudioStore(self.root)
+        self.assertEqual(store.ingest(self.log), 1)
+        self.write([(START + 0.15, [4, 5])])
+        store = AudioStore(self.root)
+        self.assertEqual(store.ingest(self.log), 1)
+        self.assertEqual(store.samples(BADGE).tolist(), [1, 2, 3, 4, 5])
+        times, values = store.slice(BADGE, START + 0.05, START + 0.2)
+        self.assertEqual(values.tolist(), [2, 3, 4])
+        self.assertEqual(numpy.round(times - START, 3).tolist(),
+                         [0.05, 0.1, 0.15])
+
+    def test_mac_spellings(self):
+        self.write([(START, [1, 2, 3])], badge=BADGE.lower())
+        AudioStore(self.root).ingest(self.log)
+        # a later run that first sees the badge written another way
+        self.write([(START + 0.15, [4, 5])], badge=BADGE.replace(':', '-'))
+        self.write([(START + 0.25, [6])], badge=BADGE)
+        store = AudioStore(self.root)
+        self.assertEqual(store.ingest(self.log), 2)
+        self.assertEqual(store.badges(), [BADGE])
+        self.assertEqual(os.listdir(self.root).count(badge_dir(BADGE)), 1)
+        for spelling in (BADGE, BADGE.lower(), BADGE.replace(':', '-')):
+            self.assertEqual(store.samples(spelling).tolist(),
+                             [1, 2, 3, 4, 5, 6])
+
+    def test_widening(self):
+        self.write([(START, [1, 2]), (START + 0.1, [300, -2])])
+        store = AudioStore(self.root)
+        store.ingest(self.log)
+        self.assertEqual(store.state['badges'][BADGE]['type'], 'i16')
+        self.write([(START + 0.2, [70000]), (START + 0.25, [2 ** 40]),
+                    (START + 0.3, [1.5])])
+        store = AudioStore(self.root)
+        self.assertEqual(store.ingest(self.log), 1)
+        self.assertEqual(store.state['badges'][BADGE]['type'], 'i32')
+        self.assertEqual(store.samples(BADGE).tolist(),
+                         [1, 2, 300, -2, 70000])
+        self.assertEqual(sorted(os.listdir(os.path.join(
+            self.root, badge_dir(BADGE)))), ['chunks.idx', 'samples.i32'])
+
+    def test_registry(self):
+        registry = BadgeRegistry()
+        registry.add(BADGE, 700)
+        self.write([(START, [1])], member_id=641)
+        self.write([(START + 0.05, [2])], member_id=None)
+        store = AudioStore(self.root, registry)
+        store.ingest(self.log)
+        self.assertEqual(
+            store.chunk_index(BADGE)['member_id'].tolist(), [700, 700])
+
+
+if __name__ == '__main__':
+    unittest.main()
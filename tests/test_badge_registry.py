@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+BadgeRegistry over the three roster layouts of the repository and the
+badges of the sample activity, plus small rosters written to a
+temporary directory.
+
+    python -m pytest tests/test_badge_registry.py
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import ROOT, SAMPLE_AUDIO
+
+from badge_registry import BadgeRegistry, IntTable, int_to_mac, mac_to_int
+from hub_log import HubLogReader
+
+ROSTERS = [os.path.join(ROOT, name) for name in (
+    'badges_to_load.csv', 'badges_to_load.txt', 'badges_to_load_final.txt')]
+
+
+def rows(registry):
+    return [(int_to_mac(registry.macs[row]), registry.member_ids[row])
+            for row in range(len(registry))]
+
+
+class MacTest(unittest.TestCase):
+    def test_round_trip(self):
+        for address in ('CB:F3:EB:7C:75:69', '00:00:00:00:00:01'):
+            self.assertEqual(int_to_mac(mac_to_int(address)), address)
+        self.assertEqual(mac_to_int('cb:f3:eb:7c:75:69'),
+                         mac_to_int('CB-F3-EB-7C-75-69'))
+        self.assertEqual(mac_to_int('CBF3EB7C7569'), 0xCBF3EB7C7569)
+        self.assertRaises(ValueError, mac_to_int, '01:CB:F3:EB:7C:75:69')
+        self.assertRaises(ValueError, mac_to_int, 'not a mac')
+
+
+class IntTableTest(unittest.TestCase):
+    def test_grow(self):
+        table = IntTable()
+        # keys sharing their high bits, as MACs of one vendor do
+        keys = [0xCBF3EB000000 + number for number in range(500)]
+        for row, key in enumerate(keys):
+            table.put(key, row)
+        self.assertEqual([table.get(key) for key in keys],
+                         list(range(500)))
+        self.assertIsNone(table.get(0xCBF3EB000000 + 500))
+        table.put(keys[0], 7)
+        self.assertEqual(table.get(keys[0]), 7)
+        self.assertEqual(table.used, 500)
+        self.assertLessEqual(table.used * 4, len(table.keys) * 3)
+
+
+class BadgeRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='badge_registry_')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def roster(self, text):
+        path = os.path.join(self.workdir, 'badges_to_load.txt')
+        with io.open(path, 'w', encoding='utf-8', newline='') as roster:
+            roster.write(text)
+        return path
+
+    def test_layouts(self):
+        registries = [BadgeRegistry.load(path) for path in ROSTERS]
+        self.assertEqual(len(registries[0]), 42)
+        for registry in registries[1:]:
+            self.assertEqual(rows(registry), rows(registries[0]))
+        self.assertEqual(registries[0].project(601), 'UCN')
+        self.assertEqual(registries[2].project(601), '1')
+        self.assertEqual(registries[0].email(601), 'crcandiav@gmail.com')
+        self.assertEqual(registries[0].mac_address(601), 'CB:F3:EB:7C:75:69')
+        self.assertEqual(registries[0].member_id('cb:f3:eb:7c:75:69'), 601)
+        self.assertEqual(len(BadgeRegistry.load(*ROSTERS)),
+                         len(set(rows(registries[0]) + rows(registries[1]) +
+                                 rows(registries[2]))))
+
+    def test_sample_badges(self):
+        registry = BadgeRegistry()
+        for chunk in HubLogReader(SAMPLE_AUDIO):
+            registry.add(chunk.badge_address, chunk.member_id)
+        self.assertEqual(sorted(registry.member_ids), [633, 641])
+        for chunk in HubLogReader(SAMPLE_AUDIO):
+            self.assertEqual(registry.member_id(chunk.badge_address),
+                             chunk.member_id)
+            self.assertEqual(registry.mac(chunk.member_id),
+                             mac_to_int(chunk.badge_address))
+
+    def test_conflicts(self):
+        registry = BadgeRegistry()
+        registry.add('CB:F3:EB:7C:75:69', 601)
+        # the same badge again
+        self.assertEqual(registry.add('cb:f3:eb:7c:75:69', 601), 0)
+        self.assertRaises(ValueError, registry.add, 'CB:F3:EB:7C:75:69', 602)
+        self.assertRaises(ValueError, registry.add, 'C3:07:63:12:43:47', 601)
+        self.assertEqual(len(registry), 1)
+        self.assertIsNone(registry.member_id('C3:07:63:12:43:47'))
+        self.assertIsNone(registry.mac_address(602))
+
+    def test_bad_rosters(self):
+        path = self.roster(u'CB:F3:EB:7C:75:69,601\r\n\r\nC3:07:63\r\n')
+        with self.assertRaises(ValueError) as raised:
+            BadgeRegistry.load(path)
+        self.assertIn(':3:', str(raised.exception))
+        path = self.roster(u'CB:F3:EB:7C:75:69\tuno\r\n')
+        self.assertRaises(ValueError, BadgeRegistry.load, path)
+        path = self.roster(u'\ufeffCB:F3:EB:7C:75:69,601\n')
+        self.assertEqual(BadgeRegistry.load(path).member_id(
+            'CB:F3:EB:7C:75:69'), 601)
+
+
+if __name__ == '__main__':
+    unittest.main()
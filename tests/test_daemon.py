@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+ProvisioningDaemon.provision with a config tool that only records the
+calls it gets, so that the serialization per SSID can be checked
+without NetworkManager.
+
+    python -m pytest tests/test_daemon.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'benchmarks'))
+
+from installer import load_installer, scratch_home  # noqa: E402
+
+
+def read_file(path):
+    with open(path, 'rb') as stored:
+        return stored.read()
+
+
+class RecordingTool(object):
+    """
+    Stand-in for the config tool: add_connections holds every SSID it
+    is given for a while and records when and with which PFX
+    """
+    hold = 0.05
+
+    def __init__(self):
+        self.pfx_file = None
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def add_connections(self, user_data, ssids=None, del_ssids=None):
+        start = time.time()
+        pfx = None if self.pfx_file is None else read_file(self.pfx_file)
+        time.sleep(self.hold)
+        if self.pfx_file is not None and read_file(self.pfx_file) != pfx:
+            raise AssertionError("PFX rewritten while in use")
+        with self.lock:
+            self.calls.append((tuple(ssids), tuple(del_ssids), start,
+                               time.time(), user_data.username, pfx))
+
+
+class ProvisioningDaemonTest(unittest.TestCase):
+    ssids = ['eduroam', 'UCN', 'UCN-guest']
+
+    def setUp(self):
+        self.installer = load_installer()
+        self.home = scratch_home(self.installer)
+        self.installer.STATE = self.installer.ProvisioningState()
+        config = self.installer.Config
+        self.saved = (config.ssids, config.del_ssids, config.eap_outer,
+                      config.eap_inner)
+        config.ssids = list(self.ssids)
+        config.del_ssids = ['old-ssid']
+        config.eap_outer, config.eap_inner = 'PEAP', 'MSCHAPV2'
+        self.daemon = self.installer.ProvisioningDaemon(
+            os.path.join(self.home, 'daemon.sock'))
+        self.tool = self.daemon.config_tool = RecordingTool()
+
+    def tearDown(self):
+        config = self.installer.Config
+        (config.ssids, config.del_ssids, config.eap_outer,
+         config.eap_inner) = self.saved
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def provision_all(self, requests):
+        replies = [None] * len(requests)
+
+        def provision(number):
+            replies[number] = self.daemon.provision(requests[number])
+
+        threads = [threading.Thread(target=provision, args=(number,))
+                   for number in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return replies
+
+    def ssid_calls(self):
+        by_ssid = {}
+        for ssids, del_ssids, start, end, username, pfx in self.tool.calls:
+            for ssid in ssids:
+                by_ssid.setdefault(ssid, []).append((start, end))
+        return by_ssid
+
+    def test_serialized_per_ssid(self):
+        requests = [{'username': 'user{0}@ucn.cl'.format(number),
+                     'password': 'secret'} for number in range(4)]
+        replies = self.provision_all(requests)
+        self.assertEqual([reply['status'] for reply in replies],
+                         ['ok'] * 4)
+        by_ssid = self.ssid_calls()
+        self.assertEqual(sorted(by_ssid), sorted(self.ssids))
+        for ssid, spans in by_ssid.items():
+            self.assertEqual(len(spans), 4)
+            spans.sort()
+            for (_, end), (start, _) in zip(spans, spans[1:]):
+                self.assertLessEqual(end, start, ssid)
+        # different SSIDs were provisioned at the same time
+        spans = sorted(span for spans in by_ssid.values() for span in spans)
+        self.assertTrue(any(start < end for (_, end), (start, _)
+                            in zip(spans, spans[1:])))
+        deletions = [del_ssids for ssids, del_ssids, _, _, _, _
+                     in self.tool.calls if del_ssids]
+        self.assertEqual(deletions, [('old-ssid',)] * 4)
+        self.assertEqual(self.tool.pfx_file, None)
+
+    def test_bad_requests(self):
+        replies = self.provision_all([
+            {'username': 'user@ucn.cl'},
+            {'username': 5, 'password': 'secret'}])
+        self.assertEqual([reply['status'] for reply in replies],
+                         ['error', 'error'])
+        self.assertEqual(self.tool.calls, [])
+
+    @unittest.skipIf(shutil.which('openssl') is None, 'openssl not found')
+    def test_pfx_per_ssid(self):
+        from bench_p12 import PASSWORD, make_p12
+        config = self.installer.Config
+        config.eap_outer, config.eap_inner = 'TLS', ''
+        workdir = tempfile.mkdtemp(dir=self.home)
+        pfx_files = []
+        for number in range(2):
+            directory = os.path.join(workdir, str(number))
+            os.mkdir(directory)
+            pfx_files.append(make_p12(directory, 'AES-256-CBC'))
+        replies = self.provision_all([
+            {'username': 'user{0}@ucn.cl'.format(number),
+             'password': PASSWORD, 'pfx_file': pfx_file}
+            for number, pfx_file in enumerate(pfx_files)])
+        self.assertEqual([reply['status'] for reply in replies],
+                         ['ok', 'ok'])
+        contents = [read_file(pfx_file) for pfx_file in pfx_files]
+        for ssids, _, _, _, username, pfx in self.tool.calls:
+            if ssids:
+                # the PFX of the request the connection was added for
+                self.assertEqual(pfx, contents[int(username[4])])
+        paths = set(self.daemon.ssid_pfx(ssid) for ssid in self.ssids)
+        self.assertEqual(len(paths), len(self.ssids))
+        for path in paths:
+            self.assertIn(read_file(path), contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+HubLogReader over the sample activity and small hub logs in a temporary
+directory, checked against decoding every line with json.
+
+    python -m pytest tests/test_hub_log.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import (SAMPLE_AUDIO, SAMPLE_PROXIMITY, audio_line,
+                        scan_line, write_lines)
+
+from hub_log import (AudioChunk, HubLogReader, ProximityScan, RssiDistance,
+                     audio_record, proximity_record, read_records)
+
+START = 1554299803.0
+
+
+def decoded(path):
+    with open(path) as log:
+        return [json.loads(line) for line in log if line.strip()]
+
+
+class HubLogReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='hub_log_')
+        self.log = os.path.join(self.workdir, 'audio_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_sample_log(self):
+        chunks = list(HubLogReader(SAMPLE_AUDIO))
+        self.assertEqual([audio_record(chunk) for chunk in chunks],
+                         [dict(record, data=dict(
+                             record['data'],
+                             num_samples=len(record['data']['samples'])))
+                          for record in decoded(SAMPLE_AUDIO)])
+        self.assertTrue(all(isinstance(chunk, AudioChunk)
+                            for chunk in chunks))
+        scans = list(read_records(SAMPLE_PROXIMITY))
+        self.assertEqual(len(scans), 10)
+        for scan, record in zip(scans, decoded(SAMPLE_PROXIMITY)):
+            self.assertIsInstance(scan, ProximityScan)
+            self.assertEqual(proximity_record(scan)['data']['rssi_distances'],
+                             record['data']['rssi_distances'])
+
+    def test_filters(self):
+        chunks = list(HubLogReader(SAMPLE_AUDIO))
+        reader = HubLogReader(SAMPLE_AUDIO, member_ids=[641],
+                              start=1554299800, end=1554299850)
+        wanted = [chunk for chunk in chunks if chunk.member_id == 641 and
+                  1554299800 <= chunk.timestamp < 1554299850]
+        self.assertTrue(wanted)
+        self.assertEqual(list(reader), wanted)
+        self.assertEqual(reader.stats['lines'], len(chunks))
+        self.assertEqual(reader.stats['filtered'], len(chunks) - len(wanted))
+        # however the MAC is written
+        for badge in ('c1:7c:3b:1a:29:17', 'C17C3B1A2917'):
+            self.assertEqual(
+                list(HubLogReader(SAMPLE_AUDIO, badge_addresses=[badge])),
+                [chunk for chunk in chunks if chunk.member_id == 633])
+        self.assertEqual(list(HubLogReader(SAMPLE_AUDIO,
+                                           types=['proximity received'])),
+                         [])
+
+    def test_rssi_distances(self):
+        write_lines(self.log, [scan_line('F2:1E:84:04:C5:B5', 641, START,
+                                         [(633, -55, 4), (12, -70, 1)])])
+        scan, = HubLogReader(self.log)
+        self.assertEqual(scan.rssi_distances, (RssiDistance(12, -70, 1),
+                                               RssiDistance(633, -55, 4)))
+        self.assertEqual(scan.log_timestamp, START)
+
+    def test_truncated_line(self):
+        lines = [audio_line('F2:1E:84:04:C5:B5', 641, START + number,
+                            [3] * 10) for number in range(5)]
+        write_lines(self.log, lines[:-1] + [lines[-1][:50]])
+        reader = HubLogReader(self.log)
+        self.assertEqual(len(list(reader)), 4)
+        self.assertEqual(reader.stats['truncated'], 1)
+        self.assertEqual(reader.offset, len(''.join(lines[:-1])))
+        # the hub finishes the line: read on from where it stopped
+        write_lines(self.log, [lines[-1][50:]])
+        reader = HubLogReader(self.log, offset=reader.offset)
+        chunk, = reader
+        self.assertEqual(chunk.timestamp, START + 4)
+        # a complete last line without newline is taken
+        write_lines(self.log, [lines[0].rstrip('\n')])
+        self.assertEqual(len(list(HubLogReader(self.log))), 6)
+
+    def test_malformed_line(self):
+        write_lines(self.log, [
+            audio_line('F2:1E:84:04:C5:B5', 641, START, [3]),
+            '{"type": "audio received", "data": {}}\n', 'not json\n', '\n',
+            audio_line('F2:1E:84:04:C5:B5', 641, START + 1, [3])])
+        reader = HubLogReader(self.log)
+        self.assertEqual([chunk.timestamp for chunk in reader],
+                         [START, START + 1])
+        self.assertEqual(reader.stats['malformed'], 2)
+
+    def test_offset_limit(self):
+        lines = [audio_line('F2:1E:84:04:C5:B5', 641, START + number,
+                            [3] * 10) for number in range(10)]
+        write_lines(self.log, lines)
+        middle = len(''.join(lines[:4]))
+        first = HubLogReader(self.log, limit=middle)
+        second = HubLogReader(self.log, offset=middle)
+        self.assertEqual([chunk.timestamp for chunk in first] +
+                         [chunk.timestamp for chunk in second],
+                         [START + number for number in range(10)])
+        self.assertEqual(first.offset, middle)
+        self.assertEqual(second.offset, os.path.getsize(self.log))
+
+
+if __name__ == '__main__':
+    unittest.main()
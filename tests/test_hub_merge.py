@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+ClockOffsets and HubMerger over the sample activity and the logs of two
+small hubs written to a temporary directory.
+
+    python -m pytest tests/test_hub_merge.py
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import (SAMPLE_AUDIO, SAMPLE_PROXIMITY, audio_line,
+                        scan_line, write_lines)
+
+from hub_log import HubLogReader
+from hub_merge import ClockOffsets, HubMerger, record_end
+
+START = 1554299803.0
+# seconds a badge clock is behind before it gets the time from the hub
+BEHIND = 60000.0
+
+
+def hub_lines(badges, first, count, seed):
+    """
+    audio lines of badges (address, member id, clock offset) every 2 s,
+    reaching the hub 0.2 to 5 s after their end, in arrival order
+    """
+    rand = random.Random(seed)
+    lines = []
+    for number in range(first, first + count):
+        for badge, member_id, offset in badges:
+            timestamp = START + number * 2 - offset
+            arrival = START + number * 2 + 2 + rand.uniform(0.2, 5)
+            lines.append((arrival, audio_line(badge, member_id, timestamp,
+                                              [3] * 40,
+                                              log_timestamp=arrival)))
+    return [line for _, line in sorted(lines)]
+
+
+class HubMergeTest(unittest.TestCase):
+    badges = [('F2:1E:84:04:C5:B5', 641, 0.0),
+              ('C1:7C:3B:1A:29:17', 633, BEHIND)]
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='hub_merge_')
+        self.logs = [os.path.join(self.workdir, name)
+                     for name in ('hub1.txt', 'hub2.txt')]
+        write_lines(self.logs[0], hub_lines(self.badges[:1], 0, 200, 1))
+        write_lines(self.logs[1], hub_lines(self.badges[1:], 0, 200, 2))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def offsets(self, paths):
+        offsets = ClockOffsets()
+        for path in paths:
+            for record in HubLogReader(path):
+                offsets.add(record)
+        return offsets
+
+    def merged(self, paths, horizon=120.0):
+        merger = HubMerger(self.offsets(paths), horizon)
+        return merger, list(merger.merge([HubLogReader(path)
+                                          for path in paths]))
+
+    def test_offsets(self):
+        offsets = self.offsets(self.logs)
+        # the quickest records reach the hub 0.2 s after their end
+        self.assertAlmostEqual(offsets.offset('F2:1E:84:04:C5:B5'), 0.45,
+                               delta=0.25)
+        self.assertAlmostEqual(offsets.offset('c1:7c:3b:1a:29:17'),
+                               BEHIND + 0.45, delta=0.25)
+        self.assertEqual(offsets.offset('00:00:00:00:00:01'), 0.0)
+        self.assertEqual(sorted(offsets.offsets()),
+                         ['C1:7C:3B:1A:29:17', 'F2:1E:84:04:C5:B5'])
+
+    def test_two_hubs(self):
+        merger, merged = self.merged(self.logs)
+        self.assertEqual(len(merged), 400)
+        times = [time for time, _ in merged]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(merger.stats['late'], 0)
+        self.assertEqual(merger.stats['placed_at_arrival'], 0)
+        for time, record in merged:
+            self.assertLess(time, record.log_timestamp)
+            self.assertLess(record.log_timestamp - time, 2 + 5 + 0.5)
+        # the two badges interleave once corrected
+        members = [record.member_id for _, record in merged[:20]]
+        self.assertEqual(sorted(set(members)), [633, 641])
+        self.assertLess(merger.stats['most_held'], 400)
+
+    def test_clock_not_set(self):
+        # a few chunks stamped before the badge got the time
+        lines = hub_lines(self.badges[:1], 200, 100, 3)
+        early = hub_lines([('F2:1E:84:04:C5:B5', 641, BEHIND)], 300, 5, 4)
+        write_lines(self.logs[0], lines + early)
+        merger, merged = self.merged(self.logs)
+        self.assertEqual(merger.stats['placed_at_arrival'], 5)
+        times = [time for time, _ in merged]
+        self.assertEqual(times, sorted(times))
+        for time, record in merged:
+            if record.member_id == 641 and \
+                    record.timestamp < START - BEHIND / 2:
+                # placed to end when it reached the hub
+                self.assertAlmostEqual(time + record_end(record) -
+                                       record.timestamp,
+                                       record.log_timestamp, delta=1e-3)
+            self.assertLess(abs(record.log_timestamp - time), 120)
+
+    def test_sample_log(self):
+        paths = [SAMPLE_AUDIO, SAMPLE_PROXIMITY]
+        merger, merged = self.merged(paths)
+        self.assertEqual(len(merged), 45)
+        times = [time for time, _ in merged]
+        self.assertEqual(times, sorted(times))
+        for time, record in merged:
+            self.assertLess(abs(record.log_timestamp - time), 120)
+
+    def test_scans(self):
+        write_lines(self.logs[1], [
+            scan_line('C1:7C:3B:1A:29:17', 633, START - BEHIND + number * 5,
+                      [(641, -60, 2)], log_timestamp=START + number * 5 + 1)
+            for number in range(200, 240)])
+        merger, merged = self.merged(self.logs)
+        self.assertEqual(len(merged), 440)
+        times = [time for time, _ in merged]
+        self.assertEqual(times, sorted(times))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+CatNMAsyncConfigTool against the fake NetworkManager of the benchmarks,
+served on a private dbus-daemon. Skipped without dbus-daemon, the dbus
+and gi modules (needed by the fake NM) or dbus_next.
+
+    python -m pytest tests/test_nm_async.py
+"""
+import os
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'benchmarks'))
+
+import fake_nm  # noqa: E402
+from installer import load_installer, scratch_home, UserData  # noqa: E402
+
+
+def missing_requirements():
+    """why the fake NM or the asyncio backend cannot run, or None"""
+    if shutil.which('dbus-daemon') is None:
+        return 'dbus-daemon not found'
+    for module in ('dbus', 'gi', 'dbus_next'):
+        try:
+            __import__(module)
+        except ImportError:
+            return module + ' not installed'
+    return None
+
+
+MISSING = missing_requirements()
+
+
+@unittest.skipIf(MISSING, MISSING)
+class CatNMAsyncConfigToolTest(unittest.TestCase):
+    stale = 5
+
+    def setUp(self):
+        self.installer = load_installer()
+        self.home = scratch_home(self.installer)
+        self.installer.STATE = self.installer.ProvisioningState()
+        self.installer.Config.ssids = ['eduroam']
+        self.installer.Config.del_ssids = ['old-ssid']
+        self.bus_proc, self.address = fake_nm.start_private_bus()
+        self.nm_proc = fake_nm.start_fake_nm(
+            self.address, self.stale, ssids=['eduroam', 'old-ssid'])
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = self.address
+
+    def tearDown(self):
+        self.nm_proc.terminate()
+        self.nm_proc.wait()
+        self.bus_proc.terminate()
+        self.bus_proc.wait()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def connected_tool(self):
+        config_tool = self.installer.CatNMAsyncConfigTool()
+        self.assertTrue(config_tool.connect_to_nm())
+        return config_tool
+
+    def stale_ssids(self):
+        return ['stale-ssid-{0}'.format(number)
+                for number in range(self.stale)]
+
+    def test_version(self):
+        self.assertEqual(self.connected_tool().nm_version, '1.0')
+
+    def test_connection_index(self):
+        index = self.connected_tool().connection_index()
+        self.assertEqual(sorted(index.path_ssid.values()),
+                         sorted(self.stale_ssids() +
+                                ['eduroam', 'old-ssid']))
+        self.assertEqual(len(index.paths('eduroam')), 1)
+        counts = fake_nm.call_counts(self.address)
+        self.assertEqual(counts['ListConnections'], 1)
+        self.assertEqual(counts['GetSettings'], self.stale + 2)
+
+    def test_add_connections(self):
+        config_tool = self.connected_tool()
+        old_path = config_tool.connection_index().paths('eduroam')[0]
+        config_tool.add_connections(UserData())
+        self.assertEqual(fake_nm.stored_ssids(self.address),
+                         sorted(self.stale_ssids() + ['eduroam']))
+        counts = fake_nm.call_counts(self.address)
+        self.assertEqual(counts['AddConnection'], 1)
+        self.assertEqual(counts['Delete'], 2)
+        index = config_tool.connection_index()
+        self.assertEqual(index.paths('old-ssid'), [])
+        new_paths = index.paths('eduroam')
+        self.assertEqual(len(new_paths), 1)
+        self.assertNotEqual(new_paths[0], old_path)
+        self.assertEqual(
+            self.installer.STATE.get('connection:eduroam')['path'],
+            new_paths[0])
+
+    def test_connection_ssids(self):
+        config_tool = self.connected_tool()
+        paths = sorted(config_tool.connection_index().path_ssid)
+        missing = '/org/freedesktop/NetworkManager/Settings/999'
+        self.assertEqual(
+            config_tool.connection_ssids(paths + [missing]),
+            [config_tool.connection_index().path_ssid[path]
+             for path in paths] + [None])
+
+    def test_rerun_unchanged(self):
+        self.connected_tool().add_connections(UserData())
+        fake_nm.reset_counts(self.address)
+        self.connected_tool().add_connections(UserData())
+        counts = fake_nm.call_counts(self.address)
+        self.assertNotIn('AddConnection', counts)
+        self.assertNotIn('Delete', counts)
+        self.assertEqual(fake_nm.stored_ssids(self.address),
+                         sorted(self.stale_ssids() + ['eduroam']))
+
+
+if __name__ == '__main__':
+    unittest.main()
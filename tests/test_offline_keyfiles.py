@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Keyfiles written by OfflineNMConfigTool and provision_images into image
+roots in a temporary directory, read back and checked.
+
+    python -m pytest tests/test_offline_keyfiles.py
+"""
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'benchmarks'))
+
+from installer import load_installer, UserData  # noqa: E402
+
+CONNECTIONS = 'etc/NetworkManager/system-connections'
+ESCAPES = {'\\': '\\', 'n': '\n', 't': '\t', 'r': '\r', ';': ';', 's': ' '}
+
+
+def unescape(text):
+    """a keyfile string value as NetworkManager reads it"""
+    return re.sub(r'\\(.)', lambda match: ESCAPES[match.group(1)], text)
+
+
+def unescape_list(text):
+    """the items of a keyfile list value"""
+    items = re.findall(r'((?:[^\\;]|\\.)*);', text)
+    return [unescape(item) for item in items]
+
+
+def read_keyfile(path):
+    """group -> key -> raw value of a keyfile"""
+    groups = {}
+    group = None
+    with open(path) as keyfile:
+        for line in keyfile:
+            line = line.rstrip('\n')
+            if line.startswith('['):
+                group = groups.setdefault(line.strip('[]'), {})
+            elif line:
+                key, value = line.split('=', 1)
+                group[key] = value
+    return groups
+
+
+class KeyfileValueTest(unittest.TestCase):
+    def setUp(self):
+        self.installer = load_installer()
+
+    def test_strings(self):
+        keyfile_value = self.installer.keyfile_value
+        for text in ['plain', 'back\\slash', 'new\nline', ' leading',
+                     'tab\tand\rreturn', 'semi;colon', u'ñandú']:
+            self.assertEqual(unescape(keyfile_value(text)), text)
+        self.assertEqual(keyfile_value(' a'), '\\sa')
+        self.assertEqual(keyfile_value(0), '0')
+
+    def test_lists(self):
+        keyfile_value = self.installer.keyfile_value
+        items = ['DNS:radius.ucn.cl', 'a;b', 'c\\d', ' e']
+        value = keyfile_value(items)
+        self.assertTrue(value.endswith(';'))
+        self.assertEqual(unescape_list(value), items)
+        self.assertEqual(keyfile_value([]), '')
+
+    def test_byte_arrays(self):
+        keyfile_value = self.installer.keyfile_value
+        self.assertEqual(keyfile_value(bytearray(b'eduroam')), 'eduroam')
+        self.assertEqual(keyfile_value(bytearray(b'a;b')),
+                         '97;59;98;')
+        self.assertEqual(keyfile_value(bytearray(b'\x01\xff')), '1;255;')
+        self.assertEqual(
+            keyfile_value(bytearray(b'file:///home/u/ca.pem\0')),
+            '/home/u/ca.pem')
+
+
+class ProvisionImagesTest(unittest.TestCase):
+    ssids = ['eduroam', 'UCN; guest']
+    password = 'p4ss;word\\ "quoted"'
+
+    def setUp(self):
+        self.installer = load_installer()
+        self.workdir = tempfile.mkdtemp(prefix='cat_offline_')
+        os.environ['HOME'] = os.path.join(self.workdir, 'home')
+        config = self.installer.Config
+        self.saved = (config.ssids, config.del_ssids, config.eap_outer,
+                      config.eap_inner)
+        config.ssids = list(self.ssids)
+        config.del_ssids = ['old-ssid']
+        config.eap_outer, config.eap_inner = 'PEAP', 'MSCHAPV2'
+        self.roots = [self.image(name) for name in ('image1', 'image2')]
+
+    def tearDown(self):
+        config = self.installer.Config
+        (config.ssids, config.del_ssids, config.eap_outer,
+         config.eap_inner) = self.saved
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def image(self, name):
+        """an image root with a passwd file and some old keyfiles"""
+        root = os.path.join(self.workdir, name)
+        os.makedirs(os.path.join(root, 'etc'))
+        with open(os.path.join(root, 'etc/passwd'), 'w') as passwd:
+            passwd.write('root:x:0:0::/root:/bin/sh\n'
+                         'badge:x:1000:1000::/home/badge:/bin/sh\n')
+        connections = os.path.join(root, CONNECTIONS)
+        os.makedirs(connections)
+        for file_name, ssid in [('old.nmconnection', 'old-ssid'),
+                                ('home.nmconnection', 'home-wifi'),
+                                ('eduroam-1.nmconnection', 'eduroam')]:
+            with open(os.path.join(connections, file_name), 'w') as keyfile:
+                keyfile.write('[connection]\ntype=wifi\nid={0}\n\n'
+                              '[wifi]\nssid={0}\n'.format(ssid))
+        with open(os.path.join(connections, 'wired.nmconnection'),
+                  'w') as keyfile:
+            keyfile.write('[connection]\ntype=ethernet\nid=wired\n')
+        return root
+
+    def provision(self):
+        user_data = UserData('badge@ucn.cl', self.password)
+        results = self.installer.provision_images(self.roots, 'badge',
+                                                  None, user_data)
+        self.assertEqual(results, [(root, None) for root in self.roots])
+
+    def keyfiles(self, root):
+        connections = os.path.join(root, CONNECTIONS)
+        return dict((name, os.path.join(connections, name))
+                    for name in sorted(os.listdir(connections)))
+
+    def test_keyfiles(self):
+        self.provision()
+        uuids = set()
+        for root in self.roots:
+            keyfiles = self.keyfiles(root)
+            self.assertEqual(sorted(keyfiles), [
+                'UCN__guest.nmconnection', 'eduroam.nmconnection',
+                'home.nmconnection', 'wired.nmconnection'])
+            for ssid in self.ssids:
+                name = re.sub(r'[^A-Za-z0-9._-]', '_', ssid) + \
+                    '.nmconnection'
+                path = keyfiles[name]
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+                self.assertEqual(self.installer.keyfile_ssid(path), ssid)
+                groups = read_keyfile(path)
+                connection = groups['connection']
+                self.assertEqual(connection['type'], 'wifi')
+                self.assertEqual(unescape(connection['id']), ssid)
+                self.assertEqual(unescape_list(connection['permissions']),
+                                 ['user:badge'])
+                connection_uuid = uuid.UUID(connection['uuid'])
+                self.assertEqual(str(connection_uuid), connection['uuid'])
+                uuids.add(connection['uuid'])
+                self.assertEqual(groups['wifi']['security'],
+                                 '802-11-wireless-security')
+                self.assertEqual(groups['wifi-security']['key-mgmt'],
+                                 'wpa-eap')
+                self.assertEqual(
+                    unescape_list(groups['wifi-security']['group']),
+                    ['ccmp', 'tkip'])
+                eap = groups['802-1x']
+                self.assertEqual(unescape(eap['identity']), 'badge@ucn.cl')
+                self.assertEqual(unescape(eap['password']), self.password)
+                self.assertEqual(unescape_list(eap['eap']), ['peap'])
+                self.assertEqual(eap['phase2-auth'], 'mschapv2')
+                self.assertEqual(eap['ca-cert'],
+                                 '/home/badge/.cat_installer/ca.pem')
+        self.assertEqual(len(uuids), len(self.ssids) * len(self.roots))
+
+    def test_ssid_with_separator(self):
+        self.provision()
+        path = self.keyfiles(self.roots[0])['UCN__guest.nmconnection']
+        ssid = read_keyfile(path)['wifi']['ssid']
+        self.assertEqual(ssid, ''.join(
+            str(byte) + ';' for byte in bytearray(b'UCN; guest')))
+
+    def test_ca_certificate(self):
+        self.provision()
+        for root in self.roots:
+            path = os.path.join(root, 'home/badge/.cat_installer/ca.pem')
+            with open(path) as cert:
+                self.assertEqual(cert.read(),
+                                 self.installer.Config.CA + '\n')
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+    def test_rerun(self):
+        self.provision()
+        first = read_keyfile(
+            self.keyfiles(self.roots[0])['eduroam.nmconnection'])
+        self.provision()
+        keyfiles = self.keyfiles(self.roots[0])
+        self.assertEqual(len(keyfiles), 4)
+        second = read_keyfile(keyfiles['eduroam.nmconnection'])
+        self.assertEqual(first['802-1x'], second['802-1x'])
+
+    def test_keyfile_ssid(self):
+        keyfile_ssid = self.installer.keyfile_ssid
+        keyfiles = self.keyfiles(self.roots[0])
+        self.assertEqual(keyfile_ssid(keyfiles['old.nmconnection']),
+                         'old-ssid')
+        self.assertIsNone(keyfile_ssid(keyfiles['wired.nmconnection']))
+        self.assertIsNone(keyfile_ssid(os.path.join(self.workdir, 'none')))
+
+    def test_missing_root(self):
+        missing = os.path.join(self.workdir, 'missing')
+        results = self.installer.provision_images(
+            [missing], 'badge', None, UserData())
+        self.assertEqual(results, [(missing, 'not a directory')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+ProximityGraph windows over the sample activity and small hub logs in a
+temporary directory, checked against summing the scans of every window.
+
+    python -m pytest tests/test_proximity_graph.py
+"""
+import collections
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_PROXIMITY, scan_line, write_lines
+
+from proximity_graph import ProximityGraph, read_scans
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+START = 1554299805.0
+MEMBERS = {641: 'F2:1E:84:04:C5:B5', 633: 'C1:7C:3B:1A:29:17',
+           601: 'CB:F3:EB:7C:75:69'}
+
+
+def session(count, seed=1, delay=20):
+    """
+    scans of every badge every 15 s, logged up to `delay` s late and in
+    arrival order
+    """
+    rand = random.Random(seed)
+    lines = []
+    for number in range(count):
+        for member_id, badge in sorted(MEMBERS.items()):
+            timestamp = START + number * 15 + rand.uniform(0, 1)
+            heard = [(other, rand.randint(-80, -50), rand.randint(1, 5))
+                     for other in sorted(MEMBERS) if other != member_id]
+            arrival = timestamp + rand.uniform(0.5, delay)
+            lines.append((arrival, scan_line(badge, member_id, timestamp,
+                                             heard, log_timestamp=arrival)))
+    return [line for _, line in sorted(lines)]
+
+
+def expected(path, width, threshold=-62):
+    """window start -> (observer, heard) -> [count, rssi sum, near]"""
+    windows = collections.defaultdict(dict)
+    for scan in read_scans(path):
+        start = scan.timestamp // width * width
+        for seen in scan.rssi_distances:
+            edge = windows[start].setdefault(
+                (scan.member_id, seen.member_id), [0, 0, 0])
+            edge[0] += seen.count
+            edge[1] += seen.rssi * seen.count
+            if seen.rssi >= threshold:
+                edge[2] += seen.count
+    return windows
+
+
+class ProximityGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='proximity_graph_')
+        self.log = os.path.join(self.workdir, 'proximity_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def check(self, path, width):
+        graph = ProximityGraph(width)
+        windows = list(graph.windows(read_scans(path)))
+        self.assertEqual(graph.stats['late'], 0)
+        wanted = expected(path, width)
+        self.assertEqual([window.start for window in windows],
+                         sorted(wanted))
+        for window in windows:
+            self.assertEqual(window.end - window.start, width)
+            edges = wanted[window.start]
+            self.assertEqual([(edge.observer, edge.heard)
+                              for edge in window.edges], sorted(edges))
+            for edge in window.edges:
+                count, rssi, near = edges[(edge.observer, edge.heard)]
+                self.assertEqual(edge.count, count)
+                self.assertAlmostEqual(edge.rssi, float(rssi) / count)
+                self.assertEqual(edge.near, near)
+        return graph, windows
+
+    def test_sample_log(self):
+        for width in (15, 60, 300):
+            graph, windows = self.check(SAMPLE_PROXIMITY, width)
+            self.assertEqual(graph.stats['scans'], 10)
+            self.assertTrue(windows)
+
+    def test_windows(self):
+        write_lines(self.log, session(100))
+        for width in (15, 60, 300):
+            graph, windows = self.check(self.log, width)
+            self.assertEqual(graph.stats['edges'], sum(
+                len(window.edges) for window in windows))
+        # every window is given a lateness past its end
+        graph = ProximityGraph(15, lateness=30)
+        for scan in read_scans(self.log):
+            for window in graph.add(scan):
+                self.assertLessEqual(window.end, graph.newest - 30)
+            self.assertLessEqual(len(graph.open), 4)
+
+    def test_late_scan(self):
+        lines = session(20)
+        late = scan_line(MEMBERS[641], 641, START + 2, [(633, -55, 3)],
+                         log_timestamp=START + 500)
+        write_lines(self.log, lines + [late])
+        graph = ProximityGraph(15)
+        windows = list(graph.windows(read_scans(self.log)))
+        self.assertEqual(graph.stats['late'], 1)
+        first = windows[0].edges
+        self.assertEqual(sum(edge.count for edge in first), sum(
+            edge[0] for edge in expected(self.log, 15)[windows[0].start]
+            .values()) - 3)
+
+    def test_scan_ahead(self):
+        # a badge clock a day ahead does not close every window at once
+        lines = session(10)
+        ahead = scan_line(MEMBERS[601], 601, START + 86400, [(641, -55, 3)],
+                          log_timestamp=START + 20)
+        write_lines(self.log, lines[:5] + [ahead] + lines[5:])
+        graph = ProximityGraph(15)
+        windows = list(graph.windows(read_scans(self.log)))
+        self.assertEqual(graph.stats['ahead'], 1)
+        self.assertEqual(graph.stats['late'], 0)
+        self.assertLess(windows[-1].start, START + 86400 - 15)
+        self.assertEqual(len(windows), 10)
+
+    def test_matrix(self):
+        write_lines(self.log, session(4))
+        window = list(ProximityGraph(60).windows(read_scans(self.log)))[0]
+        index = {}
+        rows, cols, values = window.matrix(index, weight='count')
+        self.assertEqual(sorted(index), sorted(MEMBERS))
+        self.assertEqual(len(values), len(window.edges))
+        members = dict((row, member_id)
+                       for member_id, row in index.items())
+        for row, col, value in zip(rows, cols, values):
+            edge, = [edge for edge in window.edges
+                     if (edge.observer, edge.heard) ==
+                     (members[row], members[col])]
+            self.assertEqual(value, edge.count)
+        # the face to face matrix leaves out the edges with no near ping
+        self.assertEqual(len(window.matrix(index)[2]), len(
+            [edge for edge in window.edges if edge.near]))
+        self.assertEqual(len(index), len(MEMBERS))
+
+    @unittest.skipIf(scipy is None, 'scipy not installed')
+    def test_sparse(self):
+        write_lines(self.log, session(4))
+        window = list(ProximityGraph(60).windows(read_scans(self.log)))[0]
+        index = {}
+        matrix = window.sparse(index, weight='count')
+        self.assertEqual(matrix.shape, (len(MEMBERS), len(MEMBERS)))
+        self.assertEqual(matrix.sum(),
+                         sum(edge.count for edge in window.edges))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Reconciler over the sample activity and small hub logs in a temporary
+directory, checked against pairing the edges of every window by hand.
+
+    python -m pytest tests/test_reconcile.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_PROXIMITY, scan_line, write_lines
+
+import reconcile
+from proximity_graph import ProximityGraph, read_scans
+from reconcile import Reconciler
+
+START = 1554299805.0
+BADGES = {641: 'F2:1E:84:04:C5:B5', 633: 'C1:7C:3B:1A:29:17',
+          601: 'CB:F3:EB:7C:75:69'}
+
+
+class ReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='reconcile_')
+        self.log = os.path.join(self.workdir, 'proximity_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def pairs(self, lines, width=15.0):
+        write_lines(self.log, lines)
+        reconciler = Reconciler(width)
+        return reconciler, list(reconciler.pairs(read_scans(self.log)))
+
+    def test_two_sides(self):
+        reconciler, pairs = self.pairs([
+            scan_line(BADGES[641], 641, START, [(633, -55, 4)]),
+            scan_line(BADGES[633], 633, START + 3, [(641, -61, 2)],
+                      log_timestamp=START + 10)])
+        pair, = pairs
+        self.assertEqual((pair.low, pair.high), (633, 641))
+        self.assertIsNone(pair.heard_by)
+        self.assertEqual((pair.low_rssi, pair.high_rssi), (-61, -55))
+        self.assertEqual((pair.low_count, pair.high_count), (2, 4))
+        self.assertAlmostEqual(pair.rssi, (-61 * 2 - 55 * 4) / 6.0)
+        self.assertTrue(pair.near)
+        self.assertAlmostEqual(pair.confidence, 6 / (6 + reconcile.PINGS_HALF)
+                               / (1 + (6 / reconcile.RSSI_SPREAD) ** 2))
+        self.assertEqual(pair.start, START // 15 * 15)
+        self.assertEqual(reconciler.stats['two_sided'], 1)
+
+    def test_one_side(self):
+        reconciler, pairs = self.pairs([
+            scan_line(BADGES[641], 641, START, [(601, -70, 4),
+                                                (641, -20, 1)])])
+        pair, = pairs
+        self.assertEqual((pair.low, pair.high, pair.heard_by),
+                         (601, 641, 641))
+        self.assertIsNone(pair.low_rssi)
+        self.assertEqual(pair.high_count, 4)
+        self.assertFalse(pair.near)
+        self.assertAlmostEqual(pair.confidence,
+                               4 / (4 + reconcile.PINGS_HALF) / 2)
+        self.assertEqual(reconciler.stats['one_sided'], 1)
+
+    def test_agreement(self):
+        # the sides agreeing give more confidence than disagreeing ones
+        _, pairs = self.pairs([
+            scan_line(BADGES[641], 641, START, [(633, -55, 4),
+                                                (601, -55, 4)]),
+            scan_line(BADGES[633], 633, START + 1, [(641, -56, 4)]),
+            scan_line(BADGES[601], 601, START + 2, [(641, -75, 4)])])
+        apart, agreed = pairs
+        self.assertEqual((apart.low, agreed.low), (601, 633))
+        self.assertGreater(agreed.confidence, apart.confidence)
+
+    def test_windows(self):
+        lines = []
+        for number in range(40):
+            for member_id in (641, 633):
+                other = 633 if member_id == 641 else 641
+                lines.append(scan_line(
+                    BADGES[member_id], member_id, START + number * 15,
+                    [(other, -60, 1)],
+                    log_timestamp=START + number * 15 + 5))
+        reconciler, pairs = self.pairs(lines, width=60)
+        starts = sorted(set((START + number * 15) // 60 * 60
+                            for number in range(40)))
+        self.assertEqual([pair.start for pair in pairs], starts)
+        for pair in pairs:
+            self.assertIsNone(pair.heard_by)
+        self.assertEqual(sum(pair.low_count + pair.high_count
+                             for pair in pairs), 80)
+        self.assertEqual(reconciler.stats['windows'], len(starts))
+
+    def test_sample_log(self):
+        graph = ProximityGraph(15)
+        windows = list(graph.windows(read_scans(SAMPLE_PROXIMITY)))
+        reconciler = Reconciler(15)
+        pairs = list(reconciler.pairs(read_scans(SAMPLE_PROXIMITY)))
+        self.assertEqual(pairs, sum((reconcile.join(window)
+                                     for window in windows), []))
+        # every directed edge is in exactly one pair
+        self.assertEqual(sum(pair.low_count + pair.high_count
+                             for pair in pairs),
+                         sum(edge.count for window in windows
+                             for edge in window.edges
+                             if edge.observer != edge.heard))
+        self.assertEqual(reconciler.stats['one_sided'] +
+                         reconciler.stats['two_sided'], len(pairs))
+
+
+if __name__ == '__main__':
+    unittest.main()
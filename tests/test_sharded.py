@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded decoding of sharded.py over small hub logs, checked against a
+single HubLogReader pass.
+
+    python -m pytest tests/test_sharded.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_AUDIO, audio_line, write_lines
+
+import sharded
+from hub_log import HubLogReader
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'benchmarks'))
+
+from workload import write_workload  # noqa: E402
+
+START = 1554299803.0
+
+
+class ShardCountTest(unittest.TestCase):
+    def test_shard_count(self):
+        self.assertEqual(sharded.shard_count(100 << 20, 1), 1)
+        # a small log still gets a few shards per process
+        self.assertEqual(sharded.shard_count(10 << 20, 2), 8)
+        self.assertEqual(sharded.shard_count(3 << 20, 4), 3)
+        self.assertEqual(sharded.shard_count(100, 4), 1)
+        self.assertEqual(sharded.shard_count(0, 4), 1)
+        self.assertEqual(sharded.shard_count(1 << 30, 2),
+                         (1 << 30) // sharded.MAX_SHARD)
+
+
+class ShardedTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='sharded_')
+        self.log = write_workload(self.workdir, badges=6, hours=0.05)[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_shard_ranges(self):
+        with open(self.log, 'rb') as log:
+            data = log.read()
+        for shards in (1, 2, 7, 50):
+            ranges = sharded.shard_ranges(self.log, shards)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_tasks(self):
+        expected = dict((task, sharded.TASKS[task][0](
+            HubLogReader(self.log))) for task in ('count', 'records'))
+        for processes, shards in [(1, None), (1, 5), (2, 9)]:
+            for task in ('count', 'records'):
+                self.assertEqual(sharded.parse_sharded(
+                    self.log, task, processes, shards), expected[task])
+            columns = sharded.parse_sharded(self.log, 'columns', processes,
+                                            shards)
+            audio = expected['records']
+            self.assertEqual(columns['samples'].tolist(), sum(
+                (record.samples for record in audio), []))
+            self.assertEqual(columns['timestamp'].tolist(),
+                             [record.timestamp for record in audio])
+            voltages = sharded.parse_sharded(self.log, 'voltage', processes,
+                                             shards)
+            single = sharded.voltage_records(expected['records'])
+            self.assertEqual(sorted(voltages), sorted(single))
+            for badge, (low, total, count) in single.items():
+                self.assertEqual(voltages[badge][0], low)
+                self.assertAlmostEqual(voltages[badge][1], total)
+                self.assertEqual(voltages[badge][2], count)
+
+    def test_filters(self):
+        records = sharded.parse_sharded(SAMPLE_AUDIO, 'records', 2, 3,
+                                        member_ids=[641])
+        self.assertEqual(records, list(HubLogReader(SAMPLE_AUDIO,
+                                                    member_ids=[641])))
+        self.assertTrue(records)
+
+    def test_unfinished_line(self):
+        path = os.path.join(self.workdir, 'partial.txt')
+        lines = [audio_line('F2:1E:84:04:C5:B5', 641, START + number,
+                            [3] * 10) for number in range(20)]
+        write_lines(path, lines + [lines[0][:30]])
+        self.assertEqual(len(sharded.parse_sharded(path, 'records', 2, 4)),
+                         20)
+
+
+if __name__ == '__main__':
+    unittest.main()
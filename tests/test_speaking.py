@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Speaking intervals of speaking.py from audio stores of small hub logs
+in a temporary directory. Skipped without NumPy.
+
+    python -m pytest tests/test_speaking.py
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_AUDIO, audio_line, write_lines
+
+import speaking
+from audio_store import AudioStore
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BADGE = 'F2:1E:84:04:C5:B5'
+START = 1554299803.0
+PERIOD = 0.05
+CHUNK = 20
+
+
+def voice(seconds, speech, seed=1):
+    """
+    samples of `seconds` seconds around a floor of 3, loud within the
+    (start, end) seconds of speech
+    """
+    rand = random.Random(seed)
+    samples = []
+    for number in range(int(seconds / PERIOD)):
+        at = number * PERIOD
+        loud = any(start <= at < end for start, end in speech)
+        samples.append(rand.randint(20, 40) if loud else rand.randint(2, 4))
+    return samples
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class SpeakingTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='speaking_')
+        self.root = os.path.join(self.workdir, 'store')
+        self.log = os.path.join(self.workdir, 'audio_data.txt')
+        self.sparse = speaking.SPARSE
+
+    def tearDown(self):
+        speaking.SPARSE = self.sparse
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def store(self, chunks):
+        """a store of (start second, samples) chunks of one badge"""
+        write_lines(self.log, [
+            audio_line(BADGE, 641, START + second, samples)
+            for second, samples in chunks])
+        store = AudioStore(self.root)
+        store.ingest(self.log)
+        return store
+
+    def grid(self, store):
+        return speaking.sample_grid(store.chunk_index(BADGE),
+                                    store.samples(BADGE))
+
+    def split(self, samples, first=0.0):
+        """the samples as chunks of CHUNK samples from second first"""
+        return [(first + pos * PERIOD, samples[pos:pos + CHUNK])
+                for pos in range(0, len(samples), CHUNK)]
+
+    def test_intervals(self):
+        store = self.store(self.split(voice(60, [(10, 14), (30, 31)])))
+        (_, member_id, starts, ends), = speaking.speaking_intervals(
+            self.root, processes=1)
+        self.assertEqual(member_id, 641)
+        self.assertEqual(len(starts), 2)
+        for (start, end), (found_start, found_end) in zip(
+                [(10, 14), (30, 31)], zip(starts - START, ends - START)):
+            self.assertAlmostEqual(found_start, start, delta=0.5)
+            self.assertAlmostEqual(found_end, end, delta=0.5)
+        self.assertEqual(len(self.grid(store)[2]), 60 / PERIOD)
+
+    def test_short_pause_closed(self):
+        store = self.store(self.split(voice(60, [(10, 12), (12.3, 14)])))
+        starts, ends = speaking.intervals(*self.grid(store))
+        self.assertEqual(len(starts), 1)
+        self.assertAlmostEqual(ends[0] - starts[0], 4, delta=0.5)
+
+    def test_gap_not_joined(self):
+        # speech up to a gap of 0.2 s in the data and on after it
+        samples = voice(60, [(10, 14)])
+        cut = int(12 / PERIOD)
+        gap = int(0.2 / PERIOD)
+        chunks = self.split(samples[:cut]) + \
+            self.split(samples[cut + gap:], first=(cut + gap) * PERIOD)
+        store = self.store(chunks)
+        starts, ends = speaking.intervals(*self.grid(store))
+        self.assertEqual(len(starts), 2)
+        self.assertAlmostEqual(ends[0] - START, 12, delta=1e-6)
+        self.assertAlmostEqual(starts[1] - START, 12.2, delta=1e-6)
+
+    def test_resent_chunks(self):
+        # a chunk sent half full and then again whole: the later copy
+        # is kept for every cell both fill
+        samples = voice(10, [])
+        store = self.store([(0, samples[:100]), (5, [7] * 50),
+                            (5, [9] * 100)])
+        for sparse in (self.sparse, 0):
+            speaking.SPARSE = sparse
+            period, first, cells, values = self.grid(store)
+            self.assertAlmostEqual(period, PERIOD)
+            self.assertEqual(cells.tolist(), list(range(200)))
+            self.assertEqual(values.tolist(), samples[:100] + [9] * 100)
+
+    def test_sample_log(self):
+        AudioStore(self.root).ingest(SAMPLE_AUDIO)
+        results = speaking.speaking_intervals(self.root, processes=1)
+        self.assertEqual(len(results), len(AudioStore(self.root).badges()))
+        for badge, member_id, starts, ends in results:
+            self.assertTrue((ends > starts).all())
+            self.assertTrue((starts[1:] >= ends[:-1]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+TimeIndex range queries over small hub logs in a temporary directory,
+checked against a plain scan of the log.
+
+    python -m pytest tests/test_time_index.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+# hub_sample puts Scripts on the path
+from hub_sample import SAMPLE_PROXIMITY, scan_line, write_lines
+
+import time_index
+from hub_log import TIMESTAMP_FIELD
+from time_index import TimeIndex
+
+START = 1554299803.0
+
+
+def session(first, count, lag_every=7, lag=3600.0):
+    """scan lines every 5 s; some badges stamp them an hour behind"""
+    lines = []
+    for number in range(first, first + count):
+        log_time = START + number * 5
+        timestamp = log_time - lag if number % lag_every == 0 else log_time
+        lines.append(scan_line('F2:1E:84:04:C5:B5', 641, timestamp,
+                               [(633, -55, 4)], log_timestamp=log_time))
+    return lines
+
+
+def scanned(path, start, end):
+    """the lines of [start, end) found by reading the whole log"""
+    lines = []
+    with open(path, 'rb') as log:
+        for line in log:
+            timestamp = float(TIMESTAMP_FIELD.search(line).group(1))
+            if (start is None or timestamp >= start) and \
+                    (end is None or timestamp < end):
+                lines.append(line)
+    return lines
+
+
+class TimeIndexTest(unittest.TestCase):
+    ranges = [(START, START + 60), (START - 3600, START - 3000),
+              (START + 1000, START + 1400), (None, START + 30),
+              (START + 2000, None), (None, None), (0, 1)]
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='time_index_')
+        self.log = os.path.join(self.workdir, 'proximity_data.txt')
+        self.min_block = time_index.MIN_BLOCK
+        # many blocks out of a small log
+        time_index.MIN_BLOCK = 2048
+
+    def tearDown(self):
+        time_index.MIN_BLOCK = self.min_block
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def check(self, index):
+        for start, end in self.ranges:
+            self.assertEqual(list(index.lines(start, end)),
+                             scanned(self.log, start, end), (start, end))
+
+    def test_sample_log(self):
+        shutil.copy(SAMPLE_PROXIMITY, self.log)
+        index = TimeIndex(self.log)
+        index.update()
+        self.check(index)
+        self.assertEqual(len(list(index.records())), 10)
+
+    def test_incremental(self):
+        write_lines(self.log, session(0, 300))
+        index = TimeIndex(self.log)
+        index.update()
+        size = os.path.getsize(self.log)
+        write_lines(self.log, session(300, 300))
+        index = TimeIndex(self.log)
+        # the new lines and the last block again
+        self.assertLess(index.update(), os.path.getsize(self.log) - size +
+                        2 * time_index.MIN_BLOCK)
+        self.check(index)
+        os.remove(index.path)
+        whole = TimeIndex(self.log)
+        whole.update()
+        self.assertEqual(list(whole.entries), list(index.entries))
+
+    def test_partial_line(self):
+        lines = session(0, 100)
+        write_lines(self.log, lines[:-1] + [lines[-1][:40]])
+        index = TimeIndex(self.log)
+        index.update()
+        self.assertEqual(index.indexed, len(''.join(lines[:-1])))
+        write_lines(self.log, [lines[-1][40:]])
+        index.update()
+        self.check(index)
+
+    def test_cut_log(self):
+        write_lines(self.log, session(0, 400))
+        index = TimeIndex(self.log)
+        index.update()
+        write_lines(self.log, session(0, 50), mode='w')
+        # no update(): the query finds the log cut and indexes it again
+        self.check(index)
+        self.assertEqual(index.indexed, os.path.getsize(self.log))
+
+    def test_replaced_log(self):
+        write_lines(self.log, session(0, 100))
+        index = TimeIndex(self.log)
+        index.update()
+        os.rename(self.log, self.log + '.1')
+        write_lines(self.log, session(1000, 300))
+        self.check(TimeIndex(self.log))
+        self.check(index)
+
+    def test_interrupted_update(self):
+        write_lines(self.log, session(0, 300))
+        index = TimeIndex(self.log)
+        index.update()
+        indexed = index.indexed
+        write_lines(self.log, session(300, 300))
+        # an update that died while writing the new index
+        write_lines(index.path + '.tmp', ['partial'], mode='w')
+        index = TimeIndex(self.log)
+        self.assertEqual(index.indexed, indexed)
+        index.update()
+        self.check(index)
+        self.assertFalse(os.path.exists(index.path + '.tmp'))
+
+    def test_entries_past_indexed(self):
+        write_lines(self.log, session(0, 300))
+        index = TimeIndex(self.log)
+        index.update()
+        index.entries[-1] = index.indexed + 100
+        index._TimeIndex__save()
+        index = TimeIndex(self.log)
+        self.assertEqual(index.indexed, 0)
+        index.update()
+        self.check(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
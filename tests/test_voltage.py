@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Voltage rollups and discharge fit of voltage.py over small hub logs
+written to a temporary directory.
+
+    python -m pytest tests/test_voltage.py
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'Scripts'))
+
+from hub_log import ProximityScan, proximity_record  # noqa: E402
+from voltage import BadgeVoltage, VoltageMonitor  # noqa: E402
+
+START = 1554299803.0
+BADGE = 'F2:1E:84:04:C5:B5'
+
+
+def scan_line(log_timestamp, voltage, badge=BADGE, member_id=641):
+    scan = ProximityScan(badge, badge, member_id, log_timestamp - 5, (),
+                         voltage, log_timestamp, -1)
+    return json.dumps(proximity_record(scan)) + "\n"
+
+
+def discharge(start, count, step=20.0, volts=3.0, slope=-1e-5):
+    """(time, voltage) readings falling by slope volts per second"""
+    return [(start + number * step, volts + slope * number * step)
+            for number in range(count)]
+
+
+class BadgeVoltageTest(unittest.TestCase):
+    def test_linear_discharge(self):
+        rollup = BadgeVoltage()
+        for timestamp, voltage in discharge(START, 100):
+            rollup.add(timestamp, voltage)
+        self.assertAlmostEqual(rollup.slope(), -1e-5)
+        self.assertAlmostEqual(rollup.current(), 3.0 - 1e-5 * 99 * 20)
+
+    def test_out_of_order(self):
+        # a later log of the same hours, read after the first one
+        first = discharge(START, 180)
+        second = discharge(START - 7200, 180, volts=2.5, slope=0.0)
+        in_order = BadgeVoltage()
+        for timestamp, voltage in sorted(first + second):
+            in_order.add(timestamp, voltage)
+        out_of_order = BadgeVoltage()
+        for timestamp, voltage in first + second:
+            out_of_order.add(timestamp, voltage)
+        self.assertEqual(out_of_order.newest, in_order.newest)
+        for ours, theirs in zip(out_of_order.sums, in_order.sums):
+            self.assertAlmostEqual(ours, theirs, delta=abs(theirs) * 1e-9)
+        self.assertAlmostEqual(out_of_order.slope(), in_order.slope())
+        self.assertAlmostEqual(out_of_order.current(), in_order.current())
+
+    def test_old_readings_weigh_less(self):
+        rollup = BadgeVoltage()
+        rollup.add(START, 3.0)
+        rollup.add(START - 3600, 2.0)
+        self.assertAlmostEqual(rollup.sums[0], 1.5)
+        self.assertAlmostEqual(rollup.sums[2], 3.0 + 2.0 / 2)
+
+    def test_rollups(self):
+        rollup = BadgeVoltage()
+        for timestamp, voltage in [(120.0, 3.0), (150.0, 2.8),
+                                   (130.0, 2.9), (200.0, 2.7)]:
+            rollup.add(timestamp, voltage)
+        self.assertEqual(rollup.rollups(60), [(120, 2.8, 2.9, 2.8),
+                                              (180, 2.7, 2.7, 2.7)])
+        (start, low, mean, last), = rollup.rollups()
+        self.assertEqual((start, low, last), (None, 2.7, 2.7))
+        self.assertAlmostEqual(mean, 2.85)
+
+
+class VoltageMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='voltage_')
+        self.state = os.path.join(self.workdir, 'voltaje.json')
+        self.log = os.path.join(self.workdir, 'proximity_data.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def write(self, readings, mode='a'):
+        with open(self.log, mode) as log:
+            for timestamp, voltage in readings:
+                log.write(scan_line(timestamp, voltage))
+
+    def readings(self):
+        monitor = VoltageMonitor(self.state)
+        return monitor.badges[BADGE].readings
+
+    def test_incremental(self):
+        readings = discharge(START, 60)
+        self.write(readings[:40])
+        monitor = VoltageMonitor(self.state)
+        self.assertEqual(monitor.ingest(self.log), 40)
+        monitor.save()
+        self.write(readings[40:])
+        monitor = VoltageMonitor(self.state)
+        self.assertEqual(monitor.ingest(self.log), 20)
+        self.assertEqual(monitor.ingest(self.log), 0)
+        monitor.save()
+        self.assertEqual(self.readings(), 60)
+        whole = VoltageMonitor(os.path.join(self.workdir, 'whole.json'))
+        whole.ingest(self.log)
+        self.assertAlmostEqual(monitor.badges[BADGE].slope(),
+                               whole.badges[BADGE].slope())
+
+    def test_rotated_log(self):
+        self.write(discharge(START, 30))
+        monitor = VoltageMonitor(self.state)
+        monitor.ingest(self.log)
+        monitor.save()
+        # a new log, longer than the old one, in its place
+        os.rename(self.log, self.log + '.1')
+        self.write(discharge(START + 3600, 50, volts=2.9))
+        monitor = VoltageMonitor(self.state)
+        self.assertEqual(monitor.ingest(self.log), 50)
+        monitor.save()
+        self.assertEqual(self.readings(), 80)
+
+    def test_rewritten_log(self):
+        self.write(discharge(START, 30))
+        monitor = VoltageMonitor(self.state)
+        monitor.ingest(self.log)
+        monitor.save()
+        # same inode, new content
+        self.write(discharge(START + 3600, 50, volts=2.9), mode='r+')
+        monitor = VoltageMonitor(self.state)
+        self.assertEqual(monitor.ingest(self.log), 50)
+
+    def test_dying(self):
+        self.write(discharge(START, 200, slope=-5e-5))
+        monitor = VoltageMonitor(self.state)
+        monitor.ingest(self.log)
+        forecast, = monitor.forecast(2.6)
+        self.assertEqual(forecast.member_id, 641)
+        self.assertAlmostEqual(forecast.seconds_left,
+                               (2.6 - 3.0) / -5e-5 - 199 * 20, delta=1)
+        self.assertEqual(monitor.dying(2.6, 3600), [])
+        self.assertEqual(len(monitor.dying(2.6, 7200)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()